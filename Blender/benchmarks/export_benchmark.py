@@ -0,0 +1,349 @@
+'''
+Copyright (C) 2015 Andreas Esau
+andreasesau@gmail.com
+
+Created by Andreas Esau
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+### Export benchmark with synthetic rigs.
+###
+### blender -b --python export_benchmark.py -- --bones 10 50 --sprites 20 --anims 2 --output results.json
+###
+### Every parameter takes a list of values. All combinations are generated as synthetic sprite objects
+### and exported with the DragonBones and the COA json exporter. The atlas generation is timed on its own.
+### The stip.blend sample character is exported as a fixed baseline.
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import itertools
+import tempfile
+import statistics
+
+import bpy
+import addon_utils
+from mathutils import Vector
+
+addon_name = "coa_tools"
+blender_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+default_baseline = os.path.join(os.path.dirname(blender_dir),"Sample Files","stip.blend")
+case_params = ["bones","sprites","slots","slot_items","verts","shapekeys","anims","anim_length"]
+
+def get_arg_parser():
+    parser = argparse.ArgumentParser(prog="blender -b --python export_benchmark.py --",description="Benchmark the COA Tools exporters.")
+    parser.add_argument("--bones",type=int,nargs="+",default=[20])
+    parser.add_argument("--sprites",type=int,nargs="+",default=[20],help="sprites of type MESH")
+    parser.add_argument("--slots",type=int,nargs="+",default=[2],help="sprites of type SLOT")
+    parser.add_argument("--slot-items",type=int,nargs="+",default=[3],help="meshes per slot")
+    parser.add_argument("--verts",type=int,nargs="+",default=[64],help="vertices per mesh")
+    parser.add_argument("--shapekeys",type=int,nargs="+",default=[0],help="bone driven shape keys per mesh")
+    parser.add_argument("--anims",type=int,nargs="+",default=[2],help="animation collections")
+    parser.add_argument("--anim-length",type=int,nargs="+",default=[48],help="frames per animation")
+    parser.add_argument("--exporters",nargs="+",choices=["dragonbones","json","atlas"],default=["dragonbones","json","atlas"])
+    parser.add_argument("--repeat",type=int,default=3)
+    parser.add_argument("--baseline",default=default_baseline,help="blend file that is exported as baseline. pass an empty string to skip it")
+    parser.add_argument("--output",default=None,help="json file the results are written to. printed if not set")
+    return parser
+
+def enable_addon():
+    if blender_dir not in sys.path:
+        sys.path.append(blender_dir)
+    addon_utils.enable(addon_name,default_set=True)
+    return sys.modules[addon_name+".operators.export_dragonbones"]
+
+def clear_scene():
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj,do_unlink=True)
+    for data in [bpy.data.meshes,bpy.data.armatures,bpy.data.actions,bpy.data.materials,bpy.data.textures,bpy.data.images]:
+        for item in list(data):
+            item.use_fake_user = False
+            item.user_clear()
+            data.remove(item)
+
+def link_object(name,data,parent):
+    obj = bpy.data.objects.new(name,data)
+    bpy.context.scene.objects.link(obj)
+    obj.parent = parent
+    return obj
+
+def set_active(obj):
+    scene = bpy.context.scene
+    for scene_obj in scene.objects:
+        scene_obj.select = False
+    scene.objects.active = obj
+    obj.select = True
+
+### bones are built as a binary tree so the hierarchy has some depth
+def create_armature(sprite_object,bone_count):
+    armature = link_object("Armature",bpy.data.armatures.new("Armature"),sprite_object)
+    set_active(armature)
+    bpy.ops.object.mode_set(mode="EDIT")
+    bones = []
+    for i in range(bone_count):
+        bone = armature.data.edit_bones.new("Bone"+str(i))
+        if i > 0:
+            bone.parent = bones[(i-1)//2]
+            bone.head = bone.parent.tail
+        else:
+            bone.head = Vector((0,0,0))
+        bone.tail = bone.head + Vector((0.2*math.cos(i),0,0.5+0.2*math.sin(i)))
+        bones.append(bone)
+    bpy.ops.object.mode_set(mode="OBJECT")
+    return armature
+
+def create_image(name):
+    img = bpy.data.images.new(name,64,64,alpha=True)
+    img.pixels = [0.8,0.4,0.2,1.0] * (64*64)
+    return img
+
+### grid mesh with a material, texture, uvs and weights to two bones
+def create_mesh(name,img,vert_count,bone_count):
+    size = max(2,int(math.ceil(math.sqrt(vert_count))))
+    verts = []
+    faces = []
+    for y in range(size):
+        for x in range(size):
+            verts.append((x/(size-1),0,-y/(size-1)))
+    for y in range(size-1):
+        for x in range(size-1):
+            i = y*size+x
+            faces.append((i,i+1,i+size+1,i+size))
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata(verts,[],faces)
+    mesh.uv_textures.new("UVMap")
+    for loop in mesh.loops:
+        co = mesh.vertices[loop.vertex_index].co
+        mesh.uv_layers.active.data[loop.index].uv = (co[0],1+co[2])
+    for face in mesh.uv_textures.active.data:
+        face.image = img
+
+    mat = bpy.data.materials.new(name)
+    mat.use_transparency = True
+    mat.alpha = 0.0
+    tex = bpy.data.textures.new(name,"IMAGE")
+    tex.image = img
+    tex_slot = mat.texture_slots.add()
+    tex_slot.texture = tex
+    tex_slot.use_map_alpha = True
+    mesh.materials.append(mat)
+    return mesh
+
+def add_weights(obj,armature,index,bone_count):
+    if armature == None or bone_count == 0:
+        return
+    mod = obj.modifiers.new("Armature","ARMATURE")
+    mod.object = armature
+    for j,bone_index in enumerate([index % bone_count,(index+1) % bone_count]):
+        group = obj.vertex_groups.get("Bone"+str(bone_index)) or obj.vertex_groups.new("Bone"+str(bone_index))
+        for vert in obj.data.vertices:
+            weight = abs(vert.co[2]) if j == 0 else 1-abs(vert.co[2])
+            group.add([vert.index],weight,"ADD")
+
+### shape keys driven by the rotation of a bone
+def add_shapekeys(obj,armature,index,count,bone_count):
+    if count == 0:
+        return
+    obj.shape_key_add("Basis",from_mix=False)
+    for i in range(count):
+        shape = obj.shape_key_add("Key"+str(i),from_mix=False)
+        for point in shape.data:
+            point.co = point.co + Vector((0.05*(i+1),0,0.02*point.co[0]))
+        if armature != None and bone_count > 0:
+            fcurve = shape.driver_add("value")
+            fcurve.driver.type = "AVERAGE"
+            var = fcurve.driver.variables.new()
+            var.type = "TRANSFORMS"
+            var.targets[0].id = armature
+            var.targets[0].bone_target = "Bone"+str((index+i) % bone_count)
+            var.targets[0].transform_type = "ROT_Y"
+            var.targets[0].transform_space = "LOCAL_SPACE"
+
+def create_sprite(sprite_object,armature,name,index,params):
+    img = create_image(name)
+    mesh = create_mesh(name,img,params["verts"],params["bones"])
+    obj = link_object(name,mesh,armature if armature != None else sprite_object)
+    obj.location = Vector((0.3*(index % 10),-0.01*index,0.3*(index//10)))
+    obj["coa_sprite"] = True
+    add_weights(obj,armature,index,params["bones"])
+    add_shapekeys(obj,armature,index,params["shapekeys"],params["bones"])
+    return obj
+
+def create_slot(sprite_object,armature,name,index,params):
+    obj = create_sprite(sprite_object,armature,name,index,params)
+    meshes = [obj.data]
+    for i in range(1,params["slot_items"]):
+        meshes.append(create_mesh(name+"_"+str(i),create_image(name+"_"+str(i)),params["verts"],params["bones"]))
+    obj.coa_type = "SLOT"
+    for i,mesh in enumerate(meshes):
+        item = obj.coa_slot.add()
+        item.name = mesh.name
+        item.mesh = mesh
+        item.index = i
+        item["active"] = i == 0
+    return obj
+
+def get_object_action(obj,action_name):
+    action = bpy.data.actions.get(action_name) or bpy.data.actions.new(action_name)
+    action.use_fake_user = True
+    if obj.animation_data == None:
+        obj.animation_data_create()
+    obj.animation_data.action = action
+    return action
+
+### every animation keys all bones every 4 frames and the alpha and slot index of the sprites every 8 frames
+def create_animations(sprite_object,armature,sprites,params):
+    anims = sprite_object.coa_anim_collections
+    for name,frame_end in [("NO ACTION",0),("Restpose",1)]:
+        item = anims.add()
+        item.name = name
+        item.frame_start = 0
+        item.frame_end = frame_end
+    for i in range(params["anims"]):
+        item = anims.add()
+        item.name = "Anim"+str(i)
+        item.name_old = item.name
+        item.action_collection = True
+        item.frame_start = 0
+        item.frame_end = params["anim_length"]
+
+        if armature != None:
+            get_object_action(armature,item.name+"_"+armature.name)
+            for f in range(0,params["anim_length"]+1,4):
+                for j,pose_bone in enumerate(armature.pose.bones):
+                    pose_bone.rotation_mode = "XYZ"
+                    pose_bone.rotation_euler = (0,math.sin(f*0.1+j+i),0)
+                    pose_bone.location = (0.05*math.cos(f*0.1+j),0,0)
+                    pose_bone.keyframe_insert("rotation_euler",frame=f)
+                    pose_bone.keyframe_insert("location",frame=f)
+            armature.animation_data.action = None
+        for j,sprite in enumerate(sprites):
+            get_object_action(sprite,item.name+"_"+sprite.name)
+            for f in range(0,params["anim_length"]+1,8):
+                sprite.coa_alpha = 0.5+0.5*math.sin(f*0.2+j)
+                sprite.keyframe_insert("coa_alpha",frame=f)
+                if sprite.coa_type == "SLOT":
+                    sprite.coa_slot_index = (f//8) % len(sprite.coa_slot)
+                    sprite.keyframe_insert("coa_slot_index",frame=f)
+            sprite.animation_data.action = None
+    sprite_object.coa_anim_collections_index = 1
+
+def create_sprite_object(params):
+    clear_scene()
+    sprite_object = link_object("BenchSprite",None,None)
+    sprite_object["sprite_object"] = True
+    armature = None
+    if params["bones"] > 0:
+        armature = create_armature(sprite_object,params["bones"])
+    sprites = []
+    for i in range(params["sprites"]):
+        sprites.append(create_sprite(sprite_object,armature,"Sprite"+str(i),i,params))
+    for i in range(params["slots"]):
+        sprites.append(create_slot(sprite_object,armature,"Slot"+str(i),params["sprites"]+i,params))
+    create_animations(sprite_object,armature,sprites,params)
+    bpy.context.scene.update()
+    set_active(sprite_object)
+    return sprite_object
+
+def run_exporter(exporter,sprite_object,export_dir,db_module):
+    set_active(sprite_object)
+    filepath = os.path.join(export_dir,exporter,sprite_object.name+".json")
+    os.makedirs(os.path.dirname(filepath),exist_ok=True)
+    start = time.perf_counter()
+    if exporter == "dragonbones":
+        bpy.ops.coa_tools.export_dragon_bones(filepath=filepath,undo_free=True)
+    elif exporter == "json":
+        bpy.ops.object.export_to_json(filepath=filepath)
+    elif exporter == "atlas":
+        sprites = [obj for obj in db_module.get_children(bpy.context,sprite_object,[]) if obj.type == "MESH"]
+        start = time.perf_counter()
+        db_module.generate_texture_atlas(bpy.context,sprites,sprite_object.name+"_atlas",2048,2048,"AUTOMATIC",2)
+    return time.perf_counter() - start
+
+def get_timing(times):
+    return {"times":times,"min":min(times),"median":statistics.median(times),"max":max(times)}
+
+def get_scene_stats():
+    meshes = [obj for obj in bpy.context.scene.objects if obj.type == "MESH"]
+    return {"objects":len(bpy.context.scene.objects),"vertices":sum(len(obj.data.vertices) for obj in meshes)}
+
+### every measurement runs on a freshly generated or loaded scene
+def benchmark_case(params,exporter,repeat,export_dir,db_module):
+    times = []
+    for i in range(repeat):
+        sprite_object = create_sprite_object(params)
+        stats = get_scene_stats()
+        times.append(run_exporter(exporter,sprite_object,export_dir,db_module))
+    result = {"case":"synthetic","exporter":exporter,"params":params,"stats":stats}
+    result.update(get_timing(times))
+    return result
+
+def benchmark_baseline(filepath,exporter,repeat,export_dir,db_module):
+    results = []
+    bpy.ops.wm.open_mainfile(filepath=filepath)
+    names = [obj.name for obj in bpy.context.scene.objects if "sprite_object" in obj]
+    for name in names:
+        times = []
+        for i in range(repeat):
+            bpy.ops.wm.open_mainfile(filepath=filepath)
+            stats = get_scene_stats()
+            times.append(run_exporter(exporter,bpy.context.scene.objects[name],export_dir,db_module))
+        result = {"case":"baseline","exporter":exporter,"params":{"file":os.path.basename(filepath),"sprite_object":name},"stats":stats}
+        result.update(get_timing(times))
+        results.append(result)
+    return results
+
+def main():
+    args = get_arg_parser().parse_args(sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else [])
+    ### the benchmark replaces the scene and the exports run in undo free mode, which is meant for background Blender
+    if not bpy.app.background:
+        print("Run the benchmark in background mode: "+get_arg_parser().prog)
+        return
+    db_module = enable_addon()
+    export_dir = tempfile.mkdtemp(prefix="coa_benchmark_")
+    results = []
+    try:
+        values = [getattr(args,param) for param in case_params]
+        for combination in itertools.product(*values):
+            params = dict(zip(case_params,combination))
+            for exporter in args.exporters:
+                result = benchmark_case(params,exporter,args.repeat,export_dir,db_module)
+                print("{} {} {:.3f}s".format(exporter,json.dumps(params,sort_keys=True),result["median"]))
+                results.append(result)
+        if args.baseline != "" and os.path.isfile(args.baseline):
+            for exporter in args.exporters:
+                for result in benchmark_baseline(args.baseline,exporter,args.repeat,export_dir,db_module):
+                    print("{} baseline {} {:.3f}s".format(exporter,result["params"]["sprite_object"],result["median"]))
+                    results.append(result)
+    finally:
+        shutil.rmtree(export_dir,ignore_errors=True)
+
+    report = {"blender_version":bpy.app.version_string,"repeat":args.repeat,"results":results}
+    for mod in addon_utils.modules():
+        if mod.__name__ == addon_name:
+            report["addon_version"] = ".".join(str(i) for i in mod.bl_info["version"])
+    if args.output != None:
+        output_file = open(args.output,"w")
+        json.dump(report,output_file,indent="\t")
+        output_file.close()
+    else:
+        print(json.dumps(report,indent="\t"))
+
+if __name__ == "__main__":
+    main()
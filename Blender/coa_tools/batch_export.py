@@ -0,0 +1,216 @@
+'''
+Copyright (C) 2015 Andreas Esau
+andreasesau@gmail.com
+
+Created by Andreas Esau
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+### Headless batch export of all sprite objects in .blend files.
+###
+### blender -b --python batch_export.py -- <.blend files or directories> -o <output dir> [-j jobs] [--format dragonbones json]
+###
+### Every .blend file is exported by its own background Blender instance. The instances run in parallel.
+### This module is imported with the addon as well, so nothing is executed on import.
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+result_prefix = "COA_BATCH_RESULT "
+
+def get_script_args(argv):
+    if "--" in argv:
+        return argv[argv.index("--")+1:]
+    return []
+
+def get_arg_parser():
+    parser = argparse.ArgumentParser(prog="blender -b --python batch_export.py --",description="Export all sprite objects of .blend files.")
+    parser.add_argument("paths",nargs="*",help=".blend files or directories that are searched for .blend files")
+    parser.add_argument("-o","--output",default="export",help="output directory. each sprite object is exported into <output>/<blend name>/<sprite object>")
+    parser.add_argument("-j","--jobs",type=int,default=os.cpu_count() or 1,help="number of Blender instances that run in parallel")
+    parser.add_argument("--format",nargs="+",choices=["dragonbones","json"],default=["dragonbones"],help="export formats")
+    parser.add_argument("--blender",default=None,help="Blender executable used for the export instances")
+    parser.add_argument("--timeout",type=float,default=None,help="timeout in seconds per .blend file")
+    parser.add_argument("--bake",action="store_true",help="bake DragonBones animations")
+    parser.add_argument("--bake-interval",type=int,default=1)
+    parser.add_argument("--binary",action="store_true",help="export DragonBones 5.5 binary files")
+    parser.add_argument("--reduce-size",action="store_true",help="write DragonBones json files into one row")
+    parser.add_argument("--reduce-keyframes",action="store_true")
+    parser.add_argument("--atlas",action="store_true",help="generate DragonBones texture atlases")
+    parser.add_argument("--atlas-size",type=int,nargs=2,default=None,help="manual atlas page size. pages are sized automatically if not set")
+    parser.add_argument("--worker",action="store_true",help=argparse.SUPPRESS)
+    return parser
+
+### collect all .blend files. directories are searched recursively
+def find_blend_files(paths):
+    blend_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".blend"):
+                        blend_files.append(os.path.join(root,name))
+        elif path.endswith(".blend") and os.path.isfile(path):
+            blend_files.append(path)
+        else:
+            print("Skipping {}. Not a .blend file or directory.".format(path))
+    return blend_files
+
+def get_blender_binary(args):
+    if args.blender != None:
+        return args.blender
+    try:
+        import bpy
+        if bpy.app.binary_path != "":
+            return bpy.app.binary_path
+    except ImportError:
+        pass
+    return "blender"
+
+### arguments that are passed through to the export instances
+def get_worker_args(args,output_dir):
+    worker_args = ["--worker","--output",output_dir,"--bake-interval",str(args.bake_interval),"--format"] + args.format
+    for flag in ["bake","binary","reduce_size","reduce_keyframes","atlas"]:
+        if getattr(args,flag):
+            worker_args.append("--"+flag.replace("_","-"))
+    if args.atlas_size != None:
+        worker_args += ["--atlas-size",str(args.atlas_size[0]),str(args.atlas_size[1])]
+    return worker_args
+
+### export one .blend file in a background Blender instance and collect its results
+def run_blend_file(blender,blend_file,args):
+    name = os.path.splitext(os.path.basename(blend_file))[0]
+    output_dir = os.path.join(os.path.abspath(args.output),name)
+    cmd = [blender,"-b",blend_file,"--python",os.path.abspath(__file__),"--"] + get_worker_args(args,output_dir)
+    results = []
+    try:
+        proc = subprocess.run(cmd,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,universal_newlines=True,timeout=args.timeout)
+        output = proc.stdout
+        returncode = proc.returncode
+    except subprocess.TimeoutExpired as e:
+        output = e.output or ""
+        returncode = None
+    for line in output.splitlines():
+        if line.startswith(result_prefix):
+            results.append(json.loads(line[len(result_prefix):]))
+    if returncode != 0 and not any(result["status"] == "FAILED" for result in results):
+        error = "timeout" if returncode == None else "Blender exited with code {}".format(returncode)
+        results.append({"blend_file":blend_file,"sprite_object":None,"format":None,"status":"FAILED","error":error,"log":output[-4000:]})
+    return results
+
+def run_batch(args):
+    blend_files = find_blend_files(args.paths)
+    if len(blend_files) == 0:
+        print("No .blend files found.")
+        return 1
+    blender = get_blender_binary(args)
+    results = []
+    pool = ThreadPoolExecutor(max_workers=max(1,args.jobs))
+    jobs = [(blend_file,pool.submit(run_blend_file,blender,blend_file,args)) for blend_file in blend_files]
+    for blend_file,job in jobs:
+        file_results = job.result()
+        results += file_results
+        failed = len([result for result in file_results if result["status"] != "FINISHED"])
+        print("{}: {} exports, {} failed".format(blend_file,len(file_results),failed))
+    pool.shutdown()
+
+    os.makedirs(os.path.abspath(args.output),exist_ok=True)
+    report_file = open(os.path.join(os.path.abspath(args.output),"batch_report.json"),"w")
+    json.dump(results,report_file,indent="\t")
+    report_file.close()
+
+    failed = [result for result in results if result["status"] != "FINISHED"]
+    print("Exported {} of {} sprite objects from {} files.".format(len(results)-len(failed),len(results),len(blend_files)))
+    return 1 if len(failed) > 0 else 0
+
+### everything below runs inside the background Blender instance of a single .blend file
+def enable_addon():
+    import addon_utils
+    addon_path = os.path.dirname(os.path.abspath(__file__))
+    addon_name = os.path.basename(addon_path)
+    if os.path.dirname(addon_path) not in sys.path:
+        sys.path.append(os.path.dirname(addon_path))
+    addon_utils.enable(addon_name,default_set=True)
+
+def get_sprite_object_names(scene):
+    return [obj.name for obj in scene.objects if "sprite_object" in obj]
+
+def export_sprite_object(name,export_format,output_dir,args):
+    import bpy
+    scene = bpy.context.scene
+    obj = scene.objects[name]
+    if bpy.context.active_object != None and bpy.context.active_object.mode != "OBJECT":
+        bpy.ops.object.mode_set(mode="OBJECT")
+    for scene_obj in scene.objects:
+        scene_obj.select = False
+    scene.objects.active = obj
+    obj.select = True
+
+    export_dir = os.path.join(output_dir,name,export_format)
+    os.makedirs(export_dir,exist_ok=True)
+    filepath = os.path.join(export_dir,name+".json")
+    if export_format == "dragonbones":
+        atlas_size = "AUTOMATIC" if args.atlas_size == None else "MANUAL"
+        atlas_dimension = args.atlas_size if args.atlas_size != None else (1024,1024)
+        ### undo is not available in background mode. the undo free export restores the scene itself
+        result = bpy.ops.coa_tools.export_dragon_bones(filepath=filepath,bake_anim=args.bake,bake_interval=args.bake_interval,
+            export_format="BINARY" if args.binary else "JSON",reduce_size=args.reduce_size,reduce_keyframes=args.reduce_keyframes,
+            generate_atlas=args.atlas,atlas_size=atlas_size,atlas_dimension=atlas_dimension,undo_free=True)
+    else:
+        result = bpy.ops.object.export_to_json(filepath=filepath,reduce_keyframes=args.reduce_keyframes)
+    return filepath,result
+
+def run_worker(args):
+    import bpy
+    enable_addon()
+    blend_file = bpy.data.filepath
+    scene = bpy.context.scene
+    for scene_item in bpy.data.scenes:
+        if scene_item != scene:
+            for name in get_sprite_object_names(scene_item):
+                print(result_prefix+json.dumps({"blend_file":blend_file,"sprite_object":name,"format":None,"status":"SKIPPED","error":"sprite object is not in the active scene"}))
+
+    failed = False
+    for name in get_sprite_object_names(scene):
+        for export_format in args.format:
+            result = {"blend_file":blend_file,"sprite_object":name,"format":export_format}
+            try:
+                result["filepath"], status = export_sprite_object(name,export_format,args.output,args)
+                result["status"] = "FINISHED" if "FINISHED" in status else "FAILED"
+            except Exception as e:
+                traceback.print_exc()
+                result["status"] = "FAILED"
+                result["error"] = str(e)
+            failed = failed or result["status"] != "FINISHED"
+            print(result_prefix+json.dumps(result))
+            sys.stdout.flush()
+            ### reload the file so every export starts from the saved state
+            bpy.ops.wm.revert_mainfile()
+    return 1 if failed else 0
+
+def main():
+    args = get_arg_parser().parse_args(get_script_args(sys.argv))
+    if args.worker:
+        return run_worker(args)
+    return run_batch(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,948 @@
+'''
+Copyright (C) 2015 Andreas Esau
+andreasesau@gmail.com
+
+Created by Andreas Esau
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+### export helpers that don't depend on bpy. they only work on plain python data, numpy arrays and files
+
+import os
+import math
+import json
+import struct
+import csv
+import time
+import hashlib
+import functools
+import numpy as np
+from contextlib import contextmanager
+from collections import OrderedDict
+from shutil import copyfile
+from concurrent.futures import ThreadPoolExecutor
+
+### opt-in export profiling. phases are nested, each phase is stored with its full path e.g. "animation/walk/sample"
+class ExportProfiler():
+    def __init__(self):
+        self.enabled = False
+        self.phases = OrderedDict() ### path -> [wall time, call count]
+        self.stack = []
+    
+    def start(self):
+        self.enabled = True
+        self.phases.clear()
+        del self.stack[:]
+        self.start_time = time.perf_counter()
+    
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.phases["total"] = [time.perf_counter() - self.start_time,1]
+        
+    @contextmanager
+    def phase(self,name):
+        if not self.enabled:
+            yield
+            return
+        self.stack.append(name)
+        path = "/".join(self.stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.phases.setdefault(path,[0.0,0])
+            entry[0] += time.perf_counter() - start
+            entry[1] += 1
+            self.stack.pop()
+    
+    ### phases that take the most time, without their children
+    def get_summary(self,count=3):
+        self_times = OrderedDict()
+        for path in self.phases:
+            if path != "total":
+                self_times[path] = self.phases[path][0]
+        for path in self.phases:
+            parent = path.rpartition("/")[0]
+            if parent in self_times:
+                self_times[parent] -= self.phases[path][0]
+        top = sorted(self_times.items(),key=lambda item: item[1],reverse=True)[:count]
+        text = "Export took {:.2f}s".format(self.phases["total"][0])
+        if len(top) > 0:
+            text += " - " + ", ".join("{} {:.2f}s".format(path,duration) for path,duration in top)
+        return text
+    
+    ### write the report as json and csv next to the exported file
+    def write_report(self,filepath):
+        base_path = os.path.splitext(filepath)[0]+"_profile"
+        data = OrderedDict()
+        for path in self.phases:
+            data[path] = OrderedDict([("time",self.phases[path][0]),("calls",self.phases[path][1])])
+        json_file = open(base_path+".json","w")
+        json.dump(data,json_file,indent="\t")
+        json_file.close()
+        
+        csv_file = open(base_path+".csv","w",newline="")
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(["phase","time","calls"])
+        for path in self.phases:
+            csv_writer.writerow([path,"{:.6f}".format(self.phases[path][0]),self.phases[path][1]])
+        csv_file.close()
+        return base_path+".json"
+
+export_profiler = ExportProfiler()
+
+### decorator that records every call of a function as a profiler phase
+def profile_phase(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            with export_profiler.phase(name):
+                return func(*args,**kwargs)
+        return wrapper
+    return decorator
+
+### writes json incrementally into a file. produces the same output as json.dumps with indent="\t" or compact separators
+class JsonStreamWriter():
+    def __init__(self,file,compact=False):
+        self.file = file
+        self.compact = compact
+        self.stack = [] ### item count of each open container
+        
+    def write_separator(self):
+        if len(self.stack) == 0:
+            return
+        if self.stack[-1] > 0:
+            self.file.write(",")
+        if not self.compact:
+            self.file.write("\n" + "\t"*len(self.stack))
+        self.stack[-1] += 1
+    
+    def write_key(self,key):
+        self.write_separator()
+        if key != None:
+            if self.compact:
+                self.file.write(json.dumps(key)+":")
+            else:
+                self.file.write(json.dumps(key)+": ")
+        
+    def begin_object(self,key=None):
+        self.write_key(key)
+        self.file.write("{")
+        self.stack.append(0)
+        
+    def begin_array(self,key=None):
+        self.write_key(key)
+        self.file.write("[")
+        self.stack.append(0)
+    
+    def end(self,bracket):
+        count = self.stack.pop()
+        if count > 0 and not self.compact:
+            self.file.write("\n" + "\t"*len(self.stack))
+        self.file.write(bracket)
+    
+    def end_object(self):
+        self.end("}")
+        
+    def end_array(self):
+        self.end("]")
+    
+    ### write a complete value. dicts and lists get serialized in one chunk at the current depth
+    def write(self,value,key=None):
+        with export_profiler.phase("serialize"):
+            if self.compact:
+                chunk = json.dumps(value,separators=(',',':'))
+            else:
+                chunk = json.dumps(value,indent="\t",sort_keys=False).replace("\n","\n"+"\t"*len(self.stack))
+        with export_profiler.phase("file_write"):
+            self.write_key(key)
+            self.file.write(chunk)
+
+### export data is written into a temporary file next to the export file. the export file is only replaced if writing finished without an error
+@contextmanager
+def open_export_file(filepath,mode="w"):
+    tmp_path = filepath+".tmp"
+    try:
+        export_file = open(tmp_path,mode)
+        try:
+            yield export_file
+        finally:
+            export_file.close()
+        os.replace(tmp_path,filepath)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+### collects the sampled values of one animation channel and writes them as parallel times and values arrays
+class KeyframeTrack():
+    def __init__(self,step=False):
+        self.step = step
+        self.times = []
+        self.values = []
+    
+    def add(self,time,value):
+        self.times.append(time)
+        self.values.append(value)
+    
+    ### keep the first and the last key of every held value
+    def get_held_keys(self):
+        keys = []
+        last = len(self.values)-1
+        for i,value in enumerate(self.values):
+            if i == 0 or value != self.values[i-1] or (i < last and value != self.values[i+1]):
+                keys.append(i)
+        return keys
+    
+    ### keep only the keys that are needed to interpolate all samples linearly within the tolerance
+    def get_linear_keys(self,tolerance):
+        if len(self.values) == 0:
+            return []
+        times = np.array(self.times,dtype=np.float64)
+        values = np.array(self.values,dtype=np.float64).reshape((len(self.values),-1))
+        keys = [0]
+        for i in range(2,len(values)):
+            a = keys[-1]
+            factor = ((times[a+1:i] - times[a]) / (times[i] - times[a]))[:,None]
+            interpolated = values[a] + (values[i] - values[a]) * factor
+            if np.abs(interpolated - values[a+1:i]).max() > tolerance:
+                keys.append(i-1)
+        if len(values) > 1:
+            keys.append(len(values)-1)
+        ### a held value at the end of the track does not need a closing key
+        if len(keys) > 1 and self.values[keys[-1]] == self.values[keys[-2]]:
+            keys.pop()
+        return keys
+    
+    def to_dict(self,tolerance=None):
+        if self.step or tolerance == None:
+            keys = self.get_held_keys()
+        else:
+            keys = self.get_linear_keys(tolerance)
+        track = OrderedDict()
+        track["times"] = [self.times[i] for i in keys]
+        track["values"] = [self.values[i] for i in keys]
+        return track
+
+### keyframe reduction. removes keyframes that can be interpolated linearly from their neighbours.
+### all keyframes between a and b are checked at once against the linear interpolation of a and b
+def frames_interpolate(starts,values,displays,tolerances,a,b):
+    if displays is not None and np.any(displays[a+1:b] != displays[a]):
+        return False
+    factor = ((starts[a+1:b] - starts[a]) / (starts[b] - starts[a]))[:,None]
+    interpolated = values[a] + (values[b] - values[a]) * factor
+    return not np.any(np.abs(values[a+1:b] - interpolated) > tolerances)
+
+def reduce_frames(frames,values,tolerances,displays=None):
+    if len(frames) < 3:
+        return frames
+    
+    ### get absolute start frame of each keyframe
+    starts = []
+    start = 0
+    for frame in frames:
+        starts.append(start)
+        start += frame["duration"]
+    
+    start_array = np.array(starts,dtype=np.float64)
+    values = np.asarray(values,dtype=np.float64).reshape((len(frames),-1))
+    tolerances = np.asarray(tolerances,dtype=np.float64)
+    if displays is not None:
+        displays = np.asarray(displays)
+    keep = [0]
+    anchor = 0
+    for j in range(2,len(frames)):
+        if not frames_interpolate(start_array,values,displays,tolerances,anchor,j):
+            anchor = j-1
+            keep.append(anchor)
+    keep.append(len(frames)-1)
+    
+    ### extend duration of kept keyframes over the removed ones
+    reduced = []
+    for i,idx in enumerate(keep):
+        frame = frames[idx]
+        if i < len(keep)-1:
+            frame["duration"] = starts[keep[i+1]] - starts[idx]
+        reduced.append(frame)
+    return reduced
+
+def reduce_bone_frames(frames,tolerances):
+    values = []
+    for frame in frames:
+        transform = frame["transform"]
+        values.append([transform.get("x",0),transform.get("y",0),transform.get("skX",0),transform.get("scX",1),transform.get("scY",1)])
+    channel_tolerances = [tolerances["pos"],tolerances["pos"],tolerances["angle"],tolerances["scale"],tolerances["scale"]]
+    return reduce_frames(frames,values,channel_tolerances)
+
+def reduce_slot_frames(frames,tolerances):
+    values = []
+    displays = []
+    for frame in frames:
+        color = frame["color"]
+        values.append([color.get("rM",100),color.get("gM",100),color.get("bM",100),color.get("aM",100)])
+        displays.append(frame["displayIndex"])
+    return reduce_frames(frames,values,[tolerances["color"]]*4,displays)
+
+def reduce_ffd_frames(frames,tolerances):
+    vertex_count = max([len(frame.get("vertices",[])) for frame in frames])
+    values = np.zeros((len(frames),vertex_count),dtype=np.float64)
+    for i,frame in enumerate(frames):
+        vertices = frame.get("vertices",[])
+        values[i,:len(vertices)] = vertices
+    return reduce_frames(frames,values,[tolerances["ffd"]]*vertex_count)
+
+def reduce_animation_data(anim_data,tolerances):
+    for bone_data in anim_data["bone"]:
+        bone_data["frame"] = reduce_bone_frames(bone_data["frame"],tolerances)
+    for slot_data in anim_data["slot"]:
+        slot_data["frame"] = reduce_slot_frames(slot_data["frame"],tolerances)
+    for ffd_data in anim_data["ffd"]:
+        ffd_data["frame"] = reduce_ffd_frames(ffd_data["frame"],tolerances)
+
+### find free space for a rect with the best short side fit. returns the position or None
+def find_rect_position(free_rects,w,h):
+    best = None
+    for fx,fy,fw,fh in free_rects:
+        if w <= fw and h <= fh:
+            fit = (min(fw-w,fh-h),max(fw-w,fh-h))
+            if best == None or fit < best[0]:
+                best = (fit,fx,fy)
+    if best == None:
+        return None
+    return best[1],best[2]
+
+### split all free rects that overlap with the placed rect and remove free rects that are contained in others
+def split_free_rects(free_rects,x,y,w,h):
+    new_rects = []
+    for fx,fy,fw,fh in free_rects:
+        if x >= fx+fw or x+w <= fx or y >= fy+fh or y+h <= fy:
+            new_rects.append((fx,fy,fw,fh))
+            continue
+        if x > fx:
+            new_rects.append((fx,fy,x-fx,fh))
+        if x+w < fx+fw:
+            new_rects.append((x+w,fy,fx+fw-(x+w),fh))
+        if y > fy:
+            new_rects.append((fx,fy,fw,y-fy))
+        if y+h < fy+fh:
+            new_rects.append((fx,y+h,fw,fy+fh-(y+h)))
+    
+    pruned = []
+    for i,a in enumerate(new_rects):
+        contained = False
+        for j,b in enumerate(new_rects):
+            if i != j and a[0] >= b[0] and a[1] >= b[1] and a[0]+a[2] <= b[0]+b[2] and a[1]+a[3] <= b[1]+b[3]:
+                if a != b or i > j:
+                    contained = True
+                    break
+        if not contained:
+            pruned.append(a)
+    return pruned
+
+### maxrects packer. returns the bottom left pixel position of each size or None if they don't fit
+def pack_rects(sizes,width,height,padding=0):
+    free_rects = [(0,0,width+padding,height+padding)]
+    positions = [None]*len(sizes)
+    order = sorted(range(len(sizes)),key=lambda i: (max(sizes[i]),min(sizes[i])),reverse=True)
+    for i in order:
+        w = sizes[i][0] + padding
+        h = sizes[i][1] + padding
+        pos = find_rect_position(free_rects,w,h)
+        if pos == None:
+            return None
+        positions[i] = pos
+        free_rects = split_free_rects(free_rects,pos[0],pos[1],w,h)
+    return positions
+
+### maxrects packer that spills into new pages. returns (page,x,y) of each size and the page count or None if a size exceeds the page size
+def pack_rect_pages(sizes,width,height,padding=0):
+    pages = []
+    positions = [None]*len(sizes)
+    order = sorted(range(len(sizes)),key=lambda i: (max(sizes[i]),min(sizes[i])),reverse=True)
+    for i in order:
+        w = sizes[i][0] + padding
+        h = sizes[i][1] + padding
+        page = None
+        for j,free_rects in enumerate(pages):
+            pos = find_rect_position(free_rects,w,h)
+            if pos != None:
+                page = j
+                break
+        if page == None:
+            free_rects = [(0,0,width+padding,height+padding)]
+            pos = find_rect_position(free_rects,w,h)
+            if pos == None:
+                return None
+            pages.append(free_rects)
+            page = len(pages)-1
+        positions[i] = (page,pos[0],pos[1])
+        pages[page] = split_free_rects(pages[page],pos[0],pos[1],w,h)
+    return positions,len(pages)
+
+### get the smallest power of two page size up to the max size that all sprites fit in
+def fit_page_size(sizes,max_width,max_height,padding):
+    sprite_area = 0
+    for w,h in sizes:
+        sprite_area += w*h
+    candidates = []
+    width = 1
+    while width <= max_width:
+        height = 1
+        while height <= max_height:
+            candidates.append((width*height,max(width,height),width,height))
+            height *= 2
+        width *= 2
+    for area,side,width,height in sorted(candidates):
+        if area < sprite_area:
+            continue
+        positions = pack_rects(sizes,width,height,padding)
+        if positions != None:
+            return width,height,positions
+    return None
+
+### get the pixel bounds of all non transparent pixels. uv bounds of meshes using the image are always kept
+def get_trim_bounds(pixels,uv_bounds):
+    height,width = pixels.shape[:2]
+    visible = pixels[:,:,3] > 0
+    rows = np.nonzero(np.any(visible,axis=1))[0]
+    cols = np.nonzero(np.any(visible,axis=0))[0]
+    if len(rows) == 0:
+        x0,y0,x1,y1 = 0,0,1,1
+    else:
+        x0,y0,x1,y1 = cols[0],rows[0],cols[-1]+1,rows[-1]+1
+    if uv_bounds != None:
+        x0 = min(x0,int(math.floor(uv_bounds[0]*width)))
+        y0 = min(y0,int(math.floor(uv_bounds[1]*height)))
+        x1 = max(x1,int(math.ceil(uv_bounds[2]*width)))
+        y1 = max(y1,int(math.ceil(uv_bounds[3]*height)))
+    return max(x0,0),max(y0,0),min(x1,width),min(y1,height)
+
+texture_manifest = {}
+texture_copies = OrderedDict()
+
+### incremental texture copy. a manifest next to the exported textures stores size, mtime and hash of the copied source files
+def get_texture_manifest_path(texture_path):
+    return os.path.join(texture_path,"coa_texture_manifest.json")
+
+def load_texture_manifest(texture_path):
+    texture_manifest.clear()
+    texture_copies.clear()
+    manifest_path = get_texture_manifest_path(texture_path)
+    if os.path.isfile(manifest_path):
+        try:
+            manifest_file = open(manifest_path,"r")
+            texture_manifest.update(json.load(manifest_file))
+            manifest_file.close()
+        except ValueError:
+            pass
+
+def get_file_hash(path):
+    file_hash = hashlib.md5()
+    src_file = open(path,"rb")
+    for chunk in iter(lambda: src_file.read(1024*1024),b""):
+        file_hash.update(chunk)
+    src_file.close()
+    return file_hash.hexdigest()
+
+### copy a texture if it differs from the last exported version. returns its new manifest entry
+def sync_texture(src_path,dst_path):
+    stat = os.stat(src_path)
+    entry = {"src":src_path,"size":stat.st_size,"mtime":stat.st_mtime}
+    last_entry = texture_manifest.get(os.path.basename(dst_path))
+    if os.path.isfile(dst_path) and last_entry != None and last_entry["size"] == stat.st_size and os.path.getsize(dst_path) == stat.st_size:
+        if last_entry["src"] == src_path and last_entry["mtime"] == stat.st_mtime:
+            entry["hash"] = last_entry.get("hash")
+            return entry
+        entry["hash"] = get_file_hash(src_path)
+        if entry["hash"] == last_entry.get("hash"):
+            return entry
+    else:
+        entry["hash"] = get_file_hash(src_path)
+    copyfile(src_path,dst_path)
+    return entry
+
+### copy all changed textures in parallel and store the manifest
+def sync_textures(texture_path):
+    pool = ThreadPoolExecutor(max_workers=min(8,os.cpu_count() or 1))
+    jobs = []
+    for dst_path in texture_copies:
+        jobs.append((dst_path,pool.submit(sync_texture,texture_copies[dst_path],dst_path)))
+    for dst_path,job in jobs:
+        texture_manifest[os.path.basename(dst_path)] = job.result()
+    pool.shutdown()
+    texture_copies.clear()
+    
+    manifest_file = open(get_texture_manifest_path(texture_path),"w")
+    json.dump(texture_manifest,manifest_file,indent="\t")
+    manifest_file.close()
+
+### fingerprint helpers of the incremental export
+def update_hash(data_hash,*values):
+    data_hash.update(repr(values).encode("utf-8"))
+
+def update_hash_array(data_hash,collection,attr,size,dtype=np.float32):
+    values = np.empty(len(collection)*size,dtype=dtype)
+    collection.foreach_get(attr,values)
+    data_hash.update(values.tobytes())
+
+def update_action_hash(data_hash,action):
+    if action == None:
+        update_hash(data_hash,None)
+        return
+    update_hash(data_hash,action.name)
+    for fcurve in action.fcurves:
+        update_hash(data_hash,fcurve.data_path,fcurve.array_index,fcurve.extrapolation,fcurve.mute,[modifier.type for modifier in fcurve.modifiers])
+        update_hash_array(data_hash,fcurve.keyframe_points,"co",2)
+        update_hash_array(data_hash,fcurve.keyframe_points,"handle_left",2)
+        update_hash_array(data_hash,fcurve.keyframe_points,"handle_right",2)
+        update_hash(data_hash,[keyframe.interpolation for keyframe in fcurve.keyframe_points])
+
+def update_drivers_hash(data_hash,id_data):
+    if id_data == None or id_data.animation_data == None:
+        update_hash(data_hash,None)
+        return
+    for fcurve in id_data.animation_data.drivers:
+        driver = fcurve.driver
+        update_hash(data_hash,fcurve.data_path,fcurve.array_index,driver.type,driver.expression)
+        for var in driver.variables:
+            for target in var.targets:
+                update_hash(data_hash,var.name,var.type,target.id.name if target.id != None else None,target.bone_target,target.data_path,target.transform_type,target.transform_space)
+        update_hash_array(data_hash,fcurve.keyframe_points,"co",2)
+
+### mesh data of the exporter. vertices are converted to DragonBones pixel coordinates, x and negated z scaled by 100
+def convert_vertex_data(verts):
+    verts = np.asarray(verts,dtype=np.float64)
+    data = np.empty((len(verts),2),dtype=np.int64)
+    data[:,0] = np.trunc(verts[:,0]*100) ### x
+    data[:,1] = -np.trunc(verts[:,2]*100) ### negated z
+    return data.ravel().tolist()
+
+### read mesh topology and uvs in bulk in object mode. loops are returned in polygon order
+def get_mesh_arrays(mesh):
+    data = {}
+    data["vert_count"] = len(mesh.vertices)
+    data["edges"] = np.empty(len(mesh.edges)*2,dtype=np.int32)
+    mesh.edges.foreach_get("vertices",data["edges"])
+    data["edges"] = data["edges"].reshape((-1,2))
+    
+    loop_start = np.empty(len(mesh.polygons),dtype=np.int32)
+    loop_total = np.empty(len(mesh.polygons),dtype=np.int32)
+    mesh.polygons.foreach_get("loop_start",loop_start)
+    mesh.polygons.foreach_get("loop_total",loop_total)
+    offsets = np.cumsum(loop_total) - loop_total
+    loop_order = np.arange(loop_total.sum()) - np.repeat(offsets,loop_total) + np.repeat(loop_start,loop_total)
+    
+    loop_verts = np.empty(len(mesh.loops),dtype=np.int32)
+    loop_edges = np.empty(len(mesh.loops),dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index",loop_verts)
+    mesh.loops.foreach_get("edge_index",loop_edges)
+    data["loop_verts"] = loop_verts[loop_order]
+    data["loop_edges"] = loop_edges[loop_order]
+    
+    data["uvs"] = None
+    if mesh.uv_layers.active != None:
+        uvs = np.empty(len(mesh.loops)*2,dtype=np.float32)
+        mesh.uv_layers.active.data.foreach_get("uv",uvs)
+        data["uvs"] = uvs.reshape((-1,2))[loop_order]
+    return data
+
+### get edge information. vertex pairs of all boundary edges, edges that are used by exactly one face
+def get_edge_data(mesh_data):
+    face_count = np.bincount(mesh_data["loop_edges"],minlength=len(mesh_data["edges"]))
+    return mesh_data["edges"][face_count == 1].ravel().tolist()
+
+### get triangle information
+def get_triangle_data(mesh_data):
+    return mesh_data["loop_verts"].tolist()
+
+### get uv information. each vertex gets the uv of its first loop
+def get_uv_data(mesh_data):
+    uvs = np.zeros((mesh_data["vert_count"],2),dtype=np.float64)
+    if mesh_data["uvs"] is not None:
+        verts,first_loops = np.unique(mesh_data["loop_verts"],return_index=True)
+        uvs[verts] = mesh_data["uvs"][first_loops]
+    uvs[:,1] = 1 - uvs[:,1]
+    return uvs.ravel().tolist()
+
+### DragonBones 5.5 binary format. the file starts with the "DBDT" tag and the byte length of a json header, followed by the header and the binary data.
+### the header has the structure of DragonBones json data, but mesh and animation data are stored in shared arrays that the header references by offsets.
+### all offsets and counts are 16 bit integers, the arrays are stored in this order
+binary_array_types = [("int",np.int16),("float",np.float32),("frame_int",np.int16),("frame_float",np.float32),("frame",np.int16),("timeline",np.uint16)]
+binary_timeline_types = {"action":0,"bone":10,"display":20,"color":21,"ffd":22}
+binary_tween_types = {"none":0,"line":1,"quad_in":3,"quad_out":4,"quad_in_out":5}
+binary_action_types = {"action":0,"event":10,"sound":11}
+
+### DragonBones matrices are stored as [a,b,c,d,tx,ty]
+def transform_point(matrix,x,y,delta=False):
+    a,b,c,d,tx,ty = matrix
+    if delta:
+        return a*x + c*y, b*x + d*y
+    return a*x + c*y + tx, b*x + d*y + ty
+
+def invert_matrix(matrix):
+    a,b,c,d,tx,ty = matrix
+    det = a*d - b*c
+    if det == 0:
+        return (1.0,0.0,0.0,1.0,-tx,-ty)
+    a,b,c,d = d/det,-b/det,-c/det,a/det
+    return (a,b,c,d,-(a*tx + c*ty),-(b*tx + d*ty))
+
+### same as Transform.normalizeRadian of the runtimes
+def normalize_radian(value):
+    value = math.fmod(value + math.pi,math.pi*2)
+    if value > 0:
+        return value - math.pi
+    return value + math.pi
+
+### x, y, rotation, skew, scale x and scale y of a json transform like the runtimes parse it
+def get_transform_values(transform):
+    if "rotate" in transform or "skew" in transform:
+        rotation = normalize_radian(math.radians(transform.get("rotate",0)))
+        skew = normalize_radian(math.radians(transform.get("skew",0)))
+    else:
+        rotation = normalize_radian(math.radians(transform.get("skY",0)))
+        skew = normalize_radian(math.radians(transform.get("skX",0))) - rotation
+    return [transform.get("x",0),transform.get("y",0),rotation,skew,transform.get("scX",1),transform.get("scY",1)]
+
+def get_color_values(color):
+    channels = [("aM",100),("rM",100),("gM",100),("bM",100),("aO",0),("rO",0),("gO",0),("bO",0)]
+    return [int(round(color.get(channel,default))) for channel,default in channels]
+
+### start frame and frame count of the keyframes. keyframes that start after the end of the animation are never reached and get dropped
+def get_keyframe_ranges(frames,duration):
+    starts = []
+    start = 0
+    for frame in frames:
+        if start > duration:
+            break
+        starts.append(start)
+        start += frame.get("duration",1)
+    return [(start,end-start) for start,end in zip(starts,starts[1:]+[duration])]
+
+### receives the export data like JsonStreamWriter and converts the DragonBones 4.5 data of the exporter into the binary format.
+### the header is kept in memory while the mesh data of the skins and the animations are converted into the binary arrays as soon as they are written
+class DragonBonesBinaryWriter():
+    def __init__(self):
+        self.root = None
+        self.stack = [] ### open containers and their keys
+        self.arrays = OrderedDict([(name,[]) for name,dtype in binary_array_types])
+        self.meshes = {} ### (slot name, display name) -> mesh data that the ffd timelines need
+        self.actions = []
+        self.action_indices = {}
+        self.default_color_offset = None
+    
+    def add_value(self,value,key):
+        if len(self.stack) == 0:
+            self.root = value
+        elif isinstance(self.stack[-1][0],list):
+            self.stack[-1][0].append(value)
+        else:
+            self.stack[-1][0][key] = value
+    
+    def begin_object(self,key=None):
+        value = OrderedDict()
+        self.add_value(value,key)
+        self.stack.append((value,key))
+    
+    def begin_array(self,key=None):
+        value = []
+        self.add_value(value,key)
+        self.stack.append((value,key))
+    
+    def end_object(self):
+        self.stack.pop()
+    
+    def end_array(self):
+        self.stack.pop()
+    
+    ### skin slots and animations are converted, all other values are stored in the header as they are
+    def write(self,value,key=None):
+        with export_profiler.phase("serialize"):
+            parent_key = self.stack[-1][1] if len(self.stack) > 0 else None
+            if parent_key == "slot" and len(self.stack) > 2 and self.stack[-3][1] == "skin":
+                value = self.add_skin_slot(value)
+            elif parent_key == "animation":
+                value = self.add_animation(value,self.stack[-2][0])
+            self.add_value(value,key)
+    
+    ### the source data may be cached by the exporter, so it is copied instead of changed
+    def add_skin_slot(self,slot_data):
+        slot = OrderedDict(slot_data)
+        slot["display"] = []
+        for display_data in slot_data["display"]:
+            if display_data.get("type") == "mesh":
+                display = OrderedDict()
+                for key in display_data:
+                    if key not in ["vertices","uvs","triangles","edges","userEdges","weights","slotPose","bonePose"]:
+                        display[key] = display_data[key]
+                display["offset"] = self.add_mesh(slot_data["name"],display_data)
+                slot["display"].append(display)
+            else:
+                slot["display"].append(display_data)
+        return slot
+    
+    ### mesh header: vertex count, triangle count, offset of the vertices and uvs in the float array, weight offset and the triangle vertex indices
+    def add_mesh(self,slot_name,display):
+        int_array = self.arrays["int"]
+        float_array = self.arrays["float"]
+        vertex_count = len(display["vertices"])//2
+        mesh_offset = len(int_array)
+        int_array.extend([vertex_count,len(display["triangles"])//3,len(float_array),-1])
+        int_array.extend(display["triangles"])
+        float_array.extend(display["vertices"])
+        float_array.extend(display["uvs"])
+        
+        mesh = {"offset":mesh_offset,"vertex_count":vertex_count,"weight":None}
+        if "weights" in display:
+            int_array[mesh_offset+3] = len(int_array)
+            mesh["weight"] = self.add_weights(display,vertex_count)
+        self.meshes[(slot_name,display["name"])] = mesh
+        return mesh_offset
+    
+    ### weight header: bone count, offset in the float array and the bone indices. each vertex stores its bone count and the index of each bone in the weight header.
+    ### the float array gets the weight and the vertex position relative to the bone for each bone of a vertex
+    def add_weights(self,display,vertex_count):
+        int_array = self.arrays["int"]
+        float_array = self.arrays["float"]
+        weights = display["weights"]
+        vertices = display["vertices"]
+        bone_poses = display["bonePose"]
+        slot_pose = display["slotPose"]
+        bone_indices = [int(bone_poses[i]) for i in range(0,len(bone_poses),7)]
+        bone_matrices = [invert_matrix(bone_poses[i+1:i+7]) for i in range(0,len(bone_poses),7)]
+        int_array.extend([len(bone_indices),len(float_array)])
+        int_array.extend(bone_indices)
+        
+        pair_vertices = []
+        pair_bones = []
+        i = 0
+        for vertex in range(vertex_count):
+            x,y = transform_point(slot_pose,vertices[vertex*2],vertices[vertex*2+1])
+            bone_count = int(weights[i])
+            int_array.append(bone_count)
+            i += 1
+            for j in range(bone_count):
+                bone = bone_indices.index(int(weights[i]))
+                int_array.append(bone)
+                float_array.append(weights[i+1])
+                float_array.extend(transform_point(bone_matrices[bone],x,y))
+                pair_vertices.append(vertex)
+                pair_bones.append(bone)
+                i += 2
+        
+        ### ffd vertex offsets are transformed the same way, without translation
+        matrices = np.array([matrix[:4] for matrix in bone_matrices],dtype=np.float64).reshape((-1,4))
+        return {"slot_matrix":np.array(slot_pose[:4],dtype=np.float64),"pair_vertices":np.array(pair_vertices,dtype=np.int64),"pair_matrices":matrices[np.array(pair_bones,dtype=np.int64)]}
+    
+    ### animation header: duration, the offsets of the animation in the frame int, frame float and frame arrays and the timeline offsets of each bone and slot
+    def add_animation(self,anim_data,armature):
+        self.duration = max(int(anim_data["duration"]),1)
+        self.animation_offsets = [len(self.arrays["frame_int"]),len(self.arrays["frame_float"]),len(self.arrays["frame"])]
+        anim = OrderedDict()
+        for key in ["name","duration","playTimes"]:
+            anim[key] = anim_data[key]
+        anim["offset"] = self.animation_offsets
+        
+        action_frames = self.get_action_frames(anim_data.get("frame",[]))
+        if len(action_frames) > 0:
+            anim["action"] = self.add_timeline(action_frames,0,None,self.add_action_frame)
+            armature["actions"] = self.actions
+        
+        ### timelines without keyframes and ffd timelines of unknown meshes are skipped like the runtimes do
+        anim["bone"] = OrderedDict()
+        for bone_data in anim_data["bone"]:
+            if len(bone_data["frame"]) > 0:
+                timeline = self.add_timeline(bone_data["frame"],6,"frame_float",self.add_bone_frame)
+                anim["bone"][bone_data["name"]] = [binary_timeline_types["bone"],timeline]
+        
+        anim["slot"] = OrderedDict()
+        for slot_data in anim_data["slot"]:
+            if len(slot_data["frame"]) > 0:
+                timelines = anim["slot"].setdefault(slot_data["name"],[])
+                timelines += [binary_timeline_types["display"],self.add_timeline(slot_data["frame"],0,None,self.add_display_frame)]
+                timelines += [binary_timeline_types["color"],self.add_timeline(slot_data["frame"],1,"frame_int",self.add_color_frame)]
+        for ffd_data in anim_data["ffd"]:
+            self.ffd_mesh = self.meshes.get((ffd_data["slot"],ffd_data["name"]))
+            if self.ffd_mesh != None and len(ffd_data["frame"]) > 0:
+                timelines = anim["slot"].setdefault(ffd_data["slot"],[])
+                timelines += [binary_timeline_types["ffd"],self.add_timeline(ffd_data["frame"],0,"frame_float",self.add_ffd_frame)]
+        return anim
+    
+    ### timeline header: scale, offset, keyframe count, value count, value offset and the offset of each keyframe in the frame array.
+    ### the values of the keyframes follow each other in the given value array. offsets are relative to the offsets of the animation
+    def add_timeline(self,frames,value_count,value_array,add_frame):
+        timeline_array = self.arrays["timeline"]
+        ranges = get_keyframe_ranges(frames,self.duration)
+        value_offset = 0
+        if value_array == "frame_int":
+            value_offset = len(self.arrays["frame_int"]) - self.animation_offsets[0]
+        elif value_array == "frame_float":
+            value_offset = len(self.arrays["frame_float"]) - self.animation_offsets[1]
+        self.timeline_offset = len(timeline_array)
+        timeline_array.extend([100,0,len(ranges),value_count,value_offset])
+        self.prev_rotation = 0.0
+        for frame,(start,count) in zip(frames,ranges):
+            timeline_array.append(add_frame(frame,start,count) - self.animation_offsets[2])
+        return self.timeline_offset
+    
+    ### keyframe position and the tween type. the easing of quad tweens is stored in percent
+    def add_tween_frame(self,frame,start,count):
+        frame_array = self.arrays["frame"]
+        frame_offset = len(frame_array)
+        tween_easing = frame.get("tweenEasing")
+        if count <= 0 or tween_easing == None:
+            frame_array.extend([start,binary_tween_types["none"]])
+        elif tween_easing == 0:
+            frame_array.extend([start,binary_tween_types["line"]])
+        elif tween_easing < 0:
+            frame_array.extend([start,binary_tween_types["quad_in"],int(round(-tween_easing*100))])
+        elif tween_easing <= 1:
+            frame_array.extend([start,binary_tween_types["quad_out"],int(round(tween_easing*100))])
+        else:
+            frame_array.extend([start,binary_tween_types["quad_in_out"],int(round(tween_easing*100 - 100))])
+        return frame_offset
+    
+    ### bone keyframes store the whole transform. rotations take the shortest way from the previous keyframe
+    def add_bone_frame(self,frame,start,count):
+        frame_offset = self.add_tween_frame(frame,start,count)
+        values = get_transform_values(frame.get("transform",{}))
+        if start != 0:
+            values[2] = self.prev_rotation + normalize_radian(values[2] - self.prev_rotation)
+        self.prev_rotation = values[2]
+        self.arrays["frame_float"].extend(values)
+        return frame_offset
+    
+    def add_display_frame(self,frame,start,count):
+        frame_array = self.arrays["frame"]
+        frame_offset = len(frame_array)
+        frame_array.extend([start,frame.get("displayIndex",0)])
+        return frame_offset
+    
+    ### colors are stored in the int array. keyframes without a color share one default color
+    def add_color_frame(self,frame,start,count):
+        frame_offset = self.add_tween_frame(frame,start,count)
+        int_array = self.arrays["int"]
+        if len(frame.get("color",{})) > 0:
+            color_offset = len(int_array)
+            int_array.extend(get_color_values(frame["color"]))
+        else:
+            if self.default_color_offset == None:
+                self.default_color_offset = len(int_array)
+                int_array.extend(get_color_values({}))
+            color_offset = self.default_color_offset
+        self.arrays["frame_int"].append(color_offset)
+        return frame_offset
+    
+    ### ffd keyframes store an offset for every vertex, weighted meshes for every bone of a vertex relative to the bone.
+    ### the first keyframe adds the ffd header to the frame int array: mesh offset, deform count, value count, value offset and float offset
+    def add_ffd_frame(self,frame,start,count):
+        frame_float_array = self.arrays["frame_float"]
+        float_offset = len(frame_float_array)
+        frame_offset = self.add_tween_frame(frame,start,count)
+        mesh = self.ffd_mesh
+        
+        values = np.zeros(mesh["vertex_count"]*2,dtype=np.float64)
+        vertices = np.array(frame.get("vertices",[]),dtype=np.float64)
+        offset = frame.get("offset",0)
+        vertices = vertices[:max(len(values)-offset,0)]
+        values[offset:offset+len(vertices)] = vertices
+        weight = mesh["weight"]
+        if weight != None:
+            values = values.reshape((-1,2))
+            a,b,c,d = weight["slot_matrix"]
+            x = a*values[:,0] + c*values[:,1]
+            y = b*values[:,0] + d*values[:,1]
+            x = x[weight["pair_vertices"]]
+            y = y[weight["pair_vertices"]]
+            matrices = weight["pair_matrices"]
+            values = np.empty((len(x),2),dtype=np.float64)
+            values[:,0] = matrices[:,0]*x + matrices[:,2]*y
+            values[:,1] = matrices[:,1]*x + matrices[:,3]*y
+        frame_float_array.extend(values.ravel().tolist())
+        
+        if start == 0:
+            frame_int_array = self.arrays["frame_int"]
+            value_count = values.size
+            self.arrays["timeline"][self.timeline_offset+3] = len(frame_int_array) - self.animation_offsets[0]
+            frame_int_array.extend([mesh["offset"],value_count,value_count,0,float_offset - self.animation_offsets[1]])
+        return frame_offset
+    
+    def add_action(self,action_type,name):
+        key = (action_type,name)
+        if key not in self.action_indices:
+            self.action_indices[key] = len(self.actions)
+            self.actions.append(OrderedDict([("type",binary_action_types[action_type]),("name",name)]))
+        return self.action_indices[key]
+    
+    ### event, sound and action keyframes of the animation. the action timeline always starts with a keyframe on frame 0
+    def get_action_frames(self,frames):
+        starts = []
+        actions = []
+        start = 0
+        for frame in frames:
+            frame_actions = [self.add_action(action_type,frame[action_type]) for action_type in ["event","sound","action"] if frame.get(action_type,"") != ""]
+            if len(frame_actions) > 0:
+                if len(starts) > 0 and starts[-1] == start:
+                    actions[-1] += frame_actions
+                else:
+                    starts.append(start)
+                    actions.append(frame_actions)
+            start += frame.get("duration",1)
+        if len(starts) == 0:
+            return []
+        if starts[0] != 0:
+            starts.insert(0,0)
+            actions.insert(0,[])
+        ends = starts[1:] + [self.duration]
+        return [{"duration":end-start,"actions":frame_actions} for start,end,frame_actions in zip(starts,ends,actions)]
+    
+    def add_action_frame(self,frame,start,count):
+        frame_array = self.arrays["frame"]
+        frame_offset = len(frame_array)
+        frame_array.extend([start,len(frame["actions"])] + frame["actions"])
+        return frame_offset
+    
+    ### the runtimes read offsets above 32767 from the signed arrays as unsigned values, larger values can't be stored
+    def fits_format(self):
+        for name,dtype in binary_array_types:
+            values = self.arrays[name]
+            if len(values) > 0 and dtype != np.float32 and (min(values) < -32768 or max(values) > 65535):
+                return False
+        return True
+    
+    def write_file(self,file):
+        with export_profiler.phase("serialize"):
+            data = b""
+            offsets = []
+            for name,dtype in binary_array_types:
+                if dtype == np.float32:
+                    chunk = np.array(self.arrays[name],dtype="<f4").tobytes()
+                else:
+                    chunk = (np.array(self.arrays[name],dtype=np.int64) & 0xffff).astype("<u2").tobytes()
+                offsets += [len(data),len(chunk)]
+                ### typed arrays have to be aligned to 4 bytes
+                data += chunk + b"\0"*(-len(chunk) % 4)
+            
+            self.root["version"] = "5.5"
+            self.root["compatibleVersion"] = "5.5"
+            self.root["offset"] = offsets
+            header = json.dumps(self.root,separators=(',',':')).encode("utf-8")
+            header += b" "*(-(len(header)+12) % 4)
+        with export_profiler.phase("file_write"):
+            file.write(b"DBDT" + b"\0"*4)
+            file.write(struct.pack("<I",len(header)))
+            file.write(header)
+            file.write(data)
@@ -56,6 +56,24 @@ def remove_base_mesh(obj):
     bm = bmesh.update_edit_mesh(obj.data) 
     bpy.ops.object.mode_set(mode="OBJECT")
 
+### remove the base sprite vertices of obj from the given mesh data without entering edit mode
+def remove_base_mesh_data(obj,mesh):
+    if "coa_base_sprite" not in obj.vertex_groups:
+        return
+    v_group_idx = obj.vertex_groups["coa_base_sprite"].index
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+    bm.verts.ensure_lookup_table()
+    verts = []
+    for i,vert in enumerate(mesh.vertices):
+        for g in vert.groups:
+            if g.group == v_group_idx:
+                verts.append(bm.verts[i])
+                break
+    bmesh.ops.delete(bm,geom=verts,context=1)
+    bm.to_mesh(mesh)
+    bm.free()
+
 def fix_bone_roll(armature):
     mode = armature.mode
     bpy.ops.object.mode_set(mode="EDIT")
@@ -24,9 +24,12 @@ import json
 from bpy.props import FloatProperty, IntProperty, BoolProperty, StringProperty, CollectionProperty, FloatVectorProperty, EnumProperty, IntVectorProperty
 from collections import OrderedDict
 from .. functions import *
+from .. texture_encoder import TextureEncoder, png_filter_items, texture_format_items, texture_format_supported, get_image_pixels
+from .. export_utils import JsonStreamWriter, DragonBonesBinaryWriter, open_export_file, export_profiler, profile_phase, pack_rect_pages, fit_page_size, get_trim_bounds, reduce_animation_data, texture_manifest, texture_copies, load_texture_manifest, sync_textures, update_hash, update_hash_array, update_action_hash, update_drivers_hash, convert_vertex_data, get_mesh_arrays, get_edge_data, get_triangle_data, get_uv_data
 import math
 from mathutils import Vector,Matrix, Quaternion, Euler
-from shutil import copyfile
+import numpy as np
+import hashlib
 
 db_json = OrderedDict()
 db_json = {
@@ -94,200 +97,188 @@ bone_default_rot = {}
 default_vert_coords = {}
 texture_pathes = {}
 ignore_bones = []
+keyframe_index = {}
+bone_index_table = {}
+bone_transform_cache = {}
+export_cache = {} ### per sprite object cache of skin and animation data for incremental export
 
+bone_remap_matrix = Matrix() ### inverted posebone origin matrix
+bone_remap_matrix.row[0] = [0,0,1,0]
+bone_remap_matrix.row[1] = [1,0,0,0]
+bone_remap_matrix.row[2] = [0,1,0,0]
+bone_remap_matrix.row[3] = [0,0,0,1]
 
-def get_uv_bounds(uv):
-    top = 0
-    left = 1
-    right = 0
-    bottom = 1
-    for vert in uv.data:
-        if vert.uv.x < left:
-            left = float(vert.uv.x)
-        if vert.uv.x > right:
-            right = float(vert.uv.x)
-        if vert.uv.y > top:
-            top = float(vert.uv.y)
-        if vert.uv.y < bottom:
-            bottom = float(vert.uv.y)
-    scale_x = 1/(right-left)
-    scale_y = 1/(top-bottom)
-    return ((left,top),(right,bottom)),(scale_x,scale_y)
-
-def uv_unwrap(obj,unwrap_method,island_margin,atlas):
-    bpy.ops.object.mode_set(mode="EDIT")
-    bpy.ops.uv.unwrap(method='ANGLE_BASED', margin=island_margin)
-
-    bpy.ops.object.mode_set(mode="OBJECT")
-    
-    for vert in obj.data.uv_textures["COA_ATLAS"].data:
-        vert.image = atlas
-        
-    bpy.ops.object.mode_set(mode="EDIT")
-    if unwrap_method == "ANGLE_BASED":
-        bpy.ops.uv.unwrap(method='ANGLE_BASED', margin=island_margin)
-    elif unwrap_method == "SMART_UV":
-        bpy.ops.uv.smart_project(island_margin=island_margin,use_aspect=True, stretch_to_bounds=False)
 
-    bpy.ops.object.mode_set(mode="OBJECT")
+def get_mesh_image(mesh):
+    if len(mesh.materials) > 0 and mesh.materials[0] != None:
+        tex = mesh.materials[0].texture_slots[0].texture
+        return tex.image
 
-def generate_texture_atlas(context,objs,atlas_name,width,height,atlas_size,unwrap_method,island_margin):
-    ### create new atlas Image
-    atlas = bpy.data.images.new(atlas_name,width,height,alpha=True)
-    
-    ### deselect objects
-    for obj in context.scene.objects:
-        obj.select = False
-        
-    ### select given objects    
+### get all meshes of the given objects. sprites of type "SLOT" contribute all their slot meshes. meshes shared by several sprites are only listed once
+def get_atlas_meshes(objs,export_meshes=None):
+    if export_meshes == None:
+        export_meshes = {}
+    meshes = OrderedDict()
     for obj in objs:
-        mesh_data = []
-        ### get all mesh names if from type slot. Otherwise just append the obj mesh name 
         if obj.coa_type == "MESH":
-            mesh_data.append(obj.data.name)
+            meshes[obj.data.name] = obj.data
         elif obj.coa_type == "SLOT":
             for slot in obj.coa_slot:
-                mesh_data.append(slot.mesh.name)
-        ### loop over all mesh names        
-        for i,name in enumerate(mesh_data):
-            obj.data = bpy.data.meshes[name]
-            ob_data = obj.data.copy()
-            name = obj.name+"_atlas"
-            new_ob = obj.copy()
-            new_ob.data = ob_data
-            new_ob.name = name
-            new_ob.matrix_world = obj.matrix_world
-            context.scene.objects.link(new_ob)
-            
-            new_ob.select = True
-            context.scene.objects.active = new_ob
-            
-            
-            for group in new_ob.vertex_groups:
-                new_ob.vertex_groups.remove(group)
-            
-            ### generate vertex group with containing vertices    
-            group_name = obj.name + "_coa_slot_"+obj.data.name ### append vertex group with object and meshname
-            new_ob.vertex_groups.new(name=group_name)
-            bpy.ops.object.mode_set(mode="EDIT")  
-            bpy.ops.mesh.reveal()
-            bpy.ops.mesh.select_all(action='SELECT')
-            bpy.ops.object.vertex_group_assign()
-            bpy.ops.object.mode_set(mode="OBJECT")
-            if new_ob.active_shape_key != None:#new_ob.data.shape_keys != None and len(new_ob.data.shape_keys.key_blocks) > 0:
-                bpy.ops.object.shape_key_remove(all=True)  
-                
-            ### set active uv as default uv
-            for mat in obj.data.materials:
-                for tex_slot in mat.texture_slots:
-                    if tex_slot != None:
-                        if tex_slot.texture != None:
-                            tex_slot.uv_layer = new_ob.data.uv_textures.active.name
-                    
-    
-    ### join all selected objects into one 
-    bpy.ops.object.join()
-    obj = context.active_object
-    
-    ### generate new uv map item
-    bpy.ops.object.mode_set(mode="EDIT")
-    bpy.ops.mesh.reveal()
-    uv_map = obj.data.uv_textures.new(name="COA_ATLAS")
-    uv_map.active_render = True
-    obj.data.uv_textures.active = uv_map
-    
-    ### create uv layout
-    uv_unwrap(obj,unwrap_method,island_margin,atlas)
-    
-    ### separate mesh parts into single objects and copy uv data to original sprites
-    bpy.ops.object.mode_set(mode="EDIT")
-    bpy.ops.mesh.select_all(action='DESELECT')
-    bpy.ops.object.mode_set(mode="OBJECT")
+                mesh = export_meshes.get(slot.name,slot.mesh)
+                meshes[mesh.name] = mesh
+    return list(meshes.values())
+
+### the uv layer the sprite is textured with. the COA_ATLAS layer of a previous atlas is never used as source
+def get_source_uv_layer(mesh):
+    uv_layer = mesh.uv_layers.active
+    if uv_layer != None and uv_layer.name == "COA_ATLAS":
+        uv_layer = None
+        for layer in mesh.uv_layers:
+            if layer.name != "COA_ATLAS":
+                uv_layer = layer
+                break
+    return uv_layer
+
+### get the uv bounds of the source uv layer (left,bottom,right,top)
+def get_mesh_uv_bounds(mesh):
+    uv_layer = get_source_uv_layer(mesh)
+    if uv_layer == None:
+        return None
+    uvs = np.empty(len(uv_layer.data)*2,dtype=np.float32)
+    uv_layer.data.foreach_get("uv",uvs)
+    uvs = uvs.reshape((-1,2))
+    if len(uvs) == 0:
+        return None
+    return (uvs[:,0].min(),uvs[:,1].min(),uvs[:,0].max(),uvs[:,1].max())
+
+### transform the uvs of the source uv layer into the atlas region and store them in a COA_ATLAS uv layer
+def remap_atlas_uvs(mesh,atlas,region,width,height):
+    x,y,w,h = region
+    uv_layer = get_source_uv_layer(mesh)
+    if uv_layer == None:
+        return
+    uvs = np.empty(len(uv_layer.data)*2,dtype=np.float32)
+    uv_layer.data.foreach_get("uv",uvs)
+    uvs = uvs.reshape((-1,2))
+    uvs[:,0] = (x + uvs[:,0]*w) / width
+    uvs[:,1] = (y + uvs[:,1]*h) / height
     
-    tmp_sprites = []
-    for i,group in enumerate(obj.vertex_groups):
-        tmp_sprite = None
-        for vert in obj.data.vertices:
-            for group2 in vert.groups:
-                if group2.group == group.index:
-                    vert.select = True
-        ### separate mesh
-        bpy.ops.object.mode_set(mode="EDIT")
-        bpy.ops.mesh.separate(type='SELECTED')
-        bpy.ops.object.mode_set(mode="OBJECT")
-        
-        ### set proper selection to copy uv data
-        obj.select = False
-        tmp_sprite = bpy.context.selected_objects[0]
-        tmp_sprites.append(tmp_sprite)
-        context.scene.objects.active = tmp_sprite
-        sprite = bpy.data.objects[group.name.split("_coa_slot_")[0]]
-        sprite.data = bpy.data.meshes[group.name.split("_coa_slot_")[1]]
-        sprite.select = True
-        
-        ### calc autoatic texture size
-        if i == 0 and atlas_size == "AUTOMATIC":
-            bounds,atlas_scale = get_uv_bounds(tmp_sprite.data.uv_layers["COA_ATLAS"])
-            image_size = tmp_sprite.data.uv_textures[0].data[0].image.size
-            width = image_size[0] * atlas_scale[0]
-            height = image_size[1] * atlas_scale[1]
-            atlas.generated_width = width
-            atlas.generated_height = height
-        
-        ### generate new atlas uv layout and make it active for final sprites
-        if "COA_ATLAS" in sprite.data.uv_textures:
-            uv_map = sprite.data.uv_textures["COA_ATLAS"]
-        else:    
-            uv_map = sprite.data.uv_textures.new(name="COA_ATLAS")
-        sprite.data.uv_textures.active = uv_map
-        
-        ### copy uv data from tmp sprites to original sprite
-        bpy.ops.object.join_uvs()
-        
-        ### assign atlas texture to verts in edit mode
-        for vert in sprite.data.uv_textures.active.data:
-            vert.image = atlas
-        
-        ### restore selections
-        context.scene.objects.active = obj
-        obj.select = True
-        tmp_sprite.select = False
-        sprite.select = False
-        
-        
-        
-        ### delete tmp sprite
-        #bpy.context.scene.objects.unlink(tmp_sprite)
-        #bpy.data.objects.remove(tmp_sprite)
+    if "COA_ATLAS" in mesh.uv_textures:
+        uv_map = mesh.uv_textures["COA_ATLAS"]
+    else:
+        uv_map = mesh.uv_textures.new(name="COA_ATLAS")
+    mesh.uv_textures.active = uv_map
+    mesh.uv_layers["COA_ATLAS"].data.foreach_set("uv",uvs.ravel())
     
-    obj = context.active_object
-    bpy.context.scene.objects.unlink(obj)
-    bpy.data.objects.remove(obj)
+    ### assign atlas texture to faces
+    for face in uv_map.data:
+        face.image = atlas
+
+### pack all sprite images into atlas pages and remap the sprite uvs into their atlas region. returns the pages and the page name of each textured mesh
+@profile_phase("atlas")
+def generate_texture_atlas(context,objs,atlas_name,width,height,atlas_size,padding,export_meshes=None):
+    meshes = get_atlas_meshes(objs,export_meshes)
     
-    ####
-    for obj in context.scene.objects:
-        obj.select = False
-    for obj in tmp_sprites:
-        obj.select = True
-        context.scene.objects.active = obj
+    ### collect all images that have to be packed and the uv bounds of the meshes that use them
+    images = []
+    uv_bounds = {}
+    for mesh in meshes:
+        img = get_mesh_image(mesh)
+        if img != None:
+            if img not in images:
+                images.append(img)
+                uv_bounds[img.name] = None
+            bounds = get_mesh_uv_bounds(mesh)
+            if bounds != None:
+                if uv_bounds[img.name] != None:
+                    bounds = (min(bounds[0],uv_bounds[img.name][0]),min(bounds[1],uv_bounds[img.name][1]),max(bounds[2],uv_bounds[img.name][2]),max(bounds[3],uv_bounds[img.name][3]))
+                uv_bounds[img.name] = bounds
     
+    ### trim images to their visible pixels. pixel identical images share one atlas region
+    sources = []
+    source_hashes = {}
+    image_sources = {}
+    for img in images:
+        pixels = get_image_pixels(img)
+        x0,y0,x1,y1 = get_trim_bounds(pixels,uv_bounds[img.name])
+        trimmed = np.ascontiguousarray(pixels[y0:y1,x0:x1])
+        key = (hashlib.md5(trimmed.tobytes()).hexdigest(),trimmed.shape)
+        if key not in source_hashes:
+            source_hashes[key] = len(sources)
+            sources.append(trimmed)
+        image_sources[img.name] = (source_hashes[key],x0,y0)
+    sizes = [(source.shape[1],source.shape[0]) for source in sources]
     
-    bpy.ops.object.join()
-    obj = context.active_object
+    ### pack sources into pages of the given size. spill into new pages when a page is full
+    packed = pack_rect_pages(sizes,width,height,padding)
+    if packed == None:
+        return None
+    positions,page_count = packed
+    ### there is always one page. meshes without an image texture reference it as well
+    page_count = max(page_count,1)
+    page_sizes = [(width,height)]*page_count
     
-    ### bake texture into new uv layout
-    for vert in obj.data.uv_textures["COA_ATLAS"].data:
-        vert.image = atlas
+    ### shrink automatic sized pages to the smallest power of two that fits their sprites
+    if atlas_size == "AUTOMATIC":
+        for page in range(page_count):
+            idxs = [i for i in range(len(sizes)) if positions[i][0] == page]
+            fit = fit_page_size([sizes[i] for i in idxs],width,height,padding)
+            if fit != None:
+                page_sizes[page] = (fit[0],fit[1])
+                for i,pos in zip(idxs,fit[2]):
+                    positions[i] = (page,pos[0],pos[1])
     
-    context.scene.render.bake_type = "TEXTURE"
-    bpy.ops.object.bake_image()
-    bpy.context.scene.update()
+    ### blit all trimmed images into the page buffers
+    pages = []
+    for page in range(page_count):
+        page_width,page_height = page_sizes[page]
+        pixels = np.zeros((page_height,page_width,4),dtype=np.float32)
+        for source,size,pos in zip(sources,sizes,positions):
+            if pos[0] == page:
+                x,y = pos[1],pos[2]
+                pixels[y:y+size[1],x:x+size[0]] = source
+        
+        name = atlas_name
+        if page_count > 1:
+            name = atlas_name+"_"+str(page)
+        if name in bpy.data.images:
+            atlas = bpy.data.images[name]
+            atlas.scale(page_width,page_height)
+        else:
+            atlas = bpy.data.images.new(name,page_width,page_height,alpha=True)
+        atlas.pixels = pixels.ravel().tolist()
+        pages.append(atlas)
     
-    bpy.context.scene.objects.unlink(obj)
-    bpy.data.objects.remove(obj)
+    ### atlas region of each image. offset by the trimmed pixels so uvs stay correct
+    regions = {}
+    for img in images:
+        idx,trim_x,trim_y = image_sources[img.name]
+        page,x,y = positions[idx]
+        regions[img.name] = (page,(x-trim_x,y-trim_y,img.size[0],img.size[1]))
     
-        
+    ### remap uvs with an affine transform into the atlas region
+    mesh_pages = {}
+    for mesh in meshes:
+        img = get_mesh_image(mesh)
+        if img != None:
+            page,region = regions[img.name]
+            atlas = pages[page]
+            remap_atlas_uvs(mesh,atlas,region,atlas.size[0],atlas.size[1])
+            mesh_pages[mesh.name] = atlas.name
+    return pages,mesh_pages
+
 
+### write the texture atlas json of an atlas page next to it. the whole page is one sub texture that displays reference by their path
+def write_atlas_page_data(atlas,atlas_path):
+    data = OrderedDict()
+    data["name"] = atlas.name
+    data["imagePath"] = os.path.basename(atlas_path)
+    data["width"] = atlas.size[0]
+    data["height"] = atlas.size[1]
+    data["SubTexture"] = [OrderedDict([("name","sprites/"+atlas.name),("x",0),("y",0),("width",atlas.size[0]),("height",atlas.size[1])])]
+    atlas_file = open(os.path.splitext(atlas_path)[0]+"_tex.json","w")
+    json.dump(data,atlas_file,indent="\t")
+    atlas_file.close()
 
 def get_shapekey_driver(obj):
     bone_drivers = []
@@ -320,223 +311,297 @@ def get_sprite_driver(obj):
     return armature, bone_drivers
 
 
+### build a keyframe index per action once. maps fcurve data paths and bone names to their keyed frames
+def get_keyframe_index(action):
+    if action.name not in keyframe_index:
+        index = {"data_path":{},"bone":{},"all":set()}
+        for fcurve in action.fcurves:
+            if fcurve.data_path not in index["data_path"]:
+                index["data_path"][fcurve.data_path] = set()
+            frames = index["data_path"][fcurve.data_path]
+            for keyframe in fcurve.keyframe_points:
+                frames.add(keyframe.co[0])
+            index["all"] |= frames
+        keyframe_index[action.name] = index
+    return keyframe_index[action.name]
+
+def get_bone_keyframes(bone,action):
+    index = get_keyframe_index(action)
+    if bone.name not in index["bone"]:
+        frames = set()
+        for data_path in index["data_path"]:
+            if bone.name in data_path:
+                frames |= index["data_path"][data_path]
+        index["bone"][bone.name] = frames
+    return index["bone"][bone.name]
+
 def get_bone_keyframe_pos(armature, bones):
     action = None
-    keyframes = []    
+    keyframes = set()
     if armature != None:
         if armature.animation_data != None and armature.animation_data.action != None:
             action = armature.animation_data.action
         
         if action != None:    
             for bone in bones:
-                for fcurve in action.fcurves:
-                    if bone.name in fcurve.data_path:
-                        for keyframe in fcurve.keyframe_points:
-                            if keyframe.co[0] not in keyframes:
-                                keyframes.append(keyframe.co[0])
-        keyframes = sorted(keyframes)
-    return keyframes
+                keyframes |= get_bone_keyframes(bone,action)
+    return sorted(keyframes)
     
 ### get objs and bones that are keyed on given frame    
 def bone_key_on_frame(bone,frame,action):
-    for fcurve in action.fcurves:
-        if bone.name in fcurve.data_path:
-            for keyframe in fcurve.keyframe_points:
-                if keyframe.co[0] == frame:
-                    return True
-    return False            
+    return frame in get_bone_keyframes(bone,action)
 
 def sprite_key_on_frame(sprite,frame,action):
-    for fcurve in action.fcurves:
-        for keyframe in fcurve.keyframe_points:
-            if keyframe.co[0] == frame:
-                return True
-    return False
-
-def get_animation_data(context,sprite_object,armature,bake_anim,bake_interval):
-    m = Matrix() ### inverted posebone origin matrix
-    m.row[0] = [0,0,1,0]
-    m.row[1] = [1,0,0,0]
-    m.row[2] = [0,1,0,0]
-    m.row[3] = [0,0,0,1]
+    return frame in get_keyframe_index(action)["all"]
+
+### returns the frames of a bone track that have to be written into the export
+def get_bone_track_frames(bone,action,anim,bake_anim,bake_interval):
+    frames = []
+    for f in range(0,anim.frame_end+1):
+        if (action != None and bone_key_on_frame(bone,f,action)) or (bake_anim and f%bake_interval == 0) or f == 0 or f == anim.frame_end:
+            frames.append(f)
+    return frames
+
+### returns the frames of a slot track that have to be written into the export
+def get_slot_track_frames(obj,action,anim,bake_anim,bake_interval):
+    ### get sprite property driver bones
+    arm, bones = get_sprite_driver(obj)
+    arm_action = None
+    if arm != None and arm.animation_data != None:
+        arm_action = arm.animation_data.action
     
-    data = []
+    frames = []
+    for f in range(0,anim.frame_end+1):
+        ### check if property is manipulated by a bone driver
+        bone_key = False
+        if arm != None and arm_action != None:
+            for bone in bones:
+                if bone_key_on_frame(bone,f,arm_action):
+                    bone_key = True
+                    break
+        if (action != None and sprite_key_on_frame(obj,f,action)) or (bake_anim and f%bake_interval == 0) or f == 0 or bone_key:
+            frames.append(f)
+    return frames
+
+### returns the frames of a ffd track that have to be written into the export
+def get_ffd_track_frames(obj,anim,bake_anim,bake_interval):
+    arm, bones = get_shapekey_driver(obj)
+    keyframes = set(get_bone_keyframe_pos(arm,bones))
+    
+    frames = []
+    for f in range(0,anim.frame_end+1):
+        if f in keyframes or f == 0 or f == anim.frame_end or (bake_anim and f%bake_interval == 0 and len(keyframes)>0):
+            frames.append(f)
+    return frames
+
+### collect all bone, slot and ffd tracks of an animation with the frames they need
+def get_animation_tracks(context,sprite_object,armature,anim,bake_anim,bake_interval):
+    tracks = {"bone":[],"slot":[],"ffd":[]}
+    
+    objs = get_children(context,sprite_object,ob_list=[])
+    for obj in objs:
+        if obj.animation_data != None:
+            action = obj.animation_data.action
+            if obj.type == "ARMATURE":
+                for bone in obj.data.bones:
+                    if bone.name not in ignore_bones:
+                        frames = get_bone_track_frames(bone,action,anim,bake_anim,bake_interval)
+                        tracks["bone"].append({"name":bone.name,"bone":bone,"frames":frames})
+            elif obj.type == "MESH":
+                frames = get_slot_track_frames(obj,action,anim,bake_anim,bake_interval)
+                tracks["slot"].append({"name":obj.name,"obj":obj,"frames":frames})
+    
+    ### only meshes with shapekeys can deform relative to their default vertex coords
+    for obj in objs:
+        if obj.type == "MESH" and obj.data.shape_keys != None:
+            frames = get_ffd_track_frames(obj,anim,bake_anim,bake_interval)
+            tracks["ffd"].append({"name":obj.name,"obj":obj,"frames":frames})
+    return tracks
+
+### evaluate each needed frame exactly once and store bone, slot and ffd data in a frame table
+def sample_animation_frames(context,armature,tracks,scale):
+    frame_table = {}
+    track_frames = {}
+    for track_type in tracks:
+        for track in tracks[track_type]:
+            for f in track["frames"]:
+                if f not in track_frames:
+                    track_frames[f] = []
+                track_frames[f].append((track_type,track))
+    
+    for f in sorted(track_frames):
+        with export_profiler.phase("frame_set"):
+            context.scene.frame_set(f)
+        bone_transform_cache.clear()
+        frame_data = {"bone":{},"slot":{},"ffd":{}}
+        for track_type,track in track_frames[f]:
+            if track_type == "bone":
+                bone = track["bone"]
+                pos = get_bone_pos(armature,bone,scale)
+                pos -= bone_default_pos[bone.name]
+                angle = get_bone_angle(armature,bone)
+                angle -= bone_default_rot[bone.name]
+                sca = get_bone_scale(armature,bone)
+                frame_data["bone"][track["name"]] = {"pos":pos,"angle":angle,"scale":sca}
+            elif track_type == "slot":
+                obj = track["obj"]
+                frame_data["slot"][track["name"]] = {"displayIndex":obj.coa_slot_index,"color":get_modulate_color(obj)}
+            elif track_type == "ffd":
+                with export_profiler.phase("ffd"):
+                    obj = track["obj"]
+                    mixed_verts = get_mixed_vertex_data(obj)
+                    coord_differences = mixed_verts - default_vert_coords[obj.name][:len(mixed_verts)]
+                    vertices = convert_vertex_data(coord_differences)
+                    ### frames without any deformation store no vertex data. deltas are tested after the integer conversion
+                    if any(vertices):
+                        frame_data["ffd"][track["name"]] = vertices
+                    else:
+                        frame_data["ffd"][track["name"]] = None
+        frame_table[f] = frame_data
+    return frame_table
+
+### set the duration of the last written keyframe by comparing to the new keyframe
+def append_keyframe(frames,frame_data):
+    if len(frames) > 0:
+        idx = len(frames)-1
+        frames[idx]["duration"] = frame_data["duration"] - frames[idx]["duration"] ### set duration of last keyframe
+    frames.append(frame_data)
+
+def get_bone_anim_data(track,frame_table):
+    bone_data = {}
+    bone_data["name"] = track["name"]
+    bone_data["frame"] = []
+    for f in track["frames"]:
+        sample = frame_table[f]["bone"][track["name"]]
+        frame_data = {}
+        frame_data["duration"] = f
+        frame_data["tweenEasing"] = 0
+        frame_data["transform"] = {}
+        
+        ### get bone position
+        pos = sample["pos"]
+        if pos != Vector((0,0)):
+            frame_data["transform"]["x"] = pos[0]
+            frame_data["transform"]["y"] = pos[1]
+        
+        ### get bone angle
+        angle = sample["angle"]
+        if angle != 0:
+            frame_data["transform"]["skY"] = angle
+            frame_data["transform"]["skX"] = angle
+        
+        ### get bone scale
+        sca = sample["scale"]
+        if sca != Vector((1.0,1.0,1.0)):
+            frame_data["transform"]["scX"] = sca[0]
+            frame_data["transform"]["scY"] = sca[1]
+        append_keyframe(bone_data["frame"],frame_data)
+    return bone_data
+
+def get_slot_anim_data(track,frame_table):
+    slot_data = {}
+    slot_data["name"] = track["name"]
+    slot_data["frame"] = []
+    for f in track["frames"]:
+        sample = frame_table[f]["slot"][track["name"]]
+        frame_data = {}
+        frame_data["duration"] = f
+        frame_data["displayIndex"] = sample["displayIndex"]
+        frame_data["color"] = {}
+        frame_data["tweenEasing"] = 0.0
+        
+        color_data = sample["color"]
+        for channel in ["rM","gM","bM","aM"]:
+            if color_data[channel] != 100:
+                frame_data["color"][channel] = color_data[channel]
+        append_keyframe(slot_data["frame"],frame_data)
+    return slot_data
+
+def get_ffd_anim_data(track,frame_table):
+    ffd_data = {}
+    ffd_data["name"] = texture_pathes[track["name"]]
+    ffd_data["slot"] = track["name"]
+    ffd_data["offset"] = 0
+    ffd_data["scale"] = 1
+    ffd_data["skin"] = ""
+    ffd_data["frame"] = []
+    deformed = False
+    for f in track["frames"]:
+        ffd_frame_data = {}
+        ffd_frame_data["duration"] = f
+        ffd_frame_data["tweenEasing"] = 0
+        vertices = frame_table[f]["ffd"][track["name"]]
+        if vertices != None:
+            ffd_frame_data["vertices"] = vertices
+            deformed = True
+        append_keyframe(ffd_data["frame"],ffd_frame_data)
+    ### skip ffd timelines that never deform the mesh
+    if not deformed:
+        return None
+    return ffd_data
+
+def get_anim_data(context,sprite_object,armature,anim,bake_anim,bake_interval,reduce_tolerances=None):
+    if anim.name in ["NO ACTION"]:
+        return None
     scale = 1/get_addon_prefs(context).sprite_import_export_scale
     anims = sprite_object.coa_anim_collections
-    for anim in anims:
-        anim_data = animation.copy()
-        anim_data["name"] = anim.name
-        anim_data["duration"] = anim.frame_end
-        anim_data["playTimes"] = 1
-        anim_data["bone"] = []
-        anim_data["slot"] = []
-        anim_data["ffd"] = []
-        if anim.name not in ["NO ACTION"]:
-            set_action(context,item=anims[1])
-            context.scene.update()
-            
-            set_action(context,item=anim)
-            context.scene.update()
-            objs = get_children(context,sprite_object,ob_list=[])
-            for obj in objs:
-                if obj.animation_data != None:# and obj.animation_data.action != None:
-                    action = None
-                    if obj.animation_data.action != None:
-                        action = obj.animation_data.action
-                    ### get keyframes for Bones (Position, Rotation, Scale)
-                    if obj.type == "ARMATURE":
-                        ### loop over all bones and get data
-                        for bone in obj.data.bones:
-                                
-                            pose_bone = armature.pose.bones[bone.name]
-                            if bone.name not in ignore_bones:
-                                bone_data = {}
-                                bone_data["name"] = bone.name
-                                bone_data["frame"] = []
-                                ### loop over action framerange
-                                #for f in range(0,anim.frame_end+1):
-                                for f in range(0,anim.frame_end+1):
-                                    bpy.context.scene.frame_set(f)
-                                    ### if bone has a keyframe on frame -> store data
-                                    if (action != None and (bone_key_on_frame(bone,f,action)) or (bake_anim and f%bake_interval == 0) or f == 0 or f == anim.frame_end):
-                                        
-                                        frame_data = {}
-                                        frame_data["duration"] = f
-                                        if len(bone_data["frame"]) > 0:
-                                            idx = len(bone_data["frame"])-1
-                                            bone_data["frame"][idx]["duration"] = f - bone_data["frame"][idx]["duration"] ### set duration of last keyframe
-                                        frame_data["tweenEasing"] = 0
-                                        #frame_data["curve"] = [0.25, 0.0, 0.75, 1.0]
-                                        frame_data["transform"] = {}
-                                        ### get bone position
-                                        
-                                        pos = get_bone_pos(armature,bone,scale)
-                                        pos -= bone_default_pos[bone.name]
-                                        if pos != Vector((0,0)):
-                                            frame_data["transform"]["x"] = pos[0]
-                                            frame_data["transform"]["y"] = pos[1]
-                                        
-                                        ### get bone angle    
-                                        angle = get_bone_angle(armature,bone)
-                                        angle -= bone_default_rot[bone.name]
-                                        if angle != 0:
-                                            frame_data["transform"]["skY"] = angle
-                                            frame_data["transform"]["skX"] = angle
-                                            
-                                        ### get bone scale
-                                        sca = get_bone_scale(armature,bone)
-                                        if sca != Vector((1.0,1.0,1.0)):
-                                            frame_data["transform"]["scX"] = sca[0]
-                                            frame_data["transform"]["scY"] = sca[1]
-                                        
-                                        bone_data["frame"].append(frame_data)
-                                anim_data["bone"].append(bone_data)          
-            
-                    ### get keyframes for slots (Color, Alpha, SlotIndex)
-                    elif obj.type == "MESH":
-                        slot_data = {}
-                        slot_data["name"] = obj.name
-                        slot_data["frame"] = []
-                        
-                        ### get sprite property driver bones
-                        arm, bones = get_sprite_driver(obj)
-                        arm_action = None
-                        if arm != None and arm.animation_data != None:
-                            arm_action = arm.animation_data.action
-                        
-                        ### loop over action framerange
-                        for f in range(0,anim.frame_end+1):
-                            bpy.context.scene.frame_set(f)
-                            
-                            ### check if property is manipulated by a bone driver
-                            bone_key = False
-                            if arm != None and arm_action != None:
-                                for bone in bones:
-                                    if bone_key_on_frame(bone,f,arm_action):
-                                        bone_key = True
-                                        break    
-                                    
-                            ### if slot has keyframe on frame -> store data
-                            if (action != None and sprite_key_on_frame(obj,f,action)) or (bake_anim and f%bake_interval == 0) or f == 0 or bone_key:
-                                frame_data = {}
-                                frame_data["duration"] = f
-                                if len(slot_data["frame"]) > 0:
-                                    idx = len(slot_data["frame"])-1
-                                    slot_data["frame"][idx]["duration"] = f - slot_data["frame"][idx]["duration"] ### set duration of last keyframe
-                                frame_data ["displayIndex"] = obj.coa_slot_index
-                                frame_data["color"] = {}
-                                frame_data["tweenEasing"] = 0.0
-                                #frame_data["curve"] = [0.5, 0.0, 0.5, 1.0]
-                                
-                                color_data = get_modulate_color(obj)
-
-                                if color_data["rM"] != 100:
-                                    frame_data["color"]["rM"] = color_data["rM"]
-                                if color_data["gM"] != 100:
-                                    frame_data["color"]["gM"] = color_data["gM"]
-                                if color_data["bM"] != 100:
-                                    frame_data["color"]["bM"] = color_data["bM"]
-                                if color_data["aM"] != 100:
-                                    frame_data["color"]["aM"] = color_data["aM"]
-                                slot_data["frame"].append(frame_data)   
-                        anim_data["slot"].append(slot_data)
-            
-            ### get shapekey deformation data
-            sprites = get_children(context,sprite_object,[])
-            for obj in sprites:
-                if obj.type == "MESH":
-                    arm, bones = get_shapekey_driver(obj)
-                    keyframes = get_bone_keyframe_pos(arm,bones)
-
-                    ffd_data = {}
-                    ffd_data["name"] = texture_pathes[obj.name]
-                    ffd_data["slot"] = obj.name
-                    ffd_data["offset"] = 0
-                    ffd_data["scale"] = 1
-                    ffd_data["skin"] = ""
-                    ffd_data["frame"] = []
-                    for f in range(0,anim.frame_end+1):
-                        bpy.context.scene.frame_set(f)
-                        
-                        if f in keyframes or f == 0 or f == anim.frame_end or (bake_anim and f%bake_interval == 0 and len(keyframes)>0):
-                            ffd_frame_data = {}
-                            ffd_frame_data["duration"] = f
-                            ffd_frame_data["tweenEasing"] = 0
-                            
-                            ### get the keyframe duration by comparing to last set keyframe
-                            if len(ffd_data["frame"]) > 0:
-                                idx = len(ffd_data["frame"])-1
-                                ffd_data["frame"][idx]["duration"] = f - ffd_data["frame"][idx]["duration"] ### set duration of last keyframe
-                            
-                            mixed_verts = get_mixed_vertex_data(obj)
-                            coord_differences = []
-                            for i,co in enumerate(mixed_verts):
-                                diff = Vector(co) - Vector(default_vert_coords[obj.name][i])
-                                coord_differences.append(diff)
-                            ffd_frame_data["vertices"] = convert_vertex_data(coord_differences)
-                                
-                            ffd_data["frame"].append(ffd_frame_data)
-                    anim_data["ffd"].append(ffd_data)  
-            
-            ### get event data             
-            for i,event in enumerate(anim.event):
-                if i == 0:
-                    if event.frame > 0:
-                        event_data = {}
-                        event_data["duration"] = event.frame
-                        anim_data["frame"].append(event_data)                
-                
+    
+    anim_data = animation.copy()
+    anim_data["name"] = anim.name
+    anim_data["duration"] = anim.frame_end
+    anim_data["playTimes"] = 1
+    anim_data["bone"] = []
+    anim_data["slot"] = []
+    anim_data["ffd"] = []
+    
+    set_action(context,item=anims[1])
+    context.scene.update()
+    
+    set_action(context,item=anim)
+    context.scene.update()
+    
+    ### sample all tracks in one pass over the frame range
+    with export_profiler.phase("sample"):
+        tracks = get_animation_tracks(context,sprite_object,armature,anim,bake_anim,bake_interval)
+        frame_table = sample_animation_frames(context,armature,tracks,scale)
+    
+    ### get keyframes for Bones (Position, Rotation, Scale)
+    for track in tracks["bone"]:
+        anim_data["bone"].append(get_bone_anim_data(track,frame_table))
+    
+    ### get keyframes for slots (Color, Alpha, SlotIndex)
+    for track in tracks["slot"]:
+        anim_data["slot"].append(get_slot_anim_data(track,frame_table))
+    
+    ### get shapekey deformation data
+    for track in tracks["ffd"]:
+        ffd_data = get_ffd_anim_data(track,frame_table)
+        if ffd_data != None:
+            anim_data["ffd"].append(ffd_data)
+    
+    ### remove redundant keyframes
+    if reduce_tolerances != None:
+        with export_profiler.phase("reduce"):
+            reduce_animation_data(anim_data,reduce_tolerances)
+    
+    ### get event data             
+    for i,event in enumerate(anim.event):
+        if i == 0:
+            if event.frame > 0:
                 event_data = {}
                 event_data["duration"] = event.frame
-                if i > 0:
-                    anim_data["frame"]["duration"] = event.frame - anim_data["frame"]["duration"]
-                
-                event_data["action"] = event.action
-                event_data["event"] = event.event
-                event_data["sound"] = event.sound
-                anim_data["frame"].append(event_data)        
-            data.append(anim_data)
-    return data                 
+                anim_data["frame"].append(event_data)                
+        
+        event_data = {}
+        event_data["duration"] = event.frame
+        if i > 0:
+            anim_data["frame"]["duration"] = event.frame - anim_data["frame"]["duration"]
+        
+        event_data["action"] = event.action
+        event_data["event"] = event.event
+        event_data["sound"] = event.sound
+        anim_data["frame"].append(event_data)
+    return anim_data
 
 def get_modulate_color(sprite):
     color = sprite.coa_modulate_color
@@ -557,62 +622,49 @@ def get_ik_data(armature,bone,const):
         data["chain"] = min(const.chain_count-1,1)
     return data
  
-def get_bone_index(armature,bone_name):
-    armature_bones = []
-    for bone in armature.data.bones:
-        if bone.name not in ignore_bones:
-            armature_bones.append(bone)
-    
-    for i,bone in enumerate(armature_bones):#enumerate(armature.data.bones):
-        if bone_name == bone.name:
-            return i
+### build the bone index table once per export. ignored bones are not counted
+def get_bone_index_table(armature):
+    if armature.name not in bone_index_table:
+        indices = OrderedDict()
+        for bone in armature.data.bones:
+            if bone.name not in ignore_bones:
+                indices[bone.name] = len(indices)
+        bone_index_table[armature.name] = indices
+    return bone_index_table[armature.name]
 
-### get weight data
+### get weight data and the bones that are used by the mesh
 def get_weight_data(obj,armature):
+    bone_indices = get_bone_index_table(armature)
+    bone_names = list(bone_indices)
+    
+    ### map vertex group indices to bone indices
+    group_bones = {}
+    for group in obj.vertex_groups:
+        if group.name in bone_indices:
+            group_bones[group.index] = bone_indices[group.name]
+    
     data = []
-    bone_names = []
-    bones = []
+    used_bones = set()
     for vert in obj.data.vertices:
-        groups = []
-        for group in vert.groups:
-            group_name = obj.vertex_groups[group.group].name
-            if group_name in armature.data.bones:
-                groups.append({"group":group,"group_name":group_name})
-        
-        data.append(len(groups))    
+        groups = [group for group in vert.groups if group.group in group_bones]
+        data.append(len(groups))
         for group in groups:
-            bone_index = get_bone_index(armature,group["group_name"])+1
-            data.append(bone_index)
-            bone_weight = group["group"].weight
-            data.append(bone_weight)
-            
-            if group["group_name"] not in bone_names:
-                bone_names.append(group["group_name"])
+            bone_index = group_bones[group.group]
+            data.append(bone_index+1)
+            data.append(group.weight)
+            used_bones.add(bone_index)
     
-    armature_bones = []
-    for bone in armature.data.bones:
-        if bone.name not in ignore_bones:
-            armature_bones.append(bone)   
-                
-    for i,bone in enumerate(armature_bones):#enumerate(armature.data.bones):
-        if bone.name in bone_names:
-            bone = armature.data.bones[bone.name]            
-            bones.append({"index":i,"bone":bone})
+    bones = []
+    for i in sorted(used_bones):
+        bones.append({"index":i,"bone":armature.data.bones[bone_names[i]]})
     return data, bones
                     
                 
     
 ### get skin data
 def get_skin_data(obj,tex_path,scale,armature,texture_atlas=False):
-    context = bpy.context
-    obj.select = True
-    context.scene.objects.active = obj
-    
     texture_pathes[obj.name] = tex_path
     
-    bpy.ops.object.mode_set(mode="EDIT")
-    bm = bmesh.from_edit_mesh(obj.data)
-    
     d = OrderedDict()
     d["type"] = "mesh"
     d["name"] = tex_path
@@ -628,20 +680,19 @@ def get_skin_data(obj,tex_path,scale,armature,texture_atlas=False):
     verts = get_mixed_vertex_data(obj,store_tmp=True)
     d["vertices"] = convert_vertex_data(verts)
     
-    bm = bmesh.from_edit_mesh(obj.data)
-    #d["vertices"] = get_vertex_data(bm)
-    d["edges"] = get_edge_data(bm)
-    d["triangles"] = get_triangle_data(bm)
-    d["uvs"] = get_uv_data(bm)
+    mesh_data = get_mesh_arrays(obj.data)
+    d["edges"] = get_edge_data(mesh_data)
+    d["triangles"] = get_triangle_data(mesh_data)
+    d["uvs"] = get_uv_data(mesh_data)
     if armature != None:
-        d["weights"] = get_weight_data(obj,armature)[0]
+        d["weights"], bones = get_weight_data(obj,armature)
     
         d["bonePose"] = []
         armature.data.pose_position = "REST"
         bpy.context.scene.update()
-        bones = get_weight_data(obj,armature)[1]
+        bone_transform_cache.clear()
         for bone in bones:
-            mat = get_bone_matrix(armature,bone["bone"],relative=False)
+            mat = get_bone_transform(armature,bone["bone"],relative=False)[0]
             d["bonePose"].append(bone["index"]+1)
             d["bonePose"].append(mat[0][0])
             d["bonePose"].append(mat[0][1])
@@ -651,6 +702,7 @@ def get_skin_data(obj,tex_path,scale,armature,texture_atlas=False):
             d["bonePose"].append(-mat[0][3] *scale )#pos y
         armature.data.pose_position = "POSE"    
         bpy.context.scene.update()
+        bone_transform_cache.clear()
         
         w = obj.matrix_local[0][0]
         x = obj.matrix_local[0][2]
@@ -667,41 +719,24 @@ def get_skin_data(obj,tex_path,scale,armature,texture_atlas=False):
     d["transform"]["scY"] = obj.matrix_local.to_scale()[0]
     d["transform"]["scX"] = obj.matrix_local.to_scale()[2]
     
-    bpy.ops.object.mode_set(mode="OBJECT")
-    
     display = OrderedDict()
     display["name"] = obj.name
     display["display"] = [d]
     return d
 
-### get mesh vertex corrseponding uv vertex        
-def uv_from_vert_first(uv_layer, v):
-    for l in v.link_loops:
-        uv_data = l[uv_layer]
-        return uv_data.uv
-    return None
-
-### get vertices information
-def convert_vertex_data(verts):
-    data = []
-    for vert in verts:
-        for i,coord in enumerate(vert):
-            if i in [0,2]:
-                multiplier = 1
-                if i == 2:
-                    multiplier = -1
-                data.append(multiplier*int(coord*100))
-    return data            
-    
+### get mixed shapekey coordinates in bulk as (vertex count x 3) float array
 def get_mixed_vertex_data(obj,store_tmp = False):
-    shapes = obj.data.shape_keys
-    verts = []
-    index = int(obj.active_shape_key_index)
-    shape_key = obj.shape_key_add("tmp_mixed_mesh",from_mix=True)
-    for vert in shape_key.data:
-        verts.append([vert.co[0],vert.co[1],vert.co[2]])
-    obj.shape_key_remove(shape_key)            
-    obj.active_shape_key_index = index
+    vert_count = len(obj.data.vertices)
+    verts = np.empty(vert_count*3,dtype=np.float32)
+    if obj.data.shape_keys == None:
+        obj.data.vertices.foreach_get("co",verts)
+    else:
+        index = int(obj.active_shape_key_index)
+        shape_key = obj.shape_key_add("tmp_mixed_mesh",from_mix=True)
+        shape_key.data.foreach_get("co",verts)
+        obj.shape_key_remove(shape_key)            
+        obj.active_shape_key_index = index
+    verts = verts.reshape((vert_count,3))
     if store_tmp:
         default_vert_coords[obj.name] = verts
     return verts    
@@ -718,50 +753,10 @@ def get_vertex_data(bm):
                 verts.append(multiplier*int(coord*100))
     return verts
 
-### get edge information
-def get_edge_data(bm):
-    edges = []
-    for edge in bm.edges:
-        #if edge.hide == False:
-        if edge.is_boundary:
-            for i,vert in enumerate(edge.verts):
-                edges.append(vert.index)
-    return edges
-                
-
-
-### get triangle information
-def get_triangle_data(bm):
-    triangles = []
-    for face in bm.faces:
-        #if face.hide == False:
-        for i,vert in enumerate(face.verts):
-            triangles.append(vert.index)
-    return triangles
-
-
-### get uv information
-def get_uv_data(bm):
-    uvs = []
-    uv_layer = bm.loops.layers.uv.active
-    for vert in bm.verts:
-        #if vert.hide == False:
-        uv_first = uv_from_vert_first(uv_layer,vert)
-        for i,val in enumerate(uv_first):
-            if i == 1:
-                uvs.append(-val + 1)
-            else:
-                uvs.append(val)
-    return uvs
-
 def get_bone_matrix(armature,bone,relative=True):
     pose_bone = armature.pose.bones[bone.name]
     
-    m = Matrix() ### inverted posebone origin matrix
-    m.row[0] = [0,0,1,0]
-    m.row[1] = [1,0,0,0]
-    m.row[2] = [0,1,0,0]
-    m.row[3] = [0,0,0,1]
+    m = bone_remap_matrix
     
     if bone.parent == None:
         mat_bone_space = m * pose_bone.matrix.copy()
@@ -788,22 +783,29 @@ def get_bone_matrix(armature,bone,relative=True):
     mat_bone_space = loc_mat * rot_mat * scale_mat
     
     return mat_bone_space
+
+### get the bone space matrix and its decomposition. cached until the scene gets evaluated again
+def get_bone_transform(armature,bone,relative=True):
+    key = (armature.name,bone.name,relative)
+    if key not in bone_transform_cache:
+        mat = get_bone_matrix(armature,bone,relative)
+        bone_transform_cache[key] = (mat,mat.decompose())
+    return bone_transform_cache[key]
         
 def get_bone_angle(armature,bone,relative=True):
-    loc, rot, scale = get_bone_matrix(armature,bone,relative).decompose()
-    compat_euler = Euler((0.0,0.0,math.pi),"XYZ")
+    loc, rot, scale = get_bone_transform(armature,bone,relative)[1]
     angle = -rot.to_euler().z  # negate angle to fit dragonbones angle
         
     return round(math.degrees(angle),2)
 
 def get_bone_pos(armature,bone,scale):
-    loc, rot, sca = get_bone_matrix(armature,bone).decompose()
+    loc, rot, sca = get_bone_transform(armature,bone)[1]
     
     pos_2d = Vector((loc[1],-loc[0])) * scale # flip x and y and negate x to fit dragonbones coordinate system
     return pos_2d 
 
 def get_bone_scale(armature,bone):
-    loc, rot, scale = get_bone_matrix(armature,bone).decompose()
+    loc, rot, scale = get_bone_transform(armature,bone)[1]
     return Vector((round(scale[0],2),round(scale[1],2),round(scale[2],2)))
 
 def get_max_bone_length(armature,scale):
@@ -874,7 +876,7 @@ def get_img_tex(obj):
         img = tex.image
         return img
 
-def save_texture(obj,texture_path):
+def save_texture(obj,texture_path,texture_encoder):
     if len(obj.material_slots) > 0:
         mat = obj.material_slots[0].material
         tex = mat.texture_slots[0].texture
@@ -885,18 +887,179 @@ def save_texture(obj,texture_path):
         
         file_name = src_path[src_path.rfind("/")+1:]
         dst_path = os.path.join(texture_path, file_name)
-        if os.path.isfile(dst_path):
-            os.remove(dst_path)
             
-        if os.path.isfile(src_path):
-            copyfile(src_path,dst_path)
+        ### files on disk are copied later by sync_textures if they changed since the last export. other images are encoded by the texture encoder
+        if os.path.isfile(src_path) and texture_encoder.copies_files():
+            texture_copies[dst_path] = src_path
         else:
-            img.save_render(dst_path)
+            texture_encoder.add(img,dst_path)
+            if file_name in texture_manifest:
+                del texture_manifest[file_name]
 
         rel_path = os.path.join("sprites",file_name[:file_name.rfind(".")])
         rel_path = rel_path.replace("\\","/")
         return rel_path
             
+### undo free export. the state the export changes is stored up front and restored afterwards
+def store_scene_state(context,sprite_object,armature,sprites):
+    state = {"frame":context.scene.frame_current,"active":context.active_object,"selected":[obj for obj in context.scene.objects if obj.select]}
+    state["anim_index"] = sprite_object.coa_anim_collections_index
+    state["actions"] = {}
+    for child in sprites:
+        if child.animation_data != None:
+            state["actions"][child.name] = child.animation_data.action
+    state["meshes"] = {}
+    state["sprites"] = {}
+    for sprite in sprites:
+        if sprite.type == "MESH":
+            state["meshes"][sprite.name] = sprite.data
+            state["sprites"][sprite.name] = (sprite.coa_alpha,Vector(sprite.coa_modulate_color),sprite.coa_sprite_frame,sprite.coa_slot_index)
+    state["pose"] = {}
+    if armature != None:
+        state["pose_position"] = armature.data.pose_position
+        for pose_bone in armature.pose.bones:
+            state["pose"][pose_bone.name] = (pose_bone.location.copy(),pose_bone.rotation_quaternion.copy(),pose_bone.rotation_euler.copy(),pose_bone.scale.copy())
+    return state
+
+def restore_scene_state(context,sprite_object,armature,sprites,state):
+    for child in sprites:
+        if child.name in state["actions"]:
+            child.animation_data.action = state["actions"][child.name]
+        elif child.animation_data != None:
+            ### set_action creates the animation data of sprites that had none
+            child.animation_data_clear()
+        if child.name in state["meshes"]:
+            child.data = state["meshes"][child.name]
+        if child.name in state["sprites"]:
+            alpha,color,sprite_frame,slot_index = state["sprites"][child.name]
+            child["coa_slot_index"] = slot_index
+            child.coa_sprite_frame = sprite_frame
+            child.coa_alpha = alpha
+            child.coa_modulate_color = color
+    sprite_object.coa_anim_collections_index = state["anim_index"]
+    if armature != None:
+        armature.data.pose_position = state["pose_position"]
+        for pose_bone in armature.pose.bones:
+            if pose_bone.name in state["pose"]:
+                pose_bone.location,pose_bone.rotation_quaternion,pose_bone.rotation_euler,pose_bone.scale = state["pose"][pose_bone.name]
+    context.scene.frame_set(state["frame"])
+    for obj in context.scene.objects:
+        obj.select = obj in state["selected"]
+    context.scene.objects.active = state["active"]
+
+### temporary copies of all sprite meshes. the export reads and modifies these instead of the meshes of the scene.
+### copies are added to export_meshes as soon as they exist, so they can be removed even if copying fails halfway
+def create_export_meshes(sprites,export_meshes):
+    for sprite in sprites:
+        if sprite.type == "MESH":
+            names = [sprite.data.name]
+            if sprite.coa_type == "SLOT":
+                names += [slot.name for slot in sprite.coa_slot]
+            for name in names:
+                if name not in export_meshes:
+                    export_meshes[name] = bpy.data.meshes[name].copy()
+            if sprite.data.coa_hide_base_sprite:
+                remove_base_mesh_data(sprite,export_meshes[sprite.data.name])
+            sprite.data = export_meshes[sprite.data.name]
+
+def remove_export_meshes(export_meshes):
+    for mesh in export_meshes.values():
+        bpy.data.meshes.remove(mesh,do_unlink=True)
+    export_meshes.clear()
+
+### incremental export. skin and animation data are reused when the fingerprint of their source data did not change since the last export
+def get_armature_fingerprint(armature):
+    data_hash = hashlib.md5()
+    if armature == None:
+        return data_hash.hexdigest()
+    update_hash(data_hash,armature.name,[tuple(row) for row in armature.matrix_local],ignore_bones)
+    for bone in armature.data.bones:
+        pose_bone = armature.pose.bones[bone.name]
+        parent_name = bone.parent.name if bone.parent != None else None
+        update_hash(data_hash,bone.name,parent_name,tuple(bone.head_local),tuple(bone.tail_local),[tuple(row) for row in bone.matrix_local],bone.use_inherit_rotation,bone.use_inherit_scale,pose_bone.rotation_mode)
+        for const in pose_bone.constraints:
+            target = getattr(const,"target",None)
+            update_hash(data_hash,const.type,const.mute,const.influence,target.name if target != None else None,getattr(const,"subtarget",None),getattr(const,"chain_count",None))
+    update_drivers_hash(data_hash,armature)
+    return data_hash.hexdigest()
+
+def get_mesh_fingerprint(obj):
+    data_hash = hashlib.md5()
+    mesh = obj.data
+    parent_name = obj.parent.name if obj.parent != None else None
+    update_hash(data_hash,obj.name,mesh.name,parent_name,obj.parent_bone,[tuple(row) for row in obj.matrix_local],[group.name for group in obj.vertex_groups])
+    update_hash_array(data_hash,mesh.vertices,"co",3)
+    update_hash_array(data_hash,mesh.loops,"vertex_index",1,dtype=np.int32)
+    update_hash_array(data_hash,mesh.polygons,"loop_total",1,dtype=np.int32)
+    if mesh.uv_layers.active != None:
+        update_hash_array(data_hash,mesh.uv_layers.active.data,"uv",2)
+    update_hash(data_hash,[[(group.group,group.weight) for group in vert.groups] for vert in mesh.vertices])
+    if mesh.shape_keys != None:
+        for shape in mesh.shape_keys.key_blocks:
+            update_hash(data_hash,shape.name,shape.value,shape.mute,shape.relative_key.name,shape.vertex_group,shape.slider_min,shape.slider_max)
+            update_hash_array(data_hash,shape.data,"co",3)
+        update_drivers_hash(data_hash,mesh.shape_keys)
+    update_drivers_hash(data_hash,obj)
+    return data_hash.hexdigest()
+
+def get_skin_fingerprint(obj,tex_path,scale,armature_fingerprint,texture_atlas):
+    data_hash = hashlib.md5()
+    if not texture_atlas:
+        size = tuple(get_img_tex(obj).size)
+    else:
+        size = tuple(bpy.data.images[tex_path.split("/")[1]].size)
+    update_hash(data_hash,get_mesh_fingerprint(obj),tex_path,size,scale,armature_fingerprint,texture_atlas)
+    return data_hash.hexdigest()
+
+### fingerprint of everything all animations depend on. rig, meshes, drivers, restpose and export options
+def get_anim_base_fingerprint(context,sprite_object,armature_fingerprint,options):
+    data_hash = hashlib.md5()
+    update_hash(data_hash,options,context.scene.coa_nla_mode,armature_fingerprint)
+    anims = sprite_object.coa_anim_collections
+    for child in get_children(context,sprite_object,ob_list=[]):
+        update_hash(data_hash,child.name,child.type)
+        if child.type == "MESH":
+            update_hash(data_hash,get_mesh_fingerprint(child),[slot.name for slot in child.coa_slot])
+        update_drivers_hash(data_hash,child)
+        if len(anims) > 1:
+            update_action_hash(data_hash,bpy.data.actions.get(anims[1].name+"_"+child.name))
+    return data_hash.hexdigest()
+
+def get_anim_fingerprint(context,sprite_object,anim,base_fingerprint):
+    data_hash = hashlib.md5()
+    update_hash(data_hash,base_fingerprint,anim.name,anim.frame_start,anim.frame_end)
+    update_hash(data_hash,[(event.frame,event.action,event.event,event.sound) for event in anim.event])
+    for child in get_children(context,sprite_object,ob_list=[]):
+        update_action_hash(data_hash,bpy.data.actions.get(anim.name+"_"+child.name))
+    return data_hash.hexdigest()
+
+def get_cached_skin_data(cache,obj,tex_path,scale,armature,armature_fingerprint,texture_atlas=False):
+    if cache == None:
+        return get_skin_data(obj,tex_path,scale,armature,texture_atlas=texture_atlas)
+    key = obj.name+"/"+obj.data.name
+    fingerprint = get_skin_fingerprint(obj,tex_path,scale,armature_fingerprint,texture_atlas)
+    entry = cache["skin"].get(key)
+    if entry != None and entry["fingerprint"] == fingerprint:
+        ### restore the side effects of get_skin_data that the animation export relies on
+        texture_pathes[obj.name] = tex_path
+        default_vert_coords[obj.name] = entry["vert_coords"]
+        return entry["data"]
+    data = get_skin_data(obj,tex_path,scale,armature,texture_atlas=texture_atlas)
+    cache["skin"][key] = {"fingerprint":fingerprint,"data":data,"vert_coords":default_vert_coords[obj.name]}
+    return data
+
+def get_cached_anim_data(cache,context,sprite_object,armature,anim,bake_anim,bake_interval,reduce_tolerances,base_fingerprint):
+    if cache == None:
+        return get_anim_data(context,sprite_object,armature,anim,bake_anim,bake_interval,reduce_tolerances)
+    fingerprint = get_anim_fingerprint(context,sprite_object,anim,base_fingerprint)
+    entry = cache["anim"].get(anim.name)
+    if entry != None and entry["fingerprint"] == fingerprint:
+        return entry["data"]
+    data = get_anim_data(context,sprite_object,armature,anim,bake_anim,bake_interval,reduce_tolerances)
+    if data != None:
+        cache["anim"][anim.name] = {"fingerprint":fingerprint,"data":data}
+    return data
+
 class DragonBonesExport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
     bl_idname = "coa_tools.export_dragon_bones"
     bl_label = "Dragonbones Export"
@@ -908,16 +1071,34 @@ class DragonBonesExport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
     filter_glob = StringProperty(default="*.json",options={'HIDDEN'},)
     bake_anim = BoolProperty(name="Bake Animation", description="If checked, keyframes will be set for each frame. This is good if the Animation has to look exactly as in Blender.",default=False)
     bake_interval = IntProperty(name="Bake Interval",default=1,min=1)
+    export_format = EnumProperty(name="Export Format",items=(("JSON","Json","Export a DragonBones 4.5 json file"),("BINARY","Binary","Export a DragonBones 5.5 binary .dbbin file next to the chosen path")),default="JSON")
     reduce_size = BoolProperty(name="Reduce Export Size", description="Reduces the export size by writing all data into one row.",default=False)
     generate_atlas = BoolProperty(name="Generate Texture Atlas",description="Generates a Texture Atlas to reduce size and bundle all graphics in one Image",default=False)
     atlas_size = EnumProperty(name="Atlas Size",items=(("AUTOMATIC","Automatic","Automatic"),("MANUAL","Manual","Manual")),default="MANUAL")
     atlas_dimension = IntVectorProperty(name="Dimension",size=2,default=(1024,1024))
-    unwrap_method = EnumProperty(name="Unwrap Method",items=(("SMART_UV","Smart UV","Smart UV"),("ANGLE_BASED","Angle Based","Angle Based")))
-    island_margin = FloatProperty(default=.01,min=0.0,step=.1)
+    atlas_max_size = IntVectorProperty(name="Max Page Size",description="Maximum size of an automatic sized atlas page. Sprites spill into additional pages when a page is full",size=2,default=(2048,2048))
+    atlas_padding = IntProperty(name="Sprite Padding",description="Padding in pixels between sprites in the texture atlas",default=2,min=0)
+    reduce_keyframes = BoolProperty(name="Reduce Keyframes", description="Removes keyframes that can be interpolated from their neighbour keyframes within the given tolerances.",default=False)
+    reduce_tolerance_pos = FloatProperty(name="Position Tolerance",default=0.5,min=0.0)
+    reduce_tolerance_angle = FloatProperty(name="Angle Tolerance",default=0.5,min=0.0)
+    reduce_tolerance_scale = FloatProperty(name="Scale Tolerance",default=0.01,min=0.0,step=.1)
+    reduce_tolerance_color = FloatProperty(name="Color Tolerance",default=1.0,min=0.0)
+    reduce_tolerance_ffd = FloatProperty(name="Mesh Deform Tolerance",default=1.0,min=0.0)
+    texture_format = EnumProperty(name="Texture Format",items=texture_format_items,default="PNG")
+    webp_quality = IntProperty(name="WebP Quality",default=80,min=0,max=100,subtype="PERCENTAGE")
+    png_compression = IntProperty(name="PNG Compression",description="Compression level of textures that are encoded by the exporter",default=6,min=0,max=9)
+    png_filter = EnumProperty(name="PNG Filter",items=png_filter_items,default="ADAPTIVE")
+    undo_free = BoolProperty(name="Undo Free Export",description="Exports temporary copies of the sprite meshes and restores the scene state afterwards instead of using undo. Needed for exports in background mode",default=False)
+    profile_export = BoolProperty(name="Profile Export",description="Writes a report with the time spent in each export phase next to the exported file",default=False)
+    incremental_export = BoolProperty(name="Incremental Export",description="Reuses skin and animation data of the last export in this session if their actions, meshes and rig did not change",default=False)
     
     sprite_object = None
     armature = None
     sprites = None
+    atlas_pages = []
+    atlas_mesh_pages = {}
+    export_meshes = {}
+    texture_encoder = None
     scale = 0.0
     @classmethod
     def poll(cls, context):
@@ -929,7 +1110,25 @@ class DragonBonesExport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         col.prop(self,"bake_anim",text="Bake Animation")
         if self.bake_anim:
             col.prop(self,"bake_interval",text="Bake Interval")
-        col.prop(self,"reduce_size",text="Reduce Export Size")
+        row = col.row()
+        row.prop(self,"export_format",expand=True)
+        if self.export_format == "JSON":
+            col.prop(self,"reduce_size",text="Reduce Export Size")
+        col.prop(self,"incremental_export",text="Incremental Export")
+        col.prop(self,"undo_free",text="Undo Free Export")
+        col.prop(self,"profile_export",text="Profile Export")
+        
+        if self.reduce_keyframes:
+            box = col.box()
+        else:
+            box = col
+        box.prop(self,"reduce_keyframes",text="Reduce Keyframes")
+        if self.reduce_keyframes:
+            box.prop(self,"reduce_tolerance_pos",text="Position")
+            box.prop(self,"reduce_tolerance_angle",text="Angle")
+            box.prop(self,"reduce_tolerance_scale",text="Scale")
+            box.prop(self,"reduce_tolerance_color",text="Color")
+            box.prop(self,"reduce_tolerance_ffd",text="Mesh Deform")
         
         if self.generate_atlas:
             box = col.box()
@@ -938,22 +1137,144 @@ class DragonBonesExport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         box.prop(self,"generate_atlas",text="Generate Texture Atlas")
         if self.generate_atlas:
             row = box.row()
-            #row.prop(self,"atlas_size",text="Atlas Size",expand=True)
+            row.prop(self,"atlas_size",text="Atlas Size",expand=True)
             if self.atlas_size == "MANUAL":
                 row = box.row()
                 row.prop(self,"atlas_dimension",text="")
-            row = box.row()    
-            row.prop(self,"unwrap_method",text="Unwrap Method",expand=True)  
+            else:
+                row = box.row()
+                row.prop(self,"atlas_max_size",text="")
             row = box.row()
-            row.prop(self,"island_margin",text="Sprite Margin")  
+            row.prop(self,"atlas_padding",text="Sprite Padding")  
+        
+        box = col.box()
+        box.prop(self,"texture_format",text="Texture Format")
+        if self.texture_format == "WEBP":
+            box.prop(self,"webp_quality",text="Quality")
+        elif not self.texture_format.startswith("WEBP"):
+            box.prop(self,"png_compression",text="PNG Compression")
+            box.prop(self,"png_filter",text="PNG Filter")
     
-    def execute(self, context):
-        bpy.ops.ed.undo_push(message="Export Undo")
-        self.scale = 1/get_addon_prefs(context).sprite_import_export_scale
-        self.sprite_object = get_sprite_object(context.active_object)
-        self.armature = get_armature(self.sprite_object)
-        self.sprites = get_children(context,self.sprite_object,[])
-        self.sprites = sorted(self.sprites, key=lambda obj: obj.location[1], reverse=True) ### sort objects based on the z depth. needed for draw order
+    ### write the slot, skin, bone and animation data into the json stream or the binary writer
+    def write_export_data(self,context,writer,texture_path,cache,armature_fingerprint):
+        writer.begin_object()
+        for key in db_json:
+            if key == "name":
+                writer.write(self.sprite_object.name,key)
+            elif key != "armature":
+                writer.write(db_json[key],key)
+        writer.begin_array("armature")
+        writer.begin_object()
+        for key in ["aabb","defaultActions","type","frameRate"]:
+            writer.write(armature[key],key)
+        writer.write(self.sprite_object.name,"name")
+        
+        ### write slot data
+        with export_profiler.phase("slots"):
+            writer.begin_array("slot")
+            for sprite in self.sprites:
+                if sprite.type == "MESH":
+                    writer.write(get_slot_data(sprite))
+            writer.end_array()
+        
+        ### write skin data
+        with export_profiler.phase("skin"):
+            writer.begin_array("skin")
+            writer.begin_object()
+            writer.write("","name")
+            writer.begin_array("slot")
+            for sprite in self.sprites:
+                if sprite.type == "MESH":
+#                    ### find export bones that have to be ignored
+#                    bones = get_shapekey_driver(sprite)[1]
+#                    for bone in bones:
+#                        if bone.name not in ignore_bones:
+#                            ignore_bones.append(bone.name)
+                
+                    display = {"name":sprite.name,"display":[]}
+                
+                    ### export mesh directly when of type "MESH"
+                    if sprite.coa_type == "MESH":
+                        if not self.generate_atlas:
+                            tex_path = save_texture(sprite,texture_path,self.texture_encoder)
+                        else:
+                        
+                            tex_path = os.path.join("sprites",self.atlas_mesh_pages.get(sprite.data.name,self.atlas_pages[0].name))
+                            tex_path = tex_path.replace("\\","/")
+                        display["display"].append(get_cached_skin_data(cache,sprite,tex_path,self.scale,self.armature,armature_fingerprint,texture_atlas=self.generate_atlas))
+                    
+                    ### loop over all slots if of type "SLOT"    
+                    elif sprite.coa_type == "SLOT":
+                        data_name = sprite.data.name
+                        ### loop over all other slot items
+                        for i,slot in enumerate(sprite.coa_slot):
+                            data = self.export_meshes.get(slot.name,bpy.data.meshes[slot.name])
+                            sprite.data = data
+                        
+                            if not self.generate_atlas:
+                                tex_path = save_texture(sprite,texture_path,self.texture_encoder)
+                            else:
+                            
+                                tex_path = os.path.join("sprites",self.atlas_mesh_pages.get(sprite.data.name,self.atlas_pages[0].name))
+                                tex_path = tex_path.replace("\\","/")
+                            display["display"].append(get_cached_skin_data(cache,sprite,tex_path,self.scale,self.armature,armature_fingerprint,texture_atlas=self.generate_atlas))
+                        sprite.data = bpy.data.meshes[data_name]
+                    
+                    writer.write(display)
+            writer.end_array()
+            writer.end_object()
+            writer.end_array()
+        with export_profiler.phase("texture_copy"):
+            sync_textures(texture_path)
+        with export_profiler.phase("texture_encode"):
+            self.texture_encoder.write()
+        
+        ### write bone data
+        with export_profiler.phase("bones"):
+            ik_data = []
+            writer.begin_array("bone")
+            if self.armature == None:
+                writer.write({"name":self.sprite_object.name,"transform":{}})
+            else:    
+                writer.write({"name":self.armature.name,"transform":{}})
+                bone_transform_cache.clear()
+
+                for bone in self.armature.data.bones:
+                    pose_bone = self.armature.pose.bones[bone.name]
+
+                    if bone.name not in ignore_bones:
+                        writer.write(get_bone_data(self.armature,bone,self.scale))
+                    
+                        for const in self.armature.pose.bones[bone.name].constraints:
+                            if const.type == "IK" and const.subtarget != "":
+                                ik_data.append(get_ik_data(self.armature,bone,const))
+            writer.end_array()
+            writer.write(ik_data,"ik")
+        
+        ### write animation data. each animation is written as soon as it is sampled
+        with export_profiler.phase("animation"):
+            writer.begin_array("animation")
+            if len(self.sprite_object.coa_anim_collections)>0:
+                reduce_tolerances = None
+                if self.reduce_keyframes:
+                    reduce_tolerances = {"pos":self.reduce_tolerance_pos,"angle":self.reduce_tolerance_angle,"scale":self.reduce_tolerance_scale,"color":self.reduce_tolerance_color,"ffd":self.reduce_tolerance_ffd}
+                base_fingerprint = None
+                if cache != None:
+                    options = (self.bake_anim,self.bake_interval,sorted(reduce_tolerances.items()) if reduce_tolerances != None else None,self.scale)
+                    base_fingerprint = get_anim_base_fingerprint(context,self.sprite_object,armature_fingerprint,options)
+                for anim in self.sprite_object.coa_anim_collections:
+                    with export_profiler.phase(anim.name):
+                        anim_data = get_cached_anim_data(cache,context,self.sprite_object,self.armature,anim,self.bake_anim,self.bake_interval,reduce_tolerances,base_fingerprint)
+                    if anim_data != None:
+                        writer.write(anim_data)
+            writer.end_array()
+        
+        writer.end_object()
+        writer.end_array()
+        writer.end_object()
+
+    ### export the sprite object with the scene prepared by execute
+    def export_sprite_object(self,context):
         export_path = os.path.dirname(self.filepath)
         texture_path = os.path.join(export_path,"texture","sprites")
         
@@ -965,14 +1286,17 @@ class DragonBonesExport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
             set_action(context,item=self.sprite_object.coa_anim_collections[1]) # set animation to restpose
         
         create_texture_dir(texture_path)
+        load_texture_manifest(texture_path)
         
         ### delete base sprite if hidden for export
-        for sprite in self.sprites:
-            if sprite.type == "MESH":
-                if sprite.data.coa_hide_base_sprite:
-                    bpy.context.scene.objects.active = sprite
-                    sprite.select = True
-                    remove_base_mesh(sprite)
+        with export_profiler.phase("prepare"):
+            if self.undo_free:
+                create_export_meshes(self.sprites,self.export_meshes)
+            else:
+                for sprite in self.sprites:
+                    if sprite.type == "MESH":
+                        if sprite.data.coa_hide_base_sprite:
+                            remove_base_mesh_data(sprite,sprite.data)
         
         ### if generate atlas is toggled a texture atlas is generated
         if self.generate_atlas:            
@@ -981,97 +1305,86 @@ class DragonBonesExport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
                 if sprite.type == "MESH":
                     sprites.append(sprite)
             name = self.sprite_object.name+"_atlas"
-            generate_texture_atlas(context,sprites,name,self.atlas_dimension[0],self.atlas_dimension[1],self.atlas_size,self.unwrap_method,self.island_margin)
-            bpy.data.images[name].save_render(os.path.join(texture_path,name+".png"))
+            page_size = self.atlas_dimension
+            if self.atlas_size == "AUTOMATIC":
+                page_size = self.atlas_max_size
+            atlas_data = generate_texture_atlas(context,sprites,name,page_size[0],page_size[1],self.atlas_size,self.atlas_padding,self.export_meshes)
+            if atlas_data == None:
+                self.report({"ERROR"},"A Sprite is larger than the Texture Atlas page. Increase the Atlas Dimension.")
+                return {"CANCELLED"}
+            self.atlas_pages,self.atlas_mesh_pages = atlas_data
+            for atlas in self.atlas_pages:
+                atlas_path = self.texture_encoder.add(atlas,os.path.join(texture_path,atlas.name+".png"))
+                write_atlas_page_data(atlas,atlas_path)
         
-        armature["slot"] = []
+        ### cached data of the last export. fingerprints decide which parts are reused
+        cache = None
+        armature_fingerprint = None
+        if self.incremental_export:
+            cache = export_cache.setdefault(self.sprite_object.name,{"skin":{},"anim":{}})
+            armature_fingerprint = get_armature_fingerprint(self.armature)
         
-        skin = OrderedDict()
-        skin = {
-                "name":"",
-                "slot":[]
-                }
-        armature["skin"] = [skin]
+        ### the binary header references the binary arrays by their offsets, so the file is written after all data is converted
+        if self.export_format == "BINARY":
+            writer = DragonBonesBinaryWriter()
+            self.write_export_data(context,writer,texture_path,cache,armature_fingerprint)
+            if not writer.fits_format():
+                self.report({"ERROR"},"The export is too large for the DragonBones binary format. Export it as json.")
+                return {"CANCELLED"}
+            with open_export_file(os.path.splitext(self.filepath)[0]+".dbbin","wb") as bin_file:
+                writer.write_file(bin_file)
+            return {"FINISHED"}
         
-        for sprite in self.sprites:
-            if sprite.type == "MESH":
-#                ### find export bones that have to be ignored
-#                bones = get_shapekey_driver(sprite)[1]
-#                for bone in bones:
-#                    if bone.name not in ignore_bones:
-#                        ignore_bones.append(bone.name)
-                
-                armature["slot"].append(get_slot_data(sprite))
-                
-                display = {"name":sprite.name,"display":[]}
-                
-                ### export mesh directly when of type "MESH"
-                if sprite.coa_type == "MESH":
-                    if not self.generate_atlas:
-                        tex_path = save_texture(sprite,texture_path)
-                    else:
-                        
-                        tex_path = os.path.join("sprites",self.sprite_object.name+"_atlas")
-                        tex_path = tex_path.replace("\\","/")
-                    display["display"].append(get_skin_data(sprite,tex_path,self.scale,self.armature,texture_atlas=self.generate_atlas))
-                    
-                ### loop over all slots if of type "SLOT"    
-                elif sprite.coa_type == "SLOT":
-                    data_name = sprite.data.name
-                    ### loop over all other slot items
-                    for i,slot in enumerate(sprite.coa_slot):
-                        data = bpy.data.meshes[slot.name]
-                        sprite.data = data
-                        
-                        if not self.generate_atlas:
-                            tex_path = save_texture(sprite,texture_path)
-                        else:
-                            
-                            tex_path = os.path.join("sprites",self.sprite_object.name+"_atlas")
-                            tex_path = tex_path.replace("\\","/")
-                        display["display"].append(get_skin_data(sprite,tex_path,self.scale,self.armature,texture_atlas=self.generate_atlas))
-                    sprite.data = bpy.data.meshes[data_name]
-                    
-                armature["skin"][0]["slot"].append(display)
-        armature["name"] = self.sprite_object.name
-        armature["bone"] = []
-        armature["ik"] = []
-        if self.armature == None:
-            armature["bone"].append({"name":self.sprite_object.name,"transform":{}})
-        else:    
-            armature["bone"].append({"name":self.armature.name,"transform":{}})
-
-            for bone in self.armature.data.bones:
-                pose_bone = self.armature.pose.bones[bone.name]
-
-                if bone.name not in ignore_bones:
-                    armature["bone"].append(get_bone_data(self.armature,bone,self.scale))
-                    
-                    for const in self.armature.pose.bones[bone.name].constraints:
-                        if const.type == "IK" and const.subtarget != "":
-                            armature["ik"].append(get_ik_data(self.armature,bone,const))
-        
-        
-        ### get animation data
-        if len(self.sprite_object.coa_anim_collections)>0:
-            armature["animation"] = []
-            armature["animation"] = get_animation_data(context,self.sprite_object,self.armature,self.bake_anim,self.bake_interval)
-            
-        db_json["armature"] = []
-        db_json["armature"].append(armature)
-        db_json["name"] = self.sprite_object.name
-        
-        if self.reduce_size:
-            json_file = json.dumps(db_json,separators=(',',':'))
-        else:    
-            json_file = json.dumps(db_json, indent="\t", sort_keys=False)
+        ### stream json data into a temporary file while it is generated. the export file is only replaced when the export succeeds
+        with open_export_file(self.filepath) as text_file:
+            self.write_export_data(context,JsonStreamWriter(text_file,compact=self.reduce_size),texture_path,cache,armature_fingerprint)
+        return {"FINISHED"}
+    
+    def execute(self, context):
+        if not texture_format_supported(self.texture_format):
+            self.report({"ERROR"},"WebP export needs the Pillow module in the python of Blender.")
+            return {"CANCELLED"}
+        ### undo does nothing in background mode, so the scene state can only be restored by the undo free export
+        if bpy.app.background:
+            self.undo_free = True
+        if not self.undo_free:
+            bpy.ops.ed.undo_push(message="Export Undo")
+        keyframe_index.clear()
+        bone_index_table.clear()
+        self.export_meshes = OrderedDict()
+        self.texture_encoder = TextureEncoder(self.png_compression,self.png_filter,self.texture_format,self.webp_quality)
+        self.scale = 1/get_addon_prefs(context).sprite_import_export_scale
+        self.sprite_object = get_sprite_object(context.active_object)
+        self.armature = get_armature(self.sprite_object)
+        self.sprites = get_children(context,self.sprite_object,[])
+        self.sprites = sorted(self.sprites, key=lambda obj: obj.location[1], reverse=True) ### sort objects based on the z depth. needed for draw order
+        if self.undo_free:
+            scene_state = store_scene_state(context,self.sprite_object,self.armature,self.sprites)
+            scene_images = set(bpy.data.images.keys())
         
-        text_file = open(self.filepath, "w")
-        text_file.write(json_file)
-        text_file.close()
+        ### the scene is restored and profiling is stopped even if the export fails, so no temporary meshes, atlas images or changed actions are left behind
+        if self.profile_export:
+            export_profiler.start()
+        try:
+            result = self.export_sprite_object(context)
+        finally:
+            if self.profile_export:
+                export_profiler.stop()
+            if self.undo_free:
+                restore_scene_state(context,self.sprite_object,self.armature,self.sprites,scene_state)
+                remove_export_meshes(self.export_meshes)
+                for name in set(bpy.data.images.keys()) - scene_images:
+                    bpy.data.images.remove(bpy.data.images[name],do_unlink=True)
+            else:
+                bpy.ops.ed.undo()
+        if result != {"FINISHED"}:
+            return result
+        if not self.undo_free:
+            bpy.ops.ed.undo_push(message="Dragonbones Export")
         
-        bpy.ops.ed.undo()
-        bpy.ops.ed.undo_push(message="Dragonbones Export")
+        if self.profile_export:
+            export_profiler.write_report(self.filepath)
+            self.report({"INFO"},export_profiler.get_summary())
         
         return {"FINISHED"}
         
\ No newline at end of file
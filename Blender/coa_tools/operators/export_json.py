@@ -22,12 +22,14 @@ import bpy
 import bpy_types
 import json
 import os
-import shutil
 from .. functions import *
+from .. texture_encoder import TextureEncoder, png_filter_items, texture_format_items, texture_format_supported
+from .. export_utils import JsonStreamWriter, KeyframeTrack, open_export_file, export_profiler, profile_phase
 from bpy.props import FloatProperty, IntProperty, BoolProperty, StringProperty, CollectionProperty, FloatVectorProperty, EnumProperty, IntVectorProperty
 from collections import OrderedDict
 import math
 import time
+import numpy as np
 
 class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
     """This appears in the tooltip of the operator and in the generated docs"""
@@ -42,16 +44,29 @@ class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
     filter_glob = StringProperty(default="*.json",options={'HIDDEN'},)
     export_anims = BoolProperty(name="Export Animation Collections",description="Exports All Animation Collections",default=True,)
     export_only_deform_bones = BoolProperty(name="Export Only Deform Bones",description="Exports All Animation Collections",default=True,)
+    texture_format = EnumProperty(name="Texture Format",items=texture_format_items,default="PNG")
+    webp_quality = IntProperty(name="WebP Quality",default=80,min=0,max=100,subtype="PERCENTAGE")
+    png_compression = IntProperty(name="PNG Compression",description="Compression level of textures that are encoded by the exporter",default=6,min=0,max=9)
+    png_filter = EnumProperty(name="PNG Filter",items=png_filter_items,default="ADAPTIVE")
+    reduce_keyframes = BoolProperty(name="Reduce Keyframes",description="Removes keyframes that can be interpolated linearly from their neighbours",default=False)
+    reduce_tolerance_pos = FloatProperty(name="Position Tolerance",description="Maximum deviation of a removed position keyframe in pixels",default=0.5,min=0.0)
+    reduce_tolerance_angle = FloatProperty(name="Angle Tolerance",description="Maximum deviation of a removed rotation keyframe in degrees",default=0.5,min=0.0)
+    reduce_tolerance_scale = FloatProperty(name="Scale Tolerance",description="Maximum deviation of a removed scale keyframe",default=0.01,min=0.0,step=.1)
+    reduce_tolerance_color = FloatProperty(name="Color Tolerance",description="Maximum deviation of a removed opacity or modulate color keyframe",default=0.005,min=0.0,step=.1,precision=4)
+    profile_export = BoolProperty(name="Profile Export",description="Writes a report with the time spent in each export phase next to the exported file",default=False)
     
-    export_dict = OrderedDict()
     sprite_object = None
     armature = None
     children = []
     bone_sprite_constraint = {}
+    bone_paths = {}
+    object_paths = {}
+    sprite_bones = {}
+    image_scales = {}
+    action_analyses = {}
     export_path = ""
+    texture_encoder = None
     scale_multiplier = 100.0
-    time_idx_hist = 0
-    time_idx = 0
     
     ### gets the sprite offset from the upper left sprite corner to the pivot point of the bone.
     def get_bounds_and_center(obj):
@@ -65,74 +80,45 @@ class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         sprite_center = sprite_center*0.125
         return[sprite_center,bounds]
     
-    ### gets the local dimension of a mesh. 
-    def get_local_dimension(self,obj):
-        x0 = 10000000000*10000000000
-        x1 = -10000000000*10000000000
-        y0 = 10000000000*10000000000
-        y1 = -100000000000*10000000000
-        
-        for vert in obj.data.vertices:
-            if vert.co[0] < x0:
-                x0 = vert.co[0]
-            if vert.co[0] > x1:
-                x1 = vert.co[0]
-            if vert.co[2] < y0:
-                y0 = vert.co[2]
-            if vert.co[2] > y1:
-                y1 = vert.co[2]
-        return [x1-x0,y1-y0]
-    
-    def get_image_scale(self,obj):
-        dimension = self.get_local_dimension(obj)
-        img = obj.material_slots[0].material.texture_slots[0].texture.image
-        scale_x = round((dimension[0])/img.size[0],5)*self.scale_multiplier
-        scale_y = round((dimension[1])/img.size[1],5)*self.scale_multiplier
-        return[scale_x,scale_y]
+    ### gets the local bounds of a mesh as [x_min,x_max,y_min,y_max]
+    def get_local_bounds(self,obj):
+        if len(obj.data.vertices) == 0:
+            return [0.0,0.0,0.0,0.0]
+        coords = np.empty(len(obj.data.vertices)*3,dtype=np.float32)
+        obj.data.vertices.foreach_get("co",coords)
+        coords = coords.reshape((-1,3)).astype(np.float64)
+        return [float(coords[:,0].min()),float(coords[:,0].max()),float(coords[:,2].min()),float(coords[:,2].max())]
+    
+    ### the image scale only depends on the mesh and its texture. it is computed once per mesh and export, slot sprites switch between meshes
+    def get_image_scale(self,obj,img=None,bounds=None):
+        if obj.data.name not in self.image_scales:
+            if img == None:
+                img = obj.material_slots[0].material.texture_slots[0].texture.image
+            if bounds == None:
+                bounds = self.get_local_bounds(obj)
+            scale_x = round((bounds[1]-bounds[0])/img.size[0],5)*self.scale_multiplier
+            scale_y = round((bounds[3]-bounds[2])/img.size[1],5)*self.scale_multiplier
+            self.image_scales[obj.data.name] = [scale_x,scale_y]
+        return self.image_scales[obj.data.name]
     
-    def get_sprite_scale(self,sprite_name):
-        obj = bpy.data.objects[sprite_name]
-        scale_x = obj.scale[0]*self.get_image_scale(obj)[0]*obj.coa_tiles_x
-        scale_y = obj.scale[2]*self.get_image_scale(obj)[1]*obj.coa_tiles_y
+    def get_sprite_scale(self,obj):
+        image_scale = self.get_image_scale(obj)
+        scale_x = obj.scale[0]*image_scale[0]*obj.coa_tiles_x
+        scale_y = obj.scale[2]*image_scale[1]*obj.coa_tiles_y
         
         return [scale_x,scale_y]
     
-        
-    def get_sprite_offset(self,obj_name):
-        obj = bpy.data.objects[obj_name]
-        x = 1000000000000000000
-        y = -1000000000000000000
-        for vert in obj.data.vertices:
-            if vert.co[0] < x:
-                x = vert.co[0]
-            if vert.co[2] > y:
-                y = vert.co[2]
-        corner_vert = Vector((x,0,y)) 
-        offset =  corner_vert * self.scale_multiplier
-        offset[0] /= self.get_image_scale(obj)[0]
-        offset[2] /= self.get_image_scale(obj)[1]
-        offset_2d = [offset[0],-offset[2]]
-        return offset_2d
-    
-    def get_sprite_tilesize(self,sprite_name):
-        obj = bpy.data.objects[sprite_name]
-        return [obj.coa_tiles_x,obj.coa_tiles_y]
-    
-    def get_sprite_frame_index(self,sprite_name):
-        obj = bpy.data.objects[sprite_name]
+    def get_sprite_frame_index(self,obj):
         return int(obj.coa_sprite_frame)
     
-    def get_modulate_color(self,sprite_name):
-        obj = bpy.data.objects[sprite_name]
+    def get_modulate_color(self,obj):
         return [obj.coa_modulate_color[0],obj.coa_modulate_color[1],obj.coa_modulate_color[2]]
     
-    def get_sprite_opacity(self,sprite_name):
-        obj = bpy.data.objects[sprite_name]
+    def get_sprite_opacity(self,obj):
         return obj.coa_alpha
     
     
-    def get_sprite_rotation(self,sprite_name):
-        obj = bpy.data.objects[sprite_name]
+    def get_sprite_rotation(self,obj):
         euler_rot = obj.matrix_basis.to_euler()
         degrees = math.degrees(euler_rot[1])
         return -math.radians(degrees)
@@ -249,12 +235,8 @@ class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         return relative_pos_2d
     
     ### get the sprite resource path and copy image resources in a subfolder of the json location
-    def get_sprite_path(self,sprite_name):
-        obj = bpy.data.objects[sprite_name]
-        mat = obj.material_slots[0].material
-        tex = mat.texture_slots[0].texture
-        img = tex.image
-        
+    @profile_phase("texture_copy")
+    def get_sprite_path(self,sprite_name,img):
         img_path = self.change_path_slashes(img.filepath)
         if "//" in img_path:
             img_path = img_path.replace("//","")
@@ -262,70 +244,110 @@ class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         img_path = self.change_path_slashes(img_path)
         ### create resource directory
         res_dir_path = os.path.join(os.path.dirname(self.export_path),"sprites")
-        copied_res_path = os.path.join(res_dir_path,os.path.basename(img_path))
         
         if not os.path.exists(res_dir_path):
             os.makedirs(res_dir_path)
-        if os.path.isfile(img_path):# and not os.path.isfile(copied_res_path):
-            shutil.copy(img_path,res_dir_path)
-        else:
-            original_path = img.filepath
-            export_path = os.path.join(res_dir_path,sprite_name)
-            img.filepath = export_path
-            img.filepath_raw = export_path
-            img.save()
-            img.filepath = original_path
-            img.filepath_raw = original_path
+        ### image files are copied, images without a file are encoded after all nodes are exported
+        copied_res_path = self.texture_encoder.add_resource(img,img_path,res_dir_path,sprite_name)
         
         rel_path = os.path.relpath(copied_res_path,os.path.dirname(self.export_path))
         return self.change_path_slashes(rel_path)
 
-    def get_node_path(self,node,path_list):
-        if type(node) == bpy_types.Bone:
-            path_list.append(node.name)
-            for child_node in node.parent_recursive:
-                path_list.append(child_node.name)
-        else:
+    ### node paths are stored in a table that is filled once per export. parent paths are looked up in the table, so every node is resolved only once
+    def build_node_paths(self):
+        self.bone_paths = {}
+        self.object_paths = {}
+        self.sprite_bones = {}
+        if self.armature != None:
+            for bone in self.armature.data.bones:
+                self.get_bone_path(bone)
+        for child in self.children:
+            if child.type == "MESH":
+                self.get_object_path(child)
+    
+    def get_bone_path(self,bone):
+        if bone.name not in self.bone_paths:
+            if bone.parent != None:
+                self.bone_paths[bone.name] = self.get_bone_path(bone.parent) + "/" + bone.name
+            else:
+                self.bone_paths[bone.name] = bone.name
+        return self.bone_paths[bone.name]
+    
+    ### main deforming bone of a sprite that is parented to the armature
+    def get_sprite_bone(self,sprite):
+        if sprite.name not in self.sprite_bones:
+            self.sprite_bones[sprite.name] = self.get_bone_sprites(sprite,self.armature)
+        return self.sprite_bones[sprite.name]
+    
+    def get_object_path(self,obj):
+        if obj.name not in self.object_paths:
+            parent_path = ""
+            if obj.parent != None and obj.parent.type != "ARMATURE":
+                parent_path = self.get_object_path(obj.parent)
             ### node is weigted to a bone
-            if node.parent != None and node.parent.type != "ARMATURE":
-                path_list.append(node.name)
-                self.get_node_path(node.parent,path_list)
-            elif node.parent != None and node.parent.type == "ARMATURE":
-                path_list.append(node.name)
-                self.get_node_path(self.armature.data.bones[self.get_bone_sprites(node,self.armature)],path_list)
-
-        path = ""
-        for i,item in enumerate(reversed(path_list)):   
-            path += item
-            if i < len(path_list)-1:
-                 path += "/"
-        return path     
+            elif obj.parent != None and obj.parent.type == "ARMATURE":
+                parent_path = self.get_bone_path(self.armature.data.bones[self.get_sprite_bone(obj)])
             
-    def get_z_value(self,sprite):
-        obj = bpy.data.objects[sprite]
+            if obj.parent == None:
+                self.object_paths[obj.name] = ""
+            elif parent_path != "":
+                self.object_paths[obj.name] = parent_path + "/" + obj.name
+            else:
+                self.object_paths[obj.name] = obj.name
+        return self.object_paths[obj.name]
+    
+    def get_node_path(self,node):
+        if type(node) == bpy_types.Bone:
+            return self.get_bone_path(node)
+        return self.get_object_path(node)
+            
+    def get_z_value(self,obj):
         return obj.coa_z_value
     
+    ### reads all exported sprite properties in one pass. the mesh and the material chain of the sprite are only visited once
+    def get_sprite_snapshot(self,obj):
+        img = obj.material_slots[0].material.texture_slots[0].texture.image
+        bounds = self.get_local_bounds(obj)
+        image_scale = self.get_image_scale(obj,img,bounds)
+        
+        snapshot = {}
+        snapshot["image"] = img
+        ### offset from the upper left sprite corner to the pivot point
+        snapshot["pivot_offset"] = [0.0,0.0]
+        if image_scale[0] != 0 and image_scale[1] != 0:
+            snapshot["pivot_offset"] = [bounds[0]*self.scale_multiplier/image_scale[0],-(bounds[3]*self.scale_multiplier/image_scale[1])]
+        snapshot["rotation"] = self.get_sprite_rotation(obj)
+        snapshot["scale"] = self.get_sprite_scale(obj)
+        snapshot["opacity"] = self.get_sprite_opacity(obj)
+        snapshot["z"] = self.get_z_value(obj)
+        snapshot["tiles_x"] = obj.coa_tiles_x
+        snapshot["tiles_y"] = obj.coa_tiles_y
+        snapshot["frame_index"] = self.get_sprite_frame_index(obj)
+        return snapshot
     
     def sprite_to_dict(self,sprite,bone=None):
+        obj = bpy.data.objects[sprite]
+        snapshot = self.get_sprite_snapshot(obj)
+        
         dict_sprites = OrderedDict()
         dict_sprites["name"] = sprite
         dict_sprites["type"] = "SPRITE"
-        dict_sprites["node_path"] = str(self.get_node_path(bpy.data.objects[sprite],[]))#,suffix=sprite))
-        dict_sprites["resource_path"] = self.get_sprite_path(sprite)
-        dict_sprites["pivot_offset"] = self.get_sprite_offset(sprite)
-        dict_sprites["position"] = self.get_relative_mesh_pos(bone,bpy.data.objects[sprite])
-        dict_sprites["rotation"] = self.get_sprite_rotation(sprite)
-        dict_sprites["scale"] = self.get_sprite_scale(sprite)
-        dict_sprites["opacity"] = self.get_sprite_opacity(sprite)
-        dict_sprites["z"] = self.get_z_value(sprite)
-        dict_sprites["tiles_x"] = self.get_sprite_tilesize(sprite)[0]
-        dict_sprites["tiles_y"] = self.get_sprite_tilesize(sprite)[1]
-        dict_sprites["frame_index"] = self.get_sprite_frame_index(sprite)
+        dict_sprites["node_path"] = str(self.get_node_path(obj))#,suffix=sprite))
+        dict_sprites["resource_path"] = self.get_sprite_path(sprite,snapshot["image"])
+        dict_sprites["pivot_offset"] = snapshot["pivot_offset"]
+        dict_sprites["position"] = self.get_relative_mesh_pos(bone,obj)
+        dict_sprites["rotation"] = snapshot["rotation"]
+        dict_sprites["scale"] = snapshot["scale"]
+        dict_sprites["opacity"] = snapshot["opacity"]
+        dict_sprites["z"] = snapshot["z"]
+        dict_sprites["tiles_x"] = snapshot["tiles_x"]
+        dict_sprites["tiles_y"] = snapshot["tiles_y"]
+        dict_sprites["frame_index"] = snapshot["frame_index"]
         dict_sprites["children"] = []
         
-        for child in bpy.data.objects[sprite].children:
+        for child in obj.children:
             if child.type == "MESH":
-                dict_sprites["children"].append(self.sprite_to_dict(child.name,bpy.data.objects[sprite]))
+                dict_sprites["children"].append(self.sprite_to_dict(child.name,obj))
                 
         return dict_sprites
     
@@ -333,7 +355,7 @@ class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         dict_bone = OrderedDict()
         dict_bone["name"] = bone.name
         dict_bone["type"] = "BONE"
-        dict_bone["node_path"] = str(self.get_node_path(bone,[]))#,suffix=""))
+        dict_bone["node_path"] = str(self.get_node_path(bone))#,suffix=""))
         dict_bone["draw_bone"] = self.armature.data.bones[bone.name].coa_draw_bone
         dict_bone["bone_connected"] = bone.use_connect
         dict_bone["position"] = self.get_relative_bone_pos(bone,"HEAD")
@@ -376,49 +398,44 @@ class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
                 actions.append(action)
         return actions
     
-    def has_animation_data(self,animation_data,channel,bone=""):
-        if animation_data == None:
-            return False
-        action = animation_data.action
-        
-        fcurve_data_found = False
-        if action != None:
+    ### split a fcurve data path into its target and property. bone paths target the bone name, object paths target ""
+    def split_data_path(self,data_path):
+        if data_path.startswith('pose.bones["'):
+            target, sep, property = data_path[len('pose.bones["'):].rpartition('"].')
+            if sep != "":
+                return target.replace('\\"','"'), property
+        return "", data_path
+    
+    ### scans the fcurves of an action once. stores the animated properties of each target and the keyed frames of each (target, property) pair
+    def get_action_analysis(self,action):
+        if action.name not in self.action_analyses:
+            properties = {}
+            keyframes = {}
             for fcurve in action.fcurves:
-                if channel in fcurve.data_path and bone in fcurve.data_path:
-                    fcurve_data_found = True        
-        return fcurve_data_found
+                target, property = self.split_data_path(fcurve.data_path)
+                properties.setdefault(target,set()).add(property)
+                coords = np.empty(len(fcurve.keyframe_points)*2,dtype=np.float32)
+                fcurve.keyframe_points.foreach_get("co",coords)
+                keyframes.setdefault((target,property),set()).update(coords[0::2].tolist())
+            self.action_analyses[action.name] = {"properties":properties,"keyframes":keyframes}
+        return self.action_analyses[action.name]
+    
+    ### returns the animated properties of a target that contain the given channel name
+    def get_animated_properties(self,animation_data,target,channel="any"):
+        if animation_data == None or animation_data.action == None:
+            return []
+        analysis = self.get_action_analysis(animation_data.action)
+        properties = analysis["properties"].get(target,())
+        return [property for property in properties if channel == "any" or channel in property]
+    
+    def has_animation_data(self,animation_data,channel,bone=""):
+        return len(self.get_animated_properties(animation_data,bone,channel)) > 0
     
     def has_keyframe(self,animation_data,name,property="any",frame=0):
-        action = None
-        if animation_data != None:
-            action = animation_data.action
-        else:
-            return False
-        keyframe_found = False 
-        for fcurve in action.fcurves:
-            for keyframe in fcurve.keyframe_points:
-                if keyframe.co[0] == frame and name in fcurve.data_path and (property in fcurve.data_path or property=="any"):
-                    keyframe_found = True
-        return keyframe_found  
-    
-    def keyframe_to_dict(self,track,property,value,channels,key):
-        time_idx_hist = channels[key][1]["time_idx_hist"]
-        if os.path.basename(track) == property:
-            if time_idx_hist in channels[key][0]:
-                if channels[key][0][time_idx_hist]["value"] != value:
-                    dict_value_entry = OrderedDict()
-                    dict_value_entry["value"] = value
-                    channels[key][0][self.time_idx] = dict_value_entry
-                    
-                    if time_idx_hist != self.time_idx_last:
-                        channels[key][0][self.time_idx_last] = channels[key][0][time_idx_hist]
-                    
-                    channels[key][1]["time_idx_hist"] = self.time_idx
-            elif self.f == 0 or (self.f and self.restpose):
-                dict_value_entry = OrderedDict()
-                dict_value_entry["value"] = value
-                channels[key][0][self.time_idx] = dict_value_entry
-                channels[key][1]["time_idx_hist"] = self.time_idx
+        for animated_property in self.get_animated_properties(animation_data,name,property):
+            if frame in self.get_action_analysis(animation_data.action)["keyframes"][(name,animated_property)]:
+                return True
+        return False
     
     def has_constraint(self,bone,const_type):
         for constraint in bone.constraints:
@@ -433,9 +450,27 @@ class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         else:
             return False
     
+    ### get node type, bone and parent of a channel from its key
+    def get_channel_info(self,key):
+        obj_name = os.path.basename(key.split(":")[0])
+        info = {"key":key,"track":os.path.basename(key.split(":")[1]),"bone":None,"sprite":None,"parent":self.sprite_object}
+        if self.armature != None and obj_name in self.armature.data.bones:
+            info["bone"] = self.armature.data.bones[obj_name]
+        if obj_name in bpy.data.objects:
+            info["sprite"] = bpy.data.objects[obj_name]
+            if len(key.split("/"+obj_name)) > 1:
+                name = os.path.basename(key.split("/"+obj_name)[0])
+                if self.armature != None and name in self.armature.data.bones:
+                    info["parent"] = self.armature.data.bones[name]
+                elif name in bpy.data.objects:
+                    info["parent"] = bpy.data.objects[name]
+        return info
+    
+    @profile_phase("sample")
     def get_action_data(self,start,end,restpose=False):
         scene = bpy.context.scene
-        self.restpose = restpose
+        ### actions are analysed once for every animation
+        self.action_analyses = {}
         channels = OrderedDict()
         if self.armature != None:
             for bone in self.armature.data.bones:
@@ -443,30 +478,30 @@ class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
                 if bone.coa_data_path == "":
                     bone.coa_data_path = "."
                 if (self.has_animation_data(self.armature.animation_data,"location",bone.name) or self.const_bone_has_anim_data(bone.name,"location") or restpose or pose_bone.is_in_ik_chain or len(pose_bone.constraints) > 0) and bone.use_deform:
-                    channels[self.get_node_path(bone,[])+":transform/pos"] = [OrderedDict(),{"node_name":bone.name,"time_idx_hist":"0.0","animation_data":self.armature.animation_data}]
+                    channels[self.get_node_path(bone)+":transform/pos"] = KeyframeTrack()
                 if (self.has_animation_data(self.armature.animation_data,"rotation",bone.name) or self.const_bone_has_anim_data(bone.name,"rotation") or restpose or pose_bone.is_in_ik_chain or len(pose_bone.constraints) > 0) and bone.use_deform:
-                    channels[self.get_node_path(bone,[])+":transform/rot"] = [OrderedDict(),{"node_name":bone.name,"time_idx_hist":"0.0","animation_data":self.armature.animation_data}]
+                    channels[self.get_node_path(bone)+":transform/rot"] = KeyframeTrack()
                 if (self.has_animation_data(self.armature.animation_data,"scale",bone.name) or self.const_bone_has_anim_data(bone.name,"scale") or restpose or pose_bone.is_in_ik_chain or len(pose_bone.constraints) > 0) and bone.use_deform:
-                    channels[self.get_node_path(bone,[])+":transform/scale"] = [OrderedDict(),{"node_name":bone.name,"time_idx_hist":"0.0","animation_data":self.armature.animation_data}]
+                    channels[self.get_node_path(bone)+":transform/scale"] = KeyframeTrack()
             
         for child in self.children:
             if child.type == "MESH":
                 if child.coa_data_path == "":
                     child.coa_data_path = "."
                 if self.has_animation_data(child.animation_data,"location") or restpose:
-                    channels[self.get_node_path(child,[])+":transform/pos"] = [OrderedDict(),{"node_name":child.name,"time_idx_hist":"0.0","animation_data":child.animation_data}]
+                    channels[self.get_node_path(child)+":transform/pos"] = KeyframeTrack()
                 if self.has_animation_data(child.animation_data,"rotation") or restpose:
-                    channels[self.get_node_path(child,[])+":transform/rot"] = [OrderedDict(),{"node_name":child.name,"time_idx_hist":"0.0","animation_data":child.animation_data}]
+                    channels[self.get_node_path(child)+":transform/rot"] = KeyframeTrack()
                 if self.has_animation_data(child.animation_data,"scale") or restpose:
-                    channels[self.get_node_path(child,[])+":transform/scale"] = [OrderedDict(),{"node_name":child.name,"time_idx_hist":"0.0","animation_data":child.animation_data}]
+                    channels[self.get_node_path(child)+":transform/scale"] = KeyframeTrack()
                 if self.has_animation_data(child.animation_data,"coa_alpha") or restpose:
-                    channels[self.get_node_path(child,[])+":visibility/opacity"] = [OrderedDict(),{"node_name":child.name,"time_idx_hist":"0.0","animation_data":child.animation_data}]
+                    channels[self.get_node_path(child)+":visibility/opacity"] = KeyframeTrack()
                 if self.has_animation_data(child.animation_data,"coa_z_value") or restpose:
-                    channels[self.get_node_path(child,[])+":z/z"] = [OrderedDict(),{"node_name":child.name,"time_idx_hist":"0.0","animation_data":child.animation_data}]
+                    channels[self.get_node_path(child)+":z/z"] = KeyframeTrack(step=True)
                 if self.has_animation_data(child.animation_data,"coa_sprite_frame") or restpose:
-                    channels[self.get_node_path(child,[])+":frame"] = [OrderedDict(),{"node_name":child.name,"time_idx_hist":"0.0","animation_data":child.animation_data}]
+                    channels[self.get_node_path(child)+":frame"] = KeyframeTrack(step=True)
                 if self.has_animation_data(child.animation_data,"coa_modulate_color") or restpose:
-                    channels[self.get_node_path(child,[])+":modulate"] = [OrderedDict(),{"node_name":child.name,"time_idx_hist":"0.0","animation_data":child.animation_data}]
+                    channels[self.get_node_path(child)+":modulate"] = KeyframeTrack()
                     
         current_frame = scene.frame_current
         if restpose:
@@ -475,174 +510,163 @@ class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         self.start = start
         self.end = end
         interval = 1
-         
+        
+        ### resolve channel metadata once, then evaluate each frame once and sample all channels from it
+        channel_infos = [self.get_channel_info(key) for key in channels]
+        bone_getters = {"pos":lambda bone: self.get_relative_bone_pos(bone,"HEAD"),"rot":self.get_bone_rotation,"scale":self.get_bone_scale}
+        sprite_getters = {"pos":lambda sprite,parent: self.get_relative_mesh_pos(parent,sprite),
+                          "rot":lambda sprite,parent: self.get_sprite_rotation(sprite),
+                          "scale":lambda sprite,parent: self.get_sprite_scale(sprite),
+                          "opacity":lambda sprite,parent: self.get_sprite_opacity(sprite),
+                          "z":lambda sprite,parent: self.get_z_value(sprite),
+                          "frame":lambda sprite,parent: self.get_sprite_frame_index(sprite),
+                          "modulate":lambda sprite,parent: self.get_modulate_color(sprite)}
+        
         for f in range(start,end+1):
-            self.f = f  
-
-            for key in channels:
-                obj_name = os.path.basename(key.split(":")[0])
-                track = os.path.basename(key.split(":")[1])
-                
-                p_bone = None
-                
-                node_type = "SPRITE"
-                if self.armature != None and obj_name in self.armature.data.bones:
-                    node_type = "BONE"
-                    p_bone = self.armature.pose.bones[obj_name]
-                elif obj_name in bpy.data.objects:
-                    node_type = "SPRITE"
-                
-                
-                if (f == start or f == end or f%interval == 0):# or (p_bone != None and (p_bone.is_in_ik_chain or self.has_constraint(p_bone,"COPY_ROTATION") or self.has_constraint(p_bone,"COPY_LOCATION"))):
-                    scene.frame_set(f)
-                    self.time_idx = str((f)/scene.render.fps)
-                    self.time_idx_last = str((f-interval)/scene.render.fps)
-                    ### write bone keyframe data
-                    if self.armature != None and obj_name in self.armature.data.bones:
-                        bone = self.armature.data.bones[obj_name]
-                        
-                        ### bone transformations
-                
-                        self.keyframe_to_dict(track,"pos",self.get_relative_bone_pos(bone,"HEAD"),channels,key)
-                        self.keyframe_to_dict(track,"rot",self.get_bone_rotation(bone),channels,key)
-                        self.keyframe_to_dict(track,"scale",self.get_bone_scale(bone),channels,key)
-                            
-                    ### write sprite keyframe data        
-                    if obj_name in bpy.data.objects:
-                        sprite = obj_name
-                        if len(key.split("/"+sprite)) > 1:
-                            name = os.path.basename(key.split("/"+sprite)[0])
-                            if name in self.armature.data.bones:
-                                parent = self.armature.data.bones[name]
-                            elif name in bpy.data.objects:
-                                parent = bpy.data.objects[name]
-                        else:
-                            parent = self.sprite_object
-                        
-                        ### sprite transformations and other properties
-                        self.keyframe_to_dict(track,"pos",self.get_relative_mesh_pos(parent,bpy.data.objects[sprite]),channels,key)
-                        self.keyframe_to_dict(track,"rot",self.get_sprite_rotation(sprite),channels,key)
-                        self.keyframe_to_dict(track,"scale",self.get_sprite_scale(sprite),channels,key)
-                        self.keyframe_to_dict(track,"opacity",self.get_sprite_opacity(sprite),channels,key)
-                        self.keyframe_to_dict(track,"z",self.get_z_value(sprite),channels,key)
-                        self.keyframe_to_dict(track,"frame",self.get_sprite_frame_index(sprite),channels,key)
-                        self.keyframe_to_dict(track,"modulate",self.get_modulate_color(sprite),channels,key)
-
+            if len(channel_infos) == 0 or not (f == start or f == end or f%interval == 0):
+                continue
+            scene.frame_set(f)
+            frame_time = f/scene.render.fps
+            
+            for info in channel_infos:
+                track = info["track"]
+                ### sample bone keyframe data
+                if info["bone"] != None and track in bone_getters:
+                    channels[info["key"]].add(frame_time,bone_getters[track](info["bone"]))
+                ### sample sprite keyframe data
+                if info["sprite"] != None and track in sprite_getters:
+                    channels[info["key"]].add(frame_time,sprite_getters[track](info["sprite"],info["parent"]))
                                      
         scene.frame_current = current_frame
         
+        ### reduce the sampled channels to the keys that change the animation
+        ### each track type has its own tolerance in the unit of its values. positions are in pixels and rotations in radians
+        tolerances = {}
+        if self.reduce_keyframes:
+            tolerances = {"pos":self.reduce_tolerance_pos,"rot":math.radians(self.reduce_tolerance_angle),"scale":self.reduce_tolerance_scale,"opacity":self.reduce_tolerance_color,"modulate":self.reduce_tolerance_color}
         export_channels = OrderedDict()
-        for key in channels:
-            export_channels[key] = channels[key][0]
+        for info in channel_infos:
+            export_channels[info["key"]] = channels[info["key"]].to_dict(tolerances.get(info["track"]))
         
         return export_channels
                     
                     
-    def execute(self, context):
-        
-        
-        
-        self.scale_multiplier = round(1/get_addon_prefs(context).sprite_import_export_scale,4)
-        
-        self.export_path = self.filepath
-        #bpy.ops.ed.undo_push(message="Export Json")
-        
-        self.bone_sprite_constraint = {}
-        self.export_dict = OrderedDict()
-        
-        self.sprite_object = get_sprite_object(context.active_object)
-        self.armature = get_armature(self.sprite_object)
-        self.children = get_children(context,self.sprite_object,[])
-        
-        if self.armature != None:
-            self.get_edit_bones(context)
-        #return{'FINISHED'}
-        ### store frame and animation state
-        if len(self.sprite_object.coa_anim_collections) > 0:
-            current_anim_collection = self.sprite_object.coa_anim_collections[self.sprite_object.coa_anim_collections_index]
-            current_time_frame = context.scene.frame_current
-            current_active_object = context.active_object
-            current_selected_objects = []
-            for obj in context.scene.objects:
-                if obj.select:
-                    current_selected_objects.append(obj)
-        
-        
-        ### start export from here
-        
-        self.export_dict["name"] = self.sprite_object.name
-        self.export_dict["changelog"] = [(time.strftime("%d/%m/%Y")+" - "+ time.strftime("%H:%M:%S"))]
-        self.export_dict["nodes"] = []
-        
-        
-        ### export armature with bones and attached sprites
-        if self.armature != None:
-            for child in self.children:   
-            #for child in self.armature.children:
-                if child in self.armature.children:
-                    if child.type == "MESH":
-                        bone = self.get_bone_sprites(child,self.armature)
-                        if bone not in self.bone_sprite_constraint:
-                            self.bone_sprite_constraint[bone] = []
-                        if child.name not in self.bone_sprite_constraint[bone]:
-                            self.bone_sprite_constraint[bone].append(child.name)
+    ### write the node and animation data into the json stream
+    def write_export_data(self,context,writer):
+        writer.begin_object()
+        writer.write(self.sprite_object.name,"name")
+        writer.write([(time.strftime("%d/%m/%Y")+" - "+ time.strftime("%H:%M:%S"))],"changelog")
+        with export_profiler.phase("nodes"):
+            writer.begin_array("nodes")
+        
+        
+            ### export armature with bones and attached sprites
+            if self.armature != None:
+                for child in self.children:   
+                #for child in self.armature.children:
+                    if child in self.armature.children:
+                        if child.type == "MESH":
+                            bone = self.get_sprite_bone(child)
+                            if bone not in self.bone_sprite_constraint:
+                                self.bone_sprite_constraint[bone] = []
+                            if child.name not in self.bone_sprite_constraint[bone]:
+                                self.bone_sprite_constraint[bone].append(child.name)
                 
-            for bone in self.armature.data.bones:
-                if bone.name not in self.bone_sprite_constraint:
-                    self.bone_sprite_constraint[bone.name] = []
+                for bone in self.armature.data.bones:
+                    if bone.name not in self.bone_sprite_constraint:
+                        self.bone_sprite_constraint[bone.name] = []
             
-            for bone in self.armature.data.bones:
-                if bone.parent == None:
-                    if bone.name in self.bone_sprite_constraint:
-                        self.export_dict["nodes"].append(self.armature_to_dict(bone))     
-        
-        ### export sprites that are not attached to any armature
-        for child in self.sprite_object.children:
-            if child.type == "MESH":
-                self.export_dict["nodes"].append(self.sprite_to_dict(child.name,self.sprite_object))
+                for bone in self.armature.data.bones:
+                    if bone.parent == None:
+                        if bone.name in self.bone_sprite_constraint:
+                            writer.write(self.armature_to_dict(bone))
+        
+            ### export sprites that are not attached to any armature
+            for child in self.sprite_object.children:
+                if child.type == "MESH":
+                    writer.write(self.sprite_to_dict(child.name,self.sprite_object))
+            writer.end_array()
+        with export_profiler.phase("texture_encode"):
+            self.texture_encoder.write()
         
         ### animation export
-        if self.export_anims:
-            self.export_dict["animations"] = []
-            if len(self.sprite_object.coa_anim_collections) > 0:
-                for anim_collection in self.sprite_object.coa_anim_collections:
-                    if anim_collection.name != "NO ACTION":
-                        self.report({'INFO'},str("Exporting "+anim_collection.name)+" Animation")
+        with export_profiler.phase("animation"):
+            if self.export_anims:
+                writer.begin_array("animations")
+                if len(self.sprite_object.coa_anim_collections) > 0:
+                    for anim_collection in self.sprite_object.coa_anim_collections:
+                        if anim_collection.name != "NO ACTION":
+                            with export_profiler.phase(anim_collection.name):
+                                self.report({'INFO'},str("Exporting "+anim_collection.name)+" Animation")
                         
-                        set_action(context,item=self.sprite_object.coa_anim_collections[1])
-                        set_action(context,item=anim_collection)
+                                set_action(context,item=self.sprite_object.coa_anim_collections[1])
+                                set_action(context,item=anim_collection)
                         
-                        animation = OrderedDict()
-                        animation["name"] = anim_collection.name
-                        animation["fps"] = context.scene.render.fps
-                        animation["start"] = (anim_collection.frame_start-1)/context.scene.render.fps
-                        animation["length"] = (anim_collection.frame_end)/context.scene.render.fps
-                        animation["keyframes"] = OrderedDict()
+                                animation = OrderedDict()
+                                animation["name"] = anim_collection.name
+                                animation["fps"] = context.scene.render.fps
+                                animation["start"] = (anim_collection.frame_start-1)/context.scene.render.fps
+                                animation["length"] = (anim_collection.frame_end)/context.scene.render.fps
+                                animation["keyframes"] = OrderedDict()
                         
-                        baked_actions = self.get_collection_action(context,anim_collection)
-                        all_channels = OrderedDict()
+                                baked_actions = self.get_collection_action(context,anim_collection)
                         
-                        if anim_collection.name == "Restpose" and self.armature != None:
-                            self.armature.data.pose_position = "REST"
-                            channels = self.get_action_data(anim_collection.frame_start,anim_collection.frame_end,restpose=True)
-                            self.armature.data.pose_position = "POSE"
-                        else:
-                            channels = self.get_action_data(anim_collection.frame_start,anim_collection.frame_end)
-                        #channels = self.get_action_data(anim_collection.frame_start,anim_collection.frame_end)
-                        for key in channels:
-                            all_channels[key] = channels[key]
-                        animation["keyframes"] = channels
-                        self.export_dict["animations"].append(animation)
+                                if anim_collection.name == "Restpose" and self.armature != None:
+                                    self.armature.data.pose_position = "REST"
+                                    channels = self.get_action_data(anim_collection.frame_start,anim_collection.frame_end,restpose=True)
+                                    self.armature.data.pose_position = "POSE"
+                                else:
+                                    channels = self.get_action_data(anim_collection.frame_start,anim_collection.frame_end)
+                                animation["keyframes"] = channels
+                                writer.write(animation)
+                writer.end_array()
                         
-            if len(self.sprite_object.coa_anim_collections) > 1:
-                set_action(context)
-        ### generate json file with a pretty print settings
-        json_file = json.dumps(self.export_dict, indent="\t", sort_keys=False)
-        #print(json_file)
+                if len(self.sprite_object.coa_anim_collections) > 1:
+                    set_action(context)
+        writer.end_object()
+    
+    def execute(self, context):
+        if not texture_format_supported(self.texture_format):
+            self.report({'ERROR'},"WebP export needs the Pillow module in the python of Blender.")
+            return {"CANCELLED"}
+        if self.profile_export:
+            export_profiler.start()
+        ### profiling is stopped even if the export fails, so the next export starts with fresh timings
+        try:
+            self.scale_multiplier = round(1/get_addon_prefs(context).sprite_import_export_scale,4)
+        
+            self.export_path = self.filepath
+            self.texture_encoder = TextureEncoder(self.png_compression,self.png_filter,self.texture_format,self.webp_quality)
+            #bpy.ops.ed.undo_push(message="Export Json")
+        
+            self.bone_sprite_constraint = {}
+            self.image_scales = {}
+        
+            self.sprite_object = get_sprite_object(context.active_object)
+            self.armature = get_armature(self.sprite_object)
+            self.children = get_children(context,self.sprite_object,[])
+        
+            if self.armature != None:
+                self.get_edit_bones(context)
+            self.build_node_paths()
+            #return{'FINISHED'}
+            ### store frame and animation state
+            if len(self.sprite_object.coa_anim_collections) > 0:
+                current_anim_collection = self.sprite_object.coa_anim_collections[self.sprite_object.coa_anim_collections_index]
+                current_time_frame = context.scene.frame_current
+                current_active_object = context.active_object
+                current_selected_objects = []
+                for obj in context.scene.objects:
+                    if obj.select:
+                        current_selected_objects.append(obj)
         
-        text_file = open(self.export_path, "w")
-        text_file.write(json_file)
-        text_file.close()
+        
+            ### start export from here. json data is streamed into a temporary file while it is generated. the export file is only replaced when the export succeeds
+            with open_export_file(self.export_path) as text_file:
+                self.write_export_data(context,JsonStreamWriter(text_file))
+        finally:
+            if self.profile_export:
+                export_profiler.stop()
         
         
         ### restore frame and animation state
@@ -653,7 +677,11 @@ class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
             for obj in current_selected_objects:
                 obj.select = True
         
-        self.report({'INFO'},"Json Export done.")
+        if self.profile_export:
+            export_profiler.write_report(self.export_path)
+            self.report({'INFO'},export_profiler.get_summary())
+        else:
+            self.report({'INFO'},"Json Export done.")
         bpy.ops.ed.undo_push(message="Export Json")
         return {"FINISHED"}
         
\ No newline at end of file
@@ -0,0 +1,178 @@
+'''
+Copyright (C) 2015 Andreas Esau
+andreasesau@gmail.com
+
+Created by Andreas Esau
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import io
+import zlib
+import struct
+import shutil
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+png_filter_items = (("NONE","None","No filter. Fastest encoding"),("SUB","Sub","Predict each pixel from its left neighbour"),("UP","Up","Predict each pixel from the pixel above"),("AVERAGE","Average","Predict each pixel from the average of its left and upper neighbours"),("PAETH","Paeth","Predict each pixel with the paeth predictor"),("ADAPTIVE","Adaptive","Choose the filter with the smallest result for each row. Smallest files"))
+png_filter_types = ["NONE","SUB","UP","AVERAGE","PAETH"]
+texture_format_items = (("PNG","PNG","Copy image files and write all other images as png"),("PNG_PREMULTIPLIED","PNG Premultiplied Alpha","Write all images as png with premultiplied alpha"),("WEBP_LOSSLESS","WebP Lossless","Write all images as lossless webp. Needs the Pillow module"),("WEBP","WebP","Write all images as lossy webp with the given quality. Needs the Pillow module"))
+texture_extensions = {"PNG":".png","PNG_PREMULTIPLIED":".png","WEBP_LOSSLESS":".webp","WEBP":".webp"}
+
+### webp is encoded with Pillow if it is installed in blenders python
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+def texture_format_supported(texture_format):
+    return not texture_format.startswith("WEBP") or Image != None
+
+### change the extension of a texture path to the extension of the texture format
+def get_texture_path(path,texture_format):
+    return os.path.splitext(path)[0] + texture_extensions[texture_format]
+
+### get image pixels as (height x width x 4) float array. rows are stored bottom up like in blender
+def get_image_pixels(img):
+    pixels = np.array(img.pixels[:],dtype=np.float32)
+    return pixels.reshape((img.size[1],img.size[0],4))
+
+def get_png_chunk(chunk_type,data):
+    chunk = chunk_type + data
+    return struct.pack(">I",len(data)) + chunk + struct.pack(">I",zlib.crc32(chunk) & 0xffffffff)
+
+def paeth_predictor(a,b,c):
+    p = a + b - c
+    pa = np.abs(p - a)
+    pb = np.abs(p - b)
+    pc = np.abs(p - c)
+    return np.where((pa <= pb) & (pa <= pc),a,np.where(pb <= pc,b,c))
+
+### apply png row filters to (height x width*4) uint8 rows. returns the rows with a leading filter type byte
+def filter_png_rows(rows,png_filter):
+    raw = rows.astype(np.int16)
+    left = np.zeros_like(raw)
+    left[:,4:] = raw[:,:-4]
+    up = np.zeros_like(raw)
+    up[1:] = raw[:-1]
+    upper_left = np.zeros_like(raw)
+    upper_left[1:,4:] = raw[:-1,:-4]
+
+    predictors = {"NONE":0,"SUB":left,"UP":up,"AVERAGE":(left + up) // 2}
+    if png_filter in ["PAETH","ADAPTIVE"]:
+        predictors["PAETH"] = paeth_predictor(left,up,upper_left)
+    filter_names = png_filter_types if png_filter == "ADAPTIVE" else [png_filter]
+    filtered = [((raw - predictors[name]) & 0xff).astype(np.uint8) for name in filter_names]
+
+    if png_filter == "ADAPTIVE":
+        ### minimum sum of absolute differences heuristic
+        costs = np.array([np.abs(data.view(np.int8).astype(np.int32)).sum(axis=1) for data in filtered])
+        choice = np.argmin(costs,axis=0)
+        data = np.choose(choice[:,None],filtered)
+        types = choice
+    else:
+        data = filtered[0]
+        types = png_filter_types.index(png_filter)
+
+    out = np.empty((rows.shape[0],rows.shape[1]+1),dtype=np.uint8)
+    out[:,0] = types
+    out[:,1:] = data
+    return out
+
+### encode blender pixels as 8 bit rgba png
+def encode_png(pixels,compression=6,png_filter="ADAPTIVE"):
+    height,width = pixels.shape[:2]
+    rows = np.clip(pixels[::-1]*255 + 0.5,0,255).astype(np.uint8).reshape((height,width*4))
+    data = filter_png_rows(rows,png_filter).tobytes()
+    png = b"\x89PNG\r\n\x1a\n"
+    png += get_png_chunk(b"IHDR",struct.pack(">IIBBBBB",width,height,8,6,0,0,0))
+    png += get_png_chunk(b"IDAT",zlib.compress(data,compression))
+    png += get_png_chunk(b"IEND",b"")
+    return png
+
+def write_file(path,data):
+    out_file = open(path,"wb")
+    out_file.write(data)
+    out_file.close()
+    return path
+
+### encode blender pixels as 8 bit rgba webp
+def encode_webp(pixels,lossless=True,quality=80):
+    height,width = pixels.shape[:2]
+    rows = np.clip(pixels[::-1]*255 + 0.5,0,255).astype(np.uint8)
+    img = Image.frombytes("RGBA",(width,height),rows.tobytes())
+    webp_file = io.BytesIO()
+    img.save(webp_file,"WEBP",lossless=lossless,quality=quality)
+    return webp_file.getvalue()
+
+def encode_texture_file(path,pixels,texture_format,compression,png_filter,webp_quality):
+    if texture_format == "PNG_PREMULTIPLIED":
+        pixels = pixels.copy()
+        pixels[:,:,:3] *= pixels[:,:,3:]
+    if texture_format.startswith("WEBP"):
+        data = encode_webp(pixels,texture_format == "WEBP_LOSSLESS",webp_quality)
+    else:
+        data = encode_png(pixels,compression,png_filter)
+    return write_file(path,data)
+
+### collects images that have to be encoded and writes them in a thread pool.
+### pixels are read on the main thread, filtering and compression run in the workers
+class TextureEncoder():
+    def __init__(self,compression=6,png_filter="ADAPTIVE",texture_format="PNG",webp_quality=80,max_workers=None):
+        self.compression = compression
+        self.png_filter = png_filter
+        self.texture_format = texture_format
+        self.webp_quality = webp_quality
+        self.max_workers = max_workers or min(8,os.cpu_count() or 1)
+        self.images = OrderedDict()
+
+    ### image files are copied as they are when writing plain png
+    def copies_files(self):
+        return self.texture_format == "PNG"
+    
+    ### queue an image. returns the path it is written to, with the extension of the texture format
+    def add(self,img,path):
+        path = get_texture_path(path,self.texture_format)
+        self.images[path] = img
+        return path
+    
+    ### resource of an image in res_dir_path. image files are copied or queued under their file name, images without a file are queued under the given name.
+    ### returns the path the resource is written to
+    def add_resource(self,img,src_path,res_dir_path,name):
+        if not os.path.isfile(src_path):
+            return self.add(img,os.path.join(res_dir_path,name))
+        dst_path = os.path.join(res_dir_path,os.path.basename(src_path))
+        if self.copies_files():
+            shutil.copy(src_path,dst_path)
+            return dst_path
+        return self.add(img,dst_path)
+
+    def write(self):
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        jobs = []
+        for path in self.images:
+            img = self.images[path]
+            if os.path.isfile(path):
+                os.remove(path)
+            if img.packed_file != None and img.file_format == "PNG" and self.texture_format == "PNG":
+                ### packed pngs are written as they are
+                jobs.append(pool.submit(write_file,path,img.packed_file.data))
+            else:
+                jobs.append(pool.submit(encode_texture_file,path,get_image_pixels(img),self.texture_format,self.compression,self.png_filter,self.webp_quality))
+        paths = [job.result() for job in jobs]
+        pool.shutdown()
+        self.images.clear()
+        return paths
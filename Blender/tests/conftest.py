@@ -0,0 +1,5 @@
+import os
+import sys
+
+### the bpy free helper modules of the addon are imported directly, without the addon package that needs blender
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"coa_tools"))
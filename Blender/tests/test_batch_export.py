@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import stat
+
+import pytest
+
+import batch_export
+from batch_export import get_script_args, get_arg_parser, get_worker_args, find_blend_files, run_blend_file, run_batch, result_prefix
+
+
+### stand-in for the blender executable. it reports results depending on the name of the .blend file
+fake_blender = """#!{python}
+import sys, json, time
+blend_file = sys.argv[2]
+prefix = {prefix!r}
+if "crash" in blend_file:
+    print("Segmentation fault")
+    sys.exit(3)
+if "hang" in blend_file:
+    time.sleep(10)
+print("Read blend: " + blend_file)
+print(prefix + json.dumps({{"blend_file":blend_file,"sprite_object":"Stip","format":"dragonbones","status":"FINISHED"}}))
+if "broken" in blend_file:
+    print(prefix + json.dumps({{"blend_file":blend_file,"sprite_object":"Stip","format":"json","status":"FAILED","error":"export failed"}}))
+    sys.exit(1)
+"""
+
+@pytest.fixture
+def blender(tmp_path):
+    path = str(tmp_path/"blender")
+    with open(path,"w") as blender_file:
+        blender_file.write(fake_blender.format(python=sys.executable,prefix=result_prefix))
+    os.chmod(path,os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+def make_blend_files(directory,names):
+    paths = []
+    for name in names:
+        path = directory/name
+        path.parent.mkdir(parents=True,exist_ok=True)
+        path.write_bytes(b"BLENDER")
+        paths.append(str(path))
+    return paths
+
+def parse_args(argv):
+    return get_arg_parser().parse_args(get_script_args(argv))
+
+
+### argument handling
+def test_script_args_are_read_after_double_dash():
+    assert get_script_args(["blender","-b","--python","batch_export.py","--","a.blend","-j","2"]) == ["a.blend","-j","2"]
+    assert get_script_args(["blender","-b","--python","batch_export.py"]) == []
+
+def test_arg_defaults():
+    args = parse_args(["blender","--","a.blend"])
+    assert args.paths == ["a.blend"]
+    assert args.format == ["dragonbones"]
+    assert args.atlas_size == None
+    assert not args.worker
+
+def test_worker_args_pass_export_options_through():
+    args = parse_args(["blender","--","a.blend","--format","dragonbones","json","--bake","--bake-interval","3","--reduce-keyframes","--binary","--atlas","--atlas-size","512","256"])
+    worker_args = parse_args(["blender","--"]+get_worker_args(args,"out/a"))
+    assert worker_args.worker
+    assert worker_args.output == "out/a"
+    assert worker_args.format == ["dragonbones","json"]
+    assert worker_args.bake and worker_args.reduce_keyframes and worker_args.atlas and worker_args.binary
+    assert not worker_args.reduce_size
+    assert worker_args.bake_interval == 3
+    assert worker_args.atlas_size == [512,256]
+
+def test_find_blend_files(tmp_path):
+    blend_files = make_blend_files(tmp_path,["b.blend","a.blend","sub/c.blend"])
+    (tmp_path/"notes.txt").write_text("")
+    assert find_blend_files([str(tmp_path)]) == [blend_files[1],blend_files[0],blend_files[2]]
+    assert find_blend_files([str(tmp_path/"notes.txt"),str(tmp_path/"missing.blend")]) == []
+
+
+### failure reporting
+def test_run_blend_file_collects_worker_results(tmp_path,blender):
+    blend_file = make_blend_files(tmp_path,["broken.blend"])[0]
+    results = run_blend_file(blender,blend_file,parse_args(["blender","--","-o",str(tmp_path)]))
+    assert [result["status"] for result in results] == ["FINISHED","FAILED"]
+    assert results[1]["error"] == "export failed"
+
+def test_run_blend_file_reports_crashed_instance(tmp_path,blender):
+    blend_file = make_blend_files(tmp_path,["crash.blend"])[0]
+    results = run_blend_file(blender,blend_file,parse_args(["blender","--","-o",str(tmp_path)]))
+    assert len(results) == 1
+    assert results[0]["status"] == "FAILED"
+    assert results[0]["error"] == "Blender exited with code 3"
+    assert "Segmentation fault" in results[0]["log"]
+
+def test_run_blend_file_reports_timeout(tmp_path,blender):
+    blend_file = make_blend_files(tmp_path,["hang.blend"])[0]
+    results = run_blend_file(blender,blend_file,parse_args(["blender","--","-o",str(tmp_path),"--timeout","0.5"]))
+    assert [(result["status"],result["error"]) for result in results] == [("FAILED","timeout")]
+
+def test_run_batch_writes_report_and_fails_if_one_file_fails(tmp_path,blender,capsys):
+    blend_files = make_blend_files(tmp_path/"blends",["good.blend","crash.blend"])
+    output = tmp_path/"export"
+    args = parse_args(["blender","--",str(tmp_path/"blends"),"-o",str(output),"--blender",blender,"-j","2"])
+    assert run_batch(args) == 1
+    
+    report = json.loads((output/"batch_report.json").read_text())
+    assert [(result["blend_file"],result["status"]) for result in report] == [(blend_files[1],"FAILED"),(blend_files[0],"FINISHED")]
+    lines = capsys.readouterr().out.splitlines()
+    assert "{}: 1 exports, 1 failed".format(blend_files[1]) in lines
+    assert "{}: 1 exports, 0 failed".format(blend_files[0]) in lines
+
+def test_run_batch_succeeds_if_all_exports_finish(tmp_path,blender):
+    make_blend_files(tmp_path/"blends",["good.blend"])
+    args = parse_args(["blender","--",str(tmp_path/"blends"),"-o",str(tmp_path/"export"),"--blender",blender])
+    assert run_batch(args) == 0
+
+def test_run_batch_without_blend_files(tmp_path):
+    assert run_batch(parse_args(["blender","--",str(tmp_path),"-o",str(tmp_path/"export")])) == 1
@@ -0,0 +1,221 @@
+import io
+import copy
+import json
+import math
+import struct
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from export_utils import DragonBonesBinaryWriter, binary_timeline_types, invert_matrix, transform_point
+
+
+### reads the arrays of a dbbin file the same way the DragonBones runtimes do
+def read_dbbin(data):
+    assert data[:4] == b"DBDT"
+    header_length = struct.unpack("<I",data[8:12])[0]
+    header = json.loads(data[12:12+header_length].decode("utf-8"))
+    binary_offset = 12+header_length
+    arrays = {}
+    for i,(name,dtype) in enumerate([("int","<i2"),("float","<f4"),("frame_int","<i2"),("frame_float","<f4"),("frame","<i2"),("timeline","<u2")]):
+        offset = binary_offset + header["offset"][i*2]
+        assert offset % 4 == 0
+        arrays[name] = np.frombuffer(data,dtype=dtype,count=header["offset"][i*2+1]//np.dtype(dtype).itemsize,offset=offset)
+    return header,arrays
+
+head_display = OrderedDict([("type","mesh"),("name","sprites/head"),("path","sprites/head"),("userEdges",[]),("width",64),("height",64),
+    ("vertices",[-100,100,100,100,100,-100,-100,-100]),("edges",[0,1,1,2,2,3,3,0]),("triangles",[0,1,2,0,2,3]),("uvs",[0.0,0.0,1.0,0.0,1.0,1.0,0.0,1.0]),
+    ("transform",{"x":10.0,"y":-5.0})])
+arm_display = OrderedDict([("type","mesh"),("name","sprites/arm"),("path","sprites/arm"),("userEdges",[]),("width",32),("height",32),
+    ("vertices",[0,0,100,0,100,50]),("edges",[0,1,1,2,2,0]),("triangles",[0,1,2]),("uvs",[0.0,0.0,1.0,0.0,1.0,1.0]),
+    ("weights",[1,1,1.0,2,1,0.25,2,0.75,1,2,1.0]),("bonePose",[1,1.0,0.0,0.0,1.0,20.0,0.0,2,0.0,1.0,-1.0,0.0,100.0,0.0]),("slotPose",[1.0,0.0,0.0,1.0,5.0,5.0]),
+    ("transform",{"x":5.0,"y":5.0})])
+
+def get_animation():
+    anim = OrderedDict([("name","wave"),("duration",10),("playTimes",1)])
+    anim["bone"] = [{"name":"upper","frame":[
+        {"duration":5,"tweenEasing":0,"transform":{"skX":170,"skY":170}},
+        {"duration":5,"tweenEasing":0,"transform":{"x":3.0,"y":4.0,"skX":-170,"skY":-170,"scX":2.0,"scY":0.5}},
+        {"duration":10,"tweenEasing":0,"transform":{}}]}]
+    anim["slot"] = [{"name":"head","frame":[
+        {"duration":4,"displayIndex":0,"color":{"aM":50},"tweenEasing":0.0},
+        {"duration":4,"displayIndex":1,"color":{},"tweenEasing":0.0}]}]
+    anim["ffd"] = [
+        {"name":"sprites/head","slot":"head","offset":0,"scale":1,"skin":"","frame":[{"duration":10,"tweenEasing":0,"vertices":[1,2,3,4]},{"duration":10,"tweenEasing":0}]},
+        {"name":"sprites/arm","slot":"arm","offset":0,"scale":1,"skin":"","frame":[{"duration":10,"tweenEasing":0,"vertices":[0,0,10,0,0,10]}]},
+        {"name":"sprites/missing","slot":"head","offset":0,"scale":1,"skin":"","frame":[{"duration":10,"tweenEasing":0}]}]
+    anim["frame"] = [{"duration":3},{"duration":7,"action":"","event":"step","sound":"stomp"}]
+    return anim
+
+### write a document with the calls DragonBonesExport.write_export_data makes
+def write_document(writer,anim):
+    writer.begin_object()
+    writer.write("4.5","version")
+    writer.write("stip","name")
+    writer.begin_array("armature")
+    writer.begin_object()
+    writer.write("stip","name")
+    writer.begin_array("slot")
+    writer.write({"name":"head","parent":"Armature"})
+    writer.write({"name":"arm","parent":"Armature"})
+    writer.end_array()
+    writer.begin_array("skin")
+    writer.begin_object()
+    writer.write("","name")
+    writer.begin_array("slot")
+    writer.write({"name":"head","display":[head_display]})
+    writer.write({"name":"arm","display":[arm_display]})
+    writer.end_array()
+    writer.end_object()
+    writer.end_array()
+    writer.begin_array("bone")
+    for name in ["Armature","upper","lower"]:
+        writer.write({"name":name,"transform":{}})
+    writer.end_array()
+    writer.write([],"ik")
+    writer.begin_array("animation")
+    writer.write(anim)
+    writer.end_array()
+    writer.end_object()
+    writer.end_array()
+    writer.end_object()
+
+@pytest.fixture
+def dbbin():
+    writer = DragonBonesBinaryWriter()
+    write_document(writer,get_animation())
+    assert writer.fits_format()
+    data = io.BytesIO()
+    writer.write_file(data)
+    return read_dbbin(data.getvalue())
+
+def get_timeline(header,arrays,offset):
+    anim_offsets = header["armature"][0]["animation"][0]["offset"]
+    timeline = arrays["timeline"]
+    key_count = timeline[offset+2]
+    frames = [anim_offsets[2] + timeline[offset+5+i] for i in range(key_count)]
+    return timeline[offset:offset+5].tolist(),frames
+
+
+def test_header_keeps_json_structure_without_mesh_arrays(dbbin):
+    header,arrays = dbbin
+    assert header["version"] == "5.5"
+    assert header["compatibleVersion"] == "5.5"
+    armature = header["armature"][0]
+    assert [bone["name"] for bone in armature["bone"]] == ["Armature","upper","lower"]
+    display = armature["skin"][0]["slot"][0]["display"][0]
+    assert display["name"] == "sprites/head"
+    assert display["transform"] == {"x":10.0,"y":-5.0}
+    for key in ["vertices","uvs","triangles","edges","weights","bonePose","slotPose"]:
+        assert key not in display
+
+def test_mesh_arrays(dbbin):
+    header,arrays = dbbin
+    int_array,float_array = arrays["int"],arrays["float"]
+    offset = header["armature"][0]["skin"][0]["slot"][0]["display"][0]["offset"]
+    vertex_count,triangle_count,float_offset,weight_offset = int_array[offset:offset+4]
+    assert (vertex_count,triangle_count,weight_offset) == (4,2,-1)
+    assert int_array[offset+4:offset+10].tolist() == head_display["triangles"]
+    assert float_array[float_offset:float_offset+8].tolist() == head_display["vertices"]
+    assert float_array[float_offset+8:float_offset+16].tolist() == head_display["uvs"]
+
+def test_weighted_vertices_are_stored_relative_to_their_bones(dbbin):
+    header,arrays = dbbin
+    int_array,float_array = arrays["int"],arrays["float"]
+    offset = header["armature"][0]["skin"][0]["slot"][1]["display"][0]["offset"]
+    assert int_array[offset] == 3
+    weight_offset = int_array[offset+3]
+    bone_count,float_offset = int_array[weight_offset:weight_offset+2]
+    assert int_array[weight_offset+2:weight_offset+2+bone_count].tolist() == [1,2]
+
+    ### skinning the stored vertices with the bone poses gives the vertices in armature space
+    bone_poses = [arm_display["bonePose"][1:7],arm_display["bonePose"][8:14]]
+    index = weight_offset+2+bone_count
+    for vertex in range(3):
+        x,y = 0.0,0.0
+        for j in range(int_array[index]):
+            bone = int_array[index+1+j]
+            weight,local_x,local_y = float_array[float_offset:float_offset+3]
+            float_offset += 3
+            bone_x,bone_y = transform_point(bone_poses[bone],local_x,local_y)
+            x += bone_x*weight
+            y += bone_y*weight
+        index += 1+int_array[index]
+        expected = transform_point(arm_display["slotPose"],*arm_display["vertices"][vertex*2:vertex*2+2])
+        assert (x,y) == pytest.approx(expected,abs=1e-4)
+
+def test_bone_timeline(dbbin):
+    header,arrays = dbbin
+    anim = header["armature"][0]["animation"][0]
+    assert anim["duration"] == 10
+    timeline_type,offset = anim["bone"]["upper"]
+    assert timeline_type == binary_timeline_types["bone"]
+    timeline,frames = get_timeline(header,arrays,offset)
+    assert timeline[:4] == [100,0,3,6]
+    ### positions and tween types. the last keyframe ends the animation and has no tween
+    assert [arrays["frame"][frame] for frame in frames] == [0,5,10]
+    assert [arrays["frame"][frame+1] for frame in frames] == [1,1,0]
+
+    values = arrays["frame_float"][anim["offset"][1]+timeline[4]:][:18].reshape((3,6))
+    assert values[0] == pytest.approx([0,0,math.radians(170),0,1,1])
+    ### the rotation keeps turning the short way over 180 degrees
+    assert values[1] == pytest.approx([3,4,math.radians(190),0,2,0.5])
+    ### and back to 0 the short way from 190 degrees
+    assert values[2] == pytest.approx([0,0,math.radians(360),0,1,1],abs=1e-6)
+
+def test_slot_timelines(dbbin):
+    header,arrays = dbbin
+    anim = header["armature"][0]["animation"][0]
+    timelines = anim["slot"]["head"]
+    assert timelines[0::2] == [binary_timeline_types["display"],binary_timeline_types["color"],binary_timeline_types["ffd"]]
+
+    timeline,frames = get_timeline(header,arrays,timelines[1])
+    assert [arrays["frame"][frame:frame+2].tolist() for frame in frames] == [[0,0],[4,1]]
+
+    timeline,frames = get_timeline(header,arrays,timelines[3])
+    assert timeline[2:4] == [2,1]
+    color_offsets = arrays["frame_int"][anim["offset"][0]+timeline[4]:][:2]
+    assert [arrays["int"][offset:offset+8].tolist() for offset in color_offsets] == [[50,100,100,100,0,0,0,0],[100,100,100,100,0,0,0,0]]
+
+def test_ffd_timelines(dbbin):
+    header,arrays = dbbin
+    anim = header["armature"][0]["animation"][0]
+    skin_slots = header["armature"][0]["skin"][0]["slot"]
+
+    ### unknown meshes get no timeline
+    assert len(anim["slot"]["head"]) == 6
+    for slot,timeline_offset in [(0,anim["slot"]["head"][5]),(1,anim["slot"]["arm"][1])]:
+        timeline,frames = get_timeline(header,arrays,timeline_offset)
+        mesh_offset,deform_count,value_count,value_offset,float_offset = arrays["frame_int"][anim["offset"][0]+timeline[3]:][:5]
+        assert mesh_offset == skin_slots[slot]["display"][0]["offset"]
+        assert (deform_count,value_offset) == (value_count,0)
+        values = arrays["frame_float"][anim["offset"][1]+timeline[4]:][:value_count*len(frames)].reshape((len(frames),value_count))
+        if slot == 0:
+            assert value_count == 8
+            assert values.tolist() == [[1,2,3,4,0,0,0,0],[0]*8]
+        else:
+            ### one offset per bone of each vertex, rotated into the space of the bone
+            inverted = invert_matrix(arm_display["bonePose"][8:14])
+            expected = [0,0,10,0] + list(transform_point(inverted,10,0,delta=True)) + list(transform_point(inverted,0,10,delta=True))
+            assert value_count == 8
+            assert values[0] == pytest.approx(expected)
+
+def test_events_are_stored_as_actions(dbbin):
+    header,arrays = dbbin
+    armature = header["armature"][0]
+    assert armature["actions"] == [{"type":10,"name":"step"},{"type":11,"name":"stomp"}]
+    timeline,frames = get_timeline(header,arrays,armature["animation"][0]["action"])
+    assert [arrays["frame"][frame:frame+2+arrays["frame"][frame+1]].tolist() for frame in frames] == [[0,0],[3,2,0,1]]
+
+def test_source_data_is_not_changed():
+    anim = get_animation()
+    expected = copy.deepcopy((head_display,arm_display,anim))
+    write_document(DragonBonesBinaryWriter(),anim)
+    assert (head_display,arm_display,anim) == expected
+
+def test_fits_format_checks_16_bit_offsets():
+    writer = DragonBonesBinaryWriter()
+    writer.arrays["float"].extend([0.0]*70000)
+    write_document(writer,get_animation())
+    assert not writer.fits_format()
@@ -0,0 +1,309 @@
+import io
+import os
+import json
+import hashlib
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import export_utils
+from export_utils import JsonStreamWriter, KeyframeTrack, reduce_frames, pack_rects, pack_rect_pages, fit_page_size, get_trim_bounds
+from export_utils import update_hash, update_hash_array, update_action_hash, sync_texture, sync_textures, load_texture_manifest, open_export_file
+from export_utils import convert_vertex_data, get_mesh_arrays, get_edge_data, get_triangle_data, get_uv_data
+
+
+### stand-in for a bpy collection that supports foreach_get
+class Collection(list):
+    def foreach_get(self,attr,values):
+        values[:] = np.array([getattr(item,attr) for item in self],dtype=values.dtype).ravel()
+
+def make_action(keyframes,interpolation="BEZIER",name="walk"):
+    points = Collection(SimpleNamespace(co=co,handle_left=(co[0]-1,co[1]),handle_right=(co[0]+1,co[1]),interpolation=interpolation) for co in keyframes)
+    fcurve = SimpleNamespace(data_path='pose.bones["Arm"].location',array_index=0,extrapolation="CONSTANT",mute=False,modifiers=[],keyframe_points=points)
+    return SimpleNamespace(name=name,fcurves=[fcurve])
+
+def get_action_hash(action):
+    data_hash = hashlib.md5()
+    update_action_hash(data_hash,action)
+    return data_hash.hexdigest()
+
+
+### JsonStreamWriter
+def write_document(writer):
+    writer.begin_object()
+    writer.write("sprite","name")
+    writer.begin_array("slot")
+    writer.write({"name":"head","color":{"aM":50}})
+    writer.write({"name":"arm","displayIndex":1})
+    writer.end_array()
+    writer.begin_array("empty")
+    writer.end_array()
+    writer.write([1,2.5,None],"values")
+    writer.end_object()
+
+@pytest.mark.parametrize("compact",[False,True])
+def test_json_stream_writer_matches_json_dumps(compact):
+    expected = OrderedDict()
+    expected["name"] = "sprite"
+    expected["slot"] = [{"name":"head","color":{"aM":50}},{"name":"arm","displayIndex":1}]
+    expected["empty"] = []
+    expected["values"] = [1,2.5,None]
+    
+    text_file = io.StringIO()
+    write_document(JsonStreamWriter(text_file,compact=compact))
+    if compact:
+        assert text_file.getvalue() == json.dumps(expected,separators=(',',':'))
+    else:
+        assert text_file.getvalue() == json.dumps(expected,indent="\t")
+
+
+### KeyframeTrack
+def test_keyframe_track_keeps_first_and_last_key_of_held_values():
+    track = KeyframeTrack()
+    for i,value in enumerate([0,0,0,1,1,2]):
+        track.add(i,value)
+    assert track.to_dict() == {"times":[0,2,3,4,5],"values":[0,0,1,1,2]}
+
+def test_keyframe_track_drops_linear_keys():
+    track = KeyframeTrack()
+    for i in range(5):
+        track.add(i*0.1,[i*2.0,1.0])
+    track.add(0.5,[0.0,1.0])
+    keys = track.to_dict(0.001)
+    assert keys["times"] == [0.0,0.4,0.5]
+    assert keys["values"] == [[0.0,1.0],[8.0,1.0],[0.0,1.0]]
+
+def test_keyframe_track_without_keys():
+    track = KeyframeTrack()
+    assert track.to_dict(0.01) == {"times":[],"values":[]}
+    assert track.to_dict() == {"times":[],"values":[]}
+
+def test_step_track_ignores_tolerance():
+    track = KeyframeTrack(step=True)
+    for i,value in enumerate([0,1,2,3]):
+        track.add(i,value)
+    assert track.to_dict(10.0)["values"] == [0,1,2,3]
+
+
+### keyframe reduction
+def test_reduce_frames_removes_interpolated_keyframes():
+    frames = [{"duration":1},{"duration":1},{"duration":1},{"duration":1},{"duration":0}]
+    values = [[0],[1],[2],[1],[0]]
+    reduced = reduce_frames(frames,values,[0.01])
+    assert [frame["duration"] for frame in reduced] == [2,2,0]
+
+def test_reduce_frames_keeps_display_changes():
+    frames = [{"duration":1},{"duration":1},{"duration":0}]
+    reduced = reduce_frames(frames,[[0],[0],[0]],[1.0],displays=[0,1,1])
+    assert len(reduced) == 3
+
+def test_reduce_ffd_frames_checks_all_vertices():
+    ### the second vertex moves linearly, the fourth one leaves the line on the third keyframe
+    vertices = [[0,0,0,0],[0,1,0,0],[0,2,0,5],[0,3,0,0],[0,4,0,0]]
+    frames = [{"duration":1,"vertices":v} for v in vertices[:-1]] + [{"duration":0,"vertices":vertices[-1]}]
+    reduced = export_utils.reduce_ffd_frames(frames,{"ffd":1.0})
+    assert [frame["vertices"] for frame in reduced] == [vertices[0],vertices[1],vertices[2],vertices[3],vertices[4]]
+    
+    frames = [{"duration":1,"vertices":[0,i]} for i in range(4)] + [{"duration":0}]
+    reduced = export_utils.reduce_ffd_frames(frames,{"ffd":0.5})
+    assert [frame.get("vertices") for frame in reduced] == [[0,0],[0,3],None]
+    assert json.dumps([frame["duration"] for frame in reduced]) == "[3, 1, 0]"
+
+
+### mesh data
+### a strip of two quads. vertex 6 is not used by any face and the loops of the second quad come first
+def make_quad_strip():
+    edges = [(0,1),(1,2),(3,4),(4,5),(0,3),(1,4),(2,5)]
+    loops = [(1,1),(2,6),(5,3),(4,5),(0,0),(1,5),(4,2),(3,4)]
+    uvs = [(0.9,0.9),(1.0,1.0),(1.0,0.0),(0.5,0.0),(0.0,1.0),(0.5,1.0),(0.5,0.0),(0.0,0.0)]
+    uv_layer = SimpleNamespace(data=Collection(SimpleNamespace(uv=uv) for uv in uvs))
+    return SimpleNamespace(vertices=[None]*7,edges=Collection(SimpleNamespace(vertices=edge) for edge in edges),
+        polygons=Collection([SimpleNamespace(loop_start=4,loop_total=4),SimpleNamespace(loop_start=0,loop_total=4)]),
+        loops=Collection(SimpleNamespace(vertex_index=vert,edge_index=edge) for vert,edge in loops),uv_layers=SimpleNamespace(active=uv_layer))
+
+def test_mesh_loops_are_read_in_polygon_order():
+    mesh_data = get_mesh_arrays(make_quad_strip())
+    assert get_triangle_data(mesh_data) == [0,1,4,3,1,2,5,4]
+
+def test_edge_data_of_a_quad_strip_only_has_boundary_edges():
+    edges = get_edge_data(get_mesh_arrays(make_quad_strip()))
+    pairs = [tuple(edges[i:i+2]) for i in range(0,len(edges),2)]
+    assert sorted(pairs) == [(0,1),(0,3),(1,2),(2,5),(3,4),(4,5)]
+
+def test_uv_data_uses_the_first_loop_of_each_vertex():
+    uvs = get_uv_data(get_mesh_arrays(make_quad_strip()))
+    assert len(uvs) == 14
+    ### vertex 1 is used by both quads. its first loop in polygon order belongs to the first quad, not the first loop in the loop array
+    assert uvs[2:4] == pytest.approx([0.5,0.0])
+    assert uvs[4:6] == pytest.approx([1.0,0.0])
+    ### vertices without loops get a zero uv
+    assert uvs[12:14] == pytest.approx([0.0,1.0])
+
+def test_uv_data_without_uv_layer():
+    mesh = make_quad_strip()
+    mesh.uv_layers.active = None
+    assert get_uv_data(get_mesh_arrays(mesh)) == [0.0,1.0]*7
+
+def test_convert_vertex_data():
+    assert convert_vertex_data([(0.014,5.0,-0.5),(-1.259,0.0,0.021)]) == [1,50,-125,-2]
+
+
+### atlas packing
+def assert_packed(sizes,positions,width,height,padding=0):
+    rects = [(x,y,w,h) for (w,h),(x,y) in zip(sizes,positions)]
+    for i,(x,y,w,h) in enumerate(rects):
+        assert x >= 0 and y >= 0 and x+w <= width and y+h <= height
+        for x2,y2,w2,h2 in rects[i+1:]:
+            assert x+w+padding <= x2 or x2+w2+padding <= x or y+h+padding <= y2 or y2+h2+padding <= y
+
+def test_pack_rects_places_rects_without_overlap():
+    sizes = [(64,32),(32,32),(16,64),(48,16),(8,8),(30,20)]
+    positions = pack_rects(sizes,128,128,padding=2)
+    assert positions != None
+    assert_packed(sizes,positions,128,128,padding=2)
+
+def test_pack_rects_fails_if_rects_do_not_fit():
+    assert pack_rects([(64,64)]*4 + [(1,1)],128,128) == None
+
+def test_pack_rect_pages_spills_into_new_pages():
+    sizes = [(100,100)]*5
+    positions,page_count = pack_rect_pages(sizes,200,200)
+    assert page_count == 2
+    for page in range(page_count):
+        page_sizes = [size for size,pos in zip(sizes,positions) if pos[0] == page]
+        assert_packed(page_sizes,[pos[1:] for pos in positions if pos[0] == page],200,200)
+    assert pack_rect_pages([(300,10)],200,200) == None
+
+def test_fit_page_size_picks_smallest_power_of_two():
+    width,height,positions = fit_page_size([(60,60),(60,60)],1024,1024,0)
+    assert width*height == 128*64
+    assert_packed([(60,60),(60,60)],positions,width,height)
+
+def test_get_trim_bounds_keeps_uv_bounds():
+    pixels = np.zeros((10,20,4),dtype=np.float32)
+    pixels[2:5,3:8,3] = 1
+    assert get_trim_bounds(pixels,None) == (3,2,8,5)
+    assert get_trim_bounds(pixels,(0.0,0.0,0.5,1.0)) == (0,0,10,10)
+
+
+### fingerprint hashes of the incremental export
+def test_update_hash_depends_on_values():
+    hashes = []
+    for values in [(1,"a"),(1,"a"),(1,"b")]:
+        data_hash = hashlib.md5()
+        update_hash(data_hash,*values)
+        hashes.append(data_hash.hexdigest())
+    assert hashes[0] == hashes[1]
+    assert hashes[0] != hashes[2]
+
+def test_update_hash_array_depends_on_collection_data():
+    def get_hash(coords):
+        data_hash = hashlib.md5()
+        update_hash_array(data_hash,Collection(SimpleNamespace(co=co) for co in coords),"co",3)
+        return data_hash.hexdigest()
+    assert get_hash([(0,0,0),(1,0,0)]) == get_hash([(0,0,0),(1,0,0)])
+    assert get_hash([(0,0,0),(1,0,0)]) != get_hash([(0,0,0),(1,0,0.5)])
+    assert get_hash([(0,0,0),(1,0,0)]) != get_hash([(0,0,0)])
+
+def test_update_action_hash_changes_with_action():
+    keyframes = [(0,0.0),(10,1.0)]
+    base = get_action_hash(make_action(keyframes))
+    assert get_action_hash(make_action(keyframes)) == base
+    assert get_action_hash(make_action([(0,0.0),(10,2.0)])) != base
+    assert get_action_hash(make_action([(0,0.0),(12,1.0)])) != base
+    assert get_action_hash(make_action(keyframes,interpolation="LINEAR")) != base
+    assert get_action_hash(make_action(keyframes,name="run")) != base
+    assert get_action_hash(None) != base
+    
+    action = make_action(keyframes)
+    action.fcurves[0].mute = True
+    assert get_action_hash(action) != base
+
+
+### incremental texture copy
+def test_sync_texture_copies_only_changed_files(tmp_path):
+    src_path = str(tmp_path/"head.png")
+    dst_dir = tmp_path/"texture"
+    dst_dir.mkdir()
+    dst_path = str(dst_dir/"head.png")
+    with open(src_path,"wb") as src_file:
+        src_file.write(b"first")
+    
+    load_texture_manifest(str(dst_dir))
+    export_utils.texture_copies[dst_path] = src_path
+    sync_textures(str(dst_dir))
+    assert open(dst_path,"rb").read() == b"first"
+    
+    ### an unchanged file is not copied again
+    load_texture_manifest(str(dst_dir))
+    assert export_utils.texture_manifest["head.png"]["hash"] == hashlib.md5(b"first").hexdigest()
+    with open(dst_path,"wb") as dst_file:
+        dst_file.write(b"xxxxx")
+    sync_texture(src_path,dst_path)
+    assert open(dst_path,"rb").read() == b"xxxxx"
+    
+    ### a changed file with the same size is copied
+    with open(src_path,"wb") as src_file:
+        src_file.write(b"other")
+    os.utime(src_path,(0,0))
+    entry = sync_texture(src_path,dst_path)
+    assert open(dst_path,"rb").read() == b"other"
+    assert entry["hash"] == hashlib.md5(b"other").hexdigest()
+
+
+### atomic export files
+def test_open_export_file_replaces_file_on_success(tmp_path):
+    filepath = str(tmp_path/"export.json")
+    with open(filepath,"w") as export_file:
+        export_file.write("old")
+    with open_export_file(filepath) as export_file:
+        export_file.write("new")
+        assert open(filepath).read() == "old"
+    assert open(filepath).read() == "new"
+    assert os.listdir(str(tmp_path)) == ["export.json"]
+
+def test_open_export_file_keeps_file_on_error(tmp_path):
+    filepath = str(tmp_path/"export.json")
+    with open(filepath,"w") as export_file:
+        export_file.write("old")
+    with pytest.raises(RuntimeError):
+        with open_export_file(filepath) as export_file:
+            export_file.write("partial")
+            raise RuntimeError("export failed")
+    assert export_file.closed
+    assert open(filepath).read() == "old"
+    assert os.listdir(str(tmp_path)) == ["export.json"]
+
+
+### export profiling
+def test_profiler_times_serialization_and_file_writes():
+    profiler = export_utils.export_profiler
+    profiler.start()
+    try:
+        with profiler.phase("skin"):
+            write_document(JsonStreamWriter(io.StringIO()))
+    finally:
+        profiler.stop()
+    assert profiler.phases["skin/serialize"][1] == 4
+    assert profiler.phases["skin/file_write"][1] == 4
+    assert "total" in profiler.phases
+
+def test_profiler_stop_is_safe_after_a_failed_export():
+    profiler = export_utils.ExportProfiler()
+    profiler.start()
+    with pytest.raises(RuntimeError):
+        try:
+            with profiler.phase("animation"):
+                raise RuntimeError("export failed")
+        finally:
+            profiler.stop()
+    assert not profiler.enabled
+    assert profiler.stack == []
+    total = profiler.phases["total"][0]
+    profiler.stop()
+    assert profiler.phases["total"][0] == total
+    
+    profiler.start()
+    assert list(profiler.phases) == []
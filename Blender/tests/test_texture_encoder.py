@@ -0,0 +1,80 @@
+import os
+import zlib
+import struct
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from texture_encoder import TextureEncoder, encode_png, get_texture_path, paeth_predictor
+
+
+def read_png(data):
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    pos = 8
+    chunks = {}
+    while pos < len(data):
+        length = struct.unpack(">I",data[pos:pos+4])[0]
+        chunk_type = data[pos+4:pos+8]
+        chunk = data[pos+8:pos+8+length]
+        assert struct.unpack(">I",data[pos+8+length:pos+12+length])[0] == zlib.crc32(data[pos+4:pos+8+length]) & 0xffffffff
+        chunks[chunk_type] = chunks.get(chunk_type,b"") + chunk
+        pos += 12+length
+    width,height = struct.unpack(">II",chunks[b"IHDR"][:8])
+    raw = np.frombuffer(zlib.decompress(chunks[b"IDAT"]),dtype=np.uint8).reshape((height,width*4+1))
+    
+    ### undo the row filters
+    rows = np.zeros((height,width*4),dtype=np.int32)
+    for y in range(height):
+        filter_type = raw[y,0]
+        for x in range(width*4):
+            a = rows[y,x-4] if x >= 4 else 0
+            b = rows[y-1,x] if y > 0 else 0
+            c = rows[y-1,x-4] if x >= 4 and y > 0 else 0
+            predictor = [0,a,b,(a+b)//2,int(paeth_predictor(np.array(a),np.array(b),np.array(c)))][filter_type]
+            rows[y,x] = (int(raw[y,x+1]) + predictor) & 0xff
+    return rows.reshape((height,width,4))
+
+@pytest.mark.parametrize("png_filter",["NONE","SUB","UP","AVERAGE","PAETH","ADAPTIVE"])
+def test_encode_png_round_trip(png_filter):
+    pixels = np.random.RandomState(0).rand(5,7,4).astype(np.float32)
+    expected = np.clip(pixels[::-1]*255 + 0.5,0,255).astype(np.uint8)
+    assert (read_png(encode_png(pixels,6,png_filter)) == expected).all()
+
+def test_get_texture_path_follows_format():
+    assert get_texture_path("sprites/head.png","WEBP") == "sprites/head.webp"
+    assert get_texture_path("sprites/head.png","PNG_PREMULTIPLIED") == "sprites/head.png"
+
+def test_texture_encoder_queues_images_with_format_extension():
+    encoder = TextureEncoder(texture_format="WEBP")
+    assert encoder.add(object(),"texture/sprites/atlas.png") == "texture/sprites/atlas.webp"
+    assert list(encoder.images) == ["texture/sprites/atlas.webp"]
+
+def make_image(width=3,height=2):
+    pixels = np.random.RandomState(1).rand(height,width,4).astype(np.float32)
+    return SimpleNamespace(pixels=pixels.ravel().tolist(),size=(width,height),packed_file=None,file_format="PNG")
+
+@pytest.mark.parametrize("texture_format,extension",[("PNG",".png"),("PNG_PREMULTIPLIED",".png")])
+def test_generated_image_resource_path_is_the_written_file(tmp_path,texture_format,extension):
+    encoder = TextureEncoder(texture_format=texture_format)
+    res_path = encoder.add_resource(make_image(),"",str(tmp_path),"head")
+    assert res_path == os.path.join(str(tmp_path),"head"+extension)
+    assert encoder.write() == [res_path]
+    assert os.path.isfile(res_path)
+
+def test_image_files_are_copied_or_encoded_under_their_file_name(tmp_path):
+    src_path = tmp_path / "src" / "arm.png"
+    src_path.parent.mkdir()
+    src_path.write_bytes(b"png data")
+    res_dir = tmp_path / "sprites"
+    res_dir.mkdir()
+    
+    encoder = TextureEncoder()
+    res_path = encoder.add_resource(make_image(),str(src_path),str(res_dir),"arm_sprite")
+    assert res_path == str(res_dir / "arm.png")
+    assert (res_dir / "arm.png").read_bytes() == b"png data"
+    assert len(encoder.images) == 0
+    
+    encoder = TextureEncoder(texture_format="PNG_PREMULTIPLIED")
+    res_path = encoder.add_resource(make_image(),str(src_path),str(res_dir),"arm_sprite")
+    assert encoder.write() == [res_path] == [str(res_dir / "arm.png")]
@@ -362,8 +362,19 @@ func import_animations(animations,owner):
 			var track = anim["keyframes"][key]
 			var idx = anim_data.add_track(Animation.TYPE_VALUE)
 			anim_data.track_set_path(idx,key)
-			for time in track:
-				var value = track[time]["value"]
+			### tracks are stored as parallel times and values arrays. older exports store a dict with one entry per key
+			var times = []
+			var values = []
+			if "times" in track:
+				times = track["times"]
+				values = track["values"]
+			else:
+				for time in track:
+					times.append(time)
+					values.append(track[time]["value"])
+			for i in range(times.size()):
+				var time = times[i]
+				var value = values[i]
 				if typeof(value) == TYPE_ARRAY:
 					if key.find("pos") != -1:
 						anim_data.track_insert_key(idx,float(time),Vector2(value[0],value[1]))